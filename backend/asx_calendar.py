@@ -0,0 +1,96 @@
+# ASX trading calendar
+# Trading days are weekdays other than ASX holidays. The normal session runs
+# 10:00-16:00 Sydney time and the closing auction finishes by about 16:12.
+# Holidays follow the ASX's rules for the national public holidays (plus the
+# NSW King's Birthday); the early closes on Christmas Eve and New Year's Eve
+# are treated as full days.
+import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+TZ = ZoneInfo("Australia/Sydney")
+OPEN = datetime.time(10, 0)
+CLOSE = datetime.time(16, 12)
+
+
+def _easter(year: int) -> datetime.date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _next_monday(day: datetime.date) -> datetime.date:
+    # Weekend holidays are observed on the following Monday
+    return day + datetime.timedelta(days=(7 - day.weekday()) % 7) if day.weekday() >= 5 else day
+
+
+@lru_cache(maxsize=None)
+def holidays(year: int) -> frozenset:
+    easter = _easter(year)
+    june = datetime.date(year, 6, 1)
+    kings_birthday = june + datetime.timedelta(days=(7 - june.weekday()) % 7 + 7)
+    christmas, boxing_day = datetime.date(year, 12, 25), datetime.date(year, 12, 26)
+    if christmas.weekday() == 5:  # Saturday: Monday and Tuesday
+        christmas, boxing_day = christmas + datetime.timedelta(days=2), boxing_day + datetime.timedelta(days=2)
+    elif christmas.weekday() == 6:  # Sunday: Boxing Day Monday, Christmas Tuesday
+        christmas = christmas + datetime.timedelta(days=2)
+    elif boxing_day.weekday() == 5:  # Boxing Day Saturday: Monday
+        boxing_day = boxing_day + datetime.timedelta(days=2)
+    days = {
+        _next_monday(datetime.date(year, 1, 1)),
+        _next_monday(datetime.date(year, 1, 26)),
+        easter - datetime.timedelta(days=2),
+        easter + datetime.timedelta(days=1),
+        datetime.date(year, 4, 25),  # Anzac Day: no substitute day
+        kings_birthday,
+        christmas,
+        boxing_day,
+    }
+    return frozenset(day for day in days if day.weekday() < 5)
+
+
+def is_trading_day(day: datetime.date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def next_trading_day(day: datetime.date) -> datetime.date:
+    """The first trading day after `day`."""
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(TZ)
+
+
+def session(day: datetime.date):
+    """(open, close) of the session on `day` as Sydney-time datetimes."""
+    return datetime.datetime.combine(day, OPEN, TZ), datetime.datetime.combine(day, CLOSE, TZ)
+
+
+def in_session(at: datetime.datetime = None, after_close: datetime.timedelta = datetime.timedelta(0)) -> bool:
+    """Whether `at` (default now) falls within a session, extended by after_close."""
+    at = (at or now()).astimezone(TZ)
+    if not is_trading_day(at.date()):
+        return False
+    open_, close = session(at.date())
+    return open_ <= at < close + after_close
+
+
+def next_open(at: datetime.datetime = None) -> datetime.datetime:
+    """Start of the first session opening after `at` (default now)."""
+    at = (at or now()).astimezone(TZ)
+    day = at.date()
+    if is_trading_day(day) and at < session(day)[0]:
+        return session(day)[0]
+    return session(next_trading_day(day))[0]
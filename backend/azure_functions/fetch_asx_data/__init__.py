@@ -1,32 +1,34 @@
 import logging
-import azure.functions as func
-import requests
 import os
-from db import SessionLocal, StockSignal
+import sys
 import datetime
 
-def main(mytimer: func.TimerRequest) -> None:
+try:
+    import azure.functions as func
+except ImportError:
+    # Running locally as a plain script (see __main__ below)
+    func = None
+
+# The sweep lives with the backend modules (db, bar_store, ml_model)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from signal_sweep import run_sweep
+
+
+def main(mytimer: "func.TimerRequest") -> None:
     utc_timestamp = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
     logging.info(f'Python timer trigger function ran at {utc_timestamp}')
 
-    # Placeholder: Fetch ASX data from an API
-    # Example: response = requests.get('https://api.example.com/asx/latest')
-    # Replace with real ASX data source and parsing logic
-    symbol = 'CBA'  # Example symbol
-    buy_signal = True
-    sell_signal = False
-    confidence = 0.80
-    timestamp = datetime.datetime.utcnow()
+    # Refresh bars for every ASX symbol, score them in one batch and
+    # bulk-write stock_signals and latest_signals
+    summary = run_sweep()
+    logging.info(f"Signal sweep: {summary['signals']} signals for {summary['symbols']} symbols, "
+                 f"{len(summary['errors'])} errors, refresh {summary['refresh_seconds']}s, "
+                 f"predict {summary['predict_seconds']}s, write {summary['write_seconds']}s")
+    for symbol, error in summary['errors'].items():
+        logging.warning(f"{symbol}: {error}")
+
 
-    # Store signal in DB
-    db = SessionLocal()
-    signal = StockSignal(
-        symbol=symbol,
-        buy_signal=int(buy_signal),
-        sell_signal=int(sell_signal),
-        confidence=confidence,
-        timestamp=timestamp
-    )
-    db.add(signal)
-    db.commit()
-    db.close()
+if __name__ == "__main__":
+    # Local run: python azure_functions/fetch_asx_data/__init__.py --stub
+    from signal_sweep import main as sweep_main
+    sweep_main()
@@ -0,0 +1,32 @@
+import logging
+import os
+import sys
+import datetime
+
+try:
+    import azure.functions as func
+except ImportError:
+    # Running locally as a plain script (see __main__ below)
+    func = None
+
+# The retention job lives with the backend modules (db, signal_history)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from signal_retention import run_retention
+
+
+def main(mytimer: "func.TimerRequest") -> None:
+    utc_timestamp = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+    logging.info(f'Python timer trigger function ran at {utc_timestamp}')
+
+    # Daily, outside ASX hours (16:30 UTC): roll stock_signals rows past the
+    # retention window into stock_signals_daily and purge expired rollups
+    summary = run_retention()
+    logging.info(f"Signal retention: {summary['rolled_up_rows']} rows before {summary['cutoff']} rolled into "
+                 f"{summary['daily_rows_written']} daily rows, {summary['purged_rollups']} rollups purged, "
+                 f"{summary['batches']} batches, rollup {summary['rollup_seconds']}s, purge {summary['purge_seconds']}s")
+
+
+if __name__ == "__main__":
+    # Local run: python azure_functions/signal_retention/__init__.py [--dry-run]
+    from signal_retention import main as retention_main
+    retention_main()
@@ -0,0 +1,522 @@
+# Cross-worker broadcast backplane
+# FanoutManager publishes every WebSocket message here, so a signal computed by
+# one uvicorn worker or replica reaches the clients connected to all of them.
+# A message is delivered to this worker's clients at once and forwarded to the
+# other workers best-effort: nothing is persisted, and messages that would
+# block (no connection, full buffer) are dropped and counted.
+#   inprocess: a single worker (default)
+#   ipc:       workers on one host, through a Unix socket hub one of them hosts
+#   redis:     workers anywhere, through Redis PUBLISH/SUBSCRIBE
+# Local Redis stand-in: python backplane.py --resp-server 6379
+# Cross-worker check:   python backplane.py --check
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import uuid
+from urllib.parse import urlparse
+
+BACKPLANE = os.getenv("BROADCAST_BACKPLANE", "inprocess")
+BACKPLANE_IPC_PATH = os.getenv("BACKPLANE_IPC_PATH", os.path.join(tempfile.gettempdir(), "anystock-backplane.sock"))
+BACKPLANE_REDIS_URL = os.getenv("BACKPLANE_REDIS_URL", "redis://localhost:6379/0")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "anystock:signals")
+# Bytes queued on a connection before further messages are dropped
+BACKPLANE_MAX_BUFFER = int(os.getenv("BACKPLANE_MAX_BUFFER_BYTES", str(4 * 1024 * 1024)))
+BACKPLANE_RECONNECT_SECONDS = float(os.getenv("BACKPLANE_RECONNECT_SECONDS", "1"))
+MAX_MESSAGE_BYTES = 1024 * 1024
+
+
+# Wire format: "<origin> <key> <text>"; workers skip their own messages
+def _encode(origin: str, key, text: str) -> bytes:
+    return f"{origin} {key or '*'} {text}".encode()
+
+
+def _decode(payload: bytes):
+    origin, key, text = payload.decode().split(" ", 2)
+    return origin, None if key == "*" else key, text
+
+
+class Backplane:
+    """In-process backplane and the interface of the cross-worker ones.
+
+    attach(handler) registers handler(key, text), called for every message
+    published by this or another worker. publish() must be called from the
+    event loop and never blocks.
+    """
+    name = "inprocess"
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex[:12]
+        self._handler = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    def attach(self, handler):
+        self._handler = handler
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+    def publish(self, key, text: str):
+        """Deliver to this worker's clients now and forward to the other workers."""
+        self.published += 1
+        self._deliver(key, text)
+        self._forward(_encode(self.origin, key, text))
+
+    def _forward(self, payload: bytes):
+        pass
+
+    def _deliver(self, key, text: str):
+        if self._handler is not None:
+            self._handler(key, text)
+
+    def _receive(self, payload: bytes):
+        origin, key, text = _decode(payload)
+        if origin == self.origin:
+            return
+        self.received += 1
+        self._deliver(key, text)
+
+    def _send(self, writer, data: bytes) -> bool:
+        # Buffered write; a missing or backed-up connection drops the message
+        if writer is None or writer.is_closing() or writer.transport.get_write_buffer_size() > BACKPLANE_MAX_BUFFER:
+            self.dropped += 1
+            return False
+        writer.write(data)
+        return True
+
+    def status(self) -> dict:
+        return {"backplane": self.name, "connected": self.connected, "published": self.published,
+                "received": self.received, "dropped": self.dropped}
+
+
+InProcessBackplane = Backplane
+
+
+async def _close_writer(writer):
+    if writer is None:
+        return
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+
+# --- Unix socket hub ---
+class UnixSocketBackplane(Backplane):
+    """Workers on one host connect to a hub socket hosted by one of them.
+
+    The first worker to find no hub listening binds the socket (under a lock
+    file, so exactly one does) and relays each worker's messages to the
+    others. When the hub's worker exits, the rest elect a new one.
+    """
+    name = "ipc"
+
+    def __init__(self, path: str = BACKPLANE_IPC_PATH):
+        super().__init__()
+        self.path = path
+        self.is_hub = False
+        self._server = None
+        self._peers = set()
+        self._writer = None
+        self._task = None
+        self._ready = None
+
+    @property
+    def connected(self) -> bool:
+        return self.is_hub or (self._writer is not None and not self._writer.is_closing())
+
+    def _elect(self):
+        """A socket connected to the hub, or a listening one if no hub answers. Blocking."""
+        import fcntl
+        import socket
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                return sock, False
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+            # Left behind by a hub that exited
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self.path)
+            sock.listen(128)
+            return sock, True
+
+    async def start(self):
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        # Messages published before the first connection would be dropped
+        try:
+            await asyncio.wait_for(self._ready.wait(), 5)
+        except asyncio.TimeoutError:
+            logging.warning("Backplane hub %s not reachable yet; retrying in the background", self.path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                sock, hub = await loop.run_in_executor(None, self._elect)
+                if hub:
+                    self._server = await asyncio.start_unix_server(self._serve_peer, sock=sock, limit=MAX_MESSAGE_BYTES)
+                    self.is_hub = True
+                    self._ready.set()
+                    logging.info("Backplane hub listening on %s", self.path)
+                    return
+                reader, self._writer = await asyncio.open_unix_connection(sock=sock, limit=MAX_MESSAGE_BYTES)
+                self._ready.set()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._receive(line.rstrip(b"\n"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Backplane connection to %s failed: %r", self.path, e)
+            await _close_writer(self._writer)
+            self._writer = None
+            await asyncio.sleep(BACKPLANE_RECONNECT_SECONDS)
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._receive(line.rstrip(b"\n"))
+                for peer in list(self._peers):
+                    if peer is not writer:
+                        self._send(peer, line)
+        except (ConnectionError, ValueError) as e:
+            logging.info("Backplane peer dropped: %r", e)
+        finally:
+            self._peers.discard(writer)
+            await _close_writer(writer)
+
+    def _forward(self, payload: bytes):
+        line = payload + b"\n"
+        if self.is_hub:
+            for peer in list(self._peers):
+                self._send(peer, line)
+        else:
+            self._send(self._writer, line)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            self.is_hub = False
+            # The remaining workers elect a new hub once their connection drops
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        for writer in list(self._peers) + [self._writer]:
+            await _close_writer(writer)
+        self._peers.clear()
+        self._writer = None
+
+
+# --- Redis ---
+class RespError(Exception):
+    pass
+
+
+def _bulk(arg) -> bytes:
+    arg = arg if isinstance(arg, bytes) else str(arg).encode()
+    return b"$%d\r\n%s\r\n" % (len(arg), arg)
+
+
+def resp_command(*args) -> bytes:
+    """A RESP array of bulk strings."""
+    return b"*%d\r\n" % len(args) + b"".join(_bulk(arg) for arg in args)
+
+
+async def read_resp(reader):
+    """Read one RESP reply; errors are returned as RespError instances."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(rest)
+        return None if length < 0 else [await read_resp(reader) for _ in range(length)]
+    raise RespError(f"unexpected reply {line!r}")
+
+
+class RedisBackplane(Backplane):
+    """PUBLISH on one connection, SUBSCRIBE on another; reconnects on failure.
+
+    Speaks RESP over asyncio streams, so it needs no client library and works
+    with any Redis-compatible server, including RespServer below.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = BACKPLANE_REDIS_URL, channel: str = BACKPLANE_CHANNEL):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.channel = channel
+        self._writer = None
+        self._sub_writer = None
+        self._subscribed = False
+        self._tasks = []
+        self._ready = None
+
+    @property
+    def connected(self) -> bool:
+        return self._subscribed and self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_MESSAGE_BYTES)
+        if self.password:
+            writer.write(resp_command("AUTH", self.password))
+            reply = await read_resp(reader)
+            if isinstance(reply, RespError):
+                await _close_writer(writer)
+                raise reply
+        return reader, writer
+
+    async def start(self):
+        self._ready = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run_publisher()), loop.create_task(self._run_subscriber())]
+        try:
+            await asyncio.wait_for(self._ready.wait(), 5)
+        except asyncio.TimeoutError:
+            logging.warning("Redis backplane %s:%s not reachable yet; retrying in the background", self.host, self.port)
+
+    async def _run_publisher(self):
+        while True:
+            try:
+                reader, self._writer = await self._connect()
+                self._check_ready()
+                # PUBLISH replies (receiver counts) are read and discarded
+                while True:
+                    reply = await read_resp(reader)
+                    if isinstance(reply, RespError):
+                        logging.warning("Redis backplane PUBLISH failed: %s", reply)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Redis backplane publisher connection failed: %r", e)
+            await _close_writer(self._writer)
+            self._writer = None
+            await asyncio.sleep(BACKPLANE_RECONNECT_SECONDS)
+
+    async def _run_subscriber(self):
+        while True:
+            try:
+                reader, self._sub_writer = await self._connect()
+                self._sub_writer.write(resp_command("SUBSCRIBE", self.channel))
+                while True:
+                    reply = await read_resp(reader)
+                    if isinstance(reply, RespError):
+                        raise reply
+                    if not isinstance(reply, list) or not reply:
+                        continue
+                    kind = reply[0]
+                    if kind == b"subscribe":
+                        self._subscribed = True
+                        self._check_ready()
+                    elif kind == b"message" and reply[1].decode() == self.channel:
+                        self._receive(reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Redis backplane subscriber connection failed: %r", e)
+            finally:
+                self._subscribed = False
+            await _close_writer(self._sub_writer)
+            self._sub_writer = None
+            await asyncio.sleep(BACKPLANE_RECONNECT_SECONDS)
+
+    def _check_ready(self):
+        if self.connected:
+            self._ready.set()
+
+    def _forward(self, payload: bytes):
+        self._send(self._writer, resp_command("PUBLISH", self.channel, payload))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for writer in (self._writer, self._sub_writer):
+            await _close_writer(writer)
+        self._writer = self._sub_writer = None
+        self._subscribed = False
+
+
+class RespServer:
+    """Minimal Redis stand-in: PING, AUTH, SELECT, PUBLISH, SUBSCRIBE and UNSUBSCRIBE."""
+
+    def __init__(self):
+        self.channels = {}
+        self._clients = {}  # writer -> connection task
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 6379):
+        self._server = await asyncio.start_server(self._serve, host, port, limit=MAX_MESSAGE_BYTES)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            tasks = list(self._clients.values())
+            for writer in list(self._clients):
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        subscribed = set()
+        self._clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                command = await read_resp(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR expected a command array\r\n")
+                    continue
+                name, args = command[0].upper(), command[1:]
+                if name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name in (b"AUTH", b"SELECT"):
+                    writer.write(b"+OK\r\n")
+                elif name == b"PUBLISH" and len(args) == 2:
+                    channel = args[0].decode()
+                    message = resp_command("message", channel, args[1])
+                    subscribers = list(self.channels.get(channel, ()))
+                    for subscriber in subscribers:
+                        subscriber.write(message)
+                    writer.write(b":%d\r\n" % len(subscribers))
+                elif name == b"SUBSCRIBE" and args:
+                    for channel in (a.decode() for a in args):
+                        subscribed.add(channel)
+                        self.channels.setdefault(channel, set()).add(writer)
+                        writer.write(b"*3\r\n" + _bulk("subscribe") + _bulk(channel) + b":%d\r\n" % len(subscribed))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in [a.decode() for a in args] or list(subscribed):
+                        subscribed.discard(channel)
+                        self.channels.get(channel, set()).discard(writer)
+                        writer.write(b"*3\r\n" + _bulk("unsubscribe") + _bulk(channel) + b":%d\r\n" % len(subscribed))
+                elif name == b"QUIT":
+                    writer.write(b"+OK\r\n")
+                    break
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % name)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            self._clients.pop(writer, None)
+            await _close_writer(writer)
+
+
+BACKPLANES = {"inprocess": InProcessBackplane, "ipc": UnixSocketBackplane, "redis": RedisBackplane}
+
+
+def create_backplane(kind: str = BACKPLANE) -> Backplane:
+    if kind not in BACKPLANES:
+        raise ValueError(f"Unknown BROADCAST_BACKPLANE '{kind}'; expected one of {', '.join(BACKPLANES)}")
+    return BACKPLANES[kind]()
+
+
+# --- Check ---
+async def _check_delivery(backplanes, settle: float = 0.2) -> dict:
+    """Publish one message from each backplane; every one must receive all of them once."""
+    received = {i: [] for i in range(len(backplanes))}
+    for i, backplane in enumerate(backplanes):
+        backplane.attach(lambda key, text, i=i: received[i].append((key, text)))
+    for i, backplane in enumerate(backplanes):
+        backplane.publish(f"SYM{i}.AX", '{"from":%d}' % i)
+    await asyncio.sleep(settle)
+    expected = sorted((f"SYM{i}.AX", '{"from":%d}' % i) for i in range(len(backplanes)))
+    return {i: sorted(messages) == expected for i, messages in received.items()}
+
+
+async def check(workers: int = 3) -> dict:
+    """Cross-worker delivery over the Unix socket hub (including hub failover) and the RESP stand-in."""
+    results = {}
+    path = os.path.join(tempfile.mkdtemp(), "backplane.sock")
+    ipc = [UnixSocketBackplane(path) for _ in range(workers)]
+    for backplane in ipc:
+        await backplane.start()
+    results["ipc"] = await _check_delivery(ipc)
+    # The hub's worker exits; the others must elect a new hub and keep delivering
+    hub = next(b for b in ipc if b.is_hub)
+    await hub.close()
+    rest = [b for b in ipc if b is not hub]
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if sum(b.is_hub for b in rest) == 1 and all(b.connected for b in rest):
+            break
+    results["ipc_failover"] = await _check_delivery(rest)
+    for backplane in rest:
+        await backplane.close()
+
+    server = RespServer()
+    port = await server.start(port=0)
+    redis = [RedisBackplane(f"redis://127.0.0.1:{port}/0") for _ in range(workers)]
+    for backplane in redis:
+        await backplane.start()
+    results["redis"] = await _check_delivery(redis)
+    for backplane in redis:
+        await backplane.close()
+    await server.close()
+    return {name: all(ok.values()) for name, ok in results.items()}
+
+
+async def _serve_resp(port: int):
+    server = RespServer()
+    port = await server.start("127.0.0.1", port)
+    print(f"RESP stand-in listening on 127.0.0.1:{port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Broadcast backplane utilities")
+    parser.add_argument('--resp-server', type=int, metavar='PORT', help="run the local Redis stand-in")
+    parser.add_argument('--check', action='store_true', help="check cross-worker delivery for every backplane")
+    args = parser.parse_args(argv)
+    if args.resp_server is not None:
+        asyncio.run(_serve_resp(args.resp_server))
+    elif args.check:
+        results = asyncio.run(check())
+        print(results)
+        return results
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
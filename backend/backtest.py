@@ -0,0 +1,301 @@
+# Vectorized cross-symbol backtest
+# Prices and signals are (date x symbol) matrices built from the bar store that
+# generate_training_data.py reads. Every holding period and signal threshold
+# is evaluated for every symbol at once: signals are stacked on a threshold
+# axis and positions for all holding periods come from one cumulative sum.
+#
+#   python backtest.py --signals ma_diff --holding 1,5,10,20 --thresholds 0.005,0.01,0.02
+#   python backtest.py --signals model --thresholds 0,0.5,0.6
+import argparse
+import datetime
+import json
+
+import numpy as np
+
+from features import FEATURE_COLS, WARMUP_BARS, compute_features
+
+PERIODS_PER_YEAR = 252
+DEFAULT_HOLDING_PERIODS = (1, 5, 10, 20)
+# ma_diff is ma_5 - ma_20 in price units; 0.01 is the serving fallback (ml_model._ma_diff_label)
+DEFAULT_MA_DIFF_THRESHOLDS = (0.005, 0.01, 0.02, 0.05)
+# Minimum model confidence to act on a buy/sell label; 0 reproduces /predict
+DEFAULT_CONFIDENCE_THRESHOLDS = (0.0, 0.4, 0.5, 0.6)
+
+
+class MarketData:
+    """Aligned (date x symbol) close and feature matrices; NaN where a symbol has no bar."""
+
+    def __init__(self, dates, symbols, close, features):
+        self.dates = dates
+        self.symbols = symbols
+        self.close = close
+        self.features = features
+
+    @property
+    def shape(self):
+        return self.close.shape
+
+
+def load_market_data(symbols=None, start=None, end=None, store=None) -> MarketData:
+    """Read stored bars for every symbol and align them on the union of their dates.
+
+    Features are computed on each symbol's own bar sequence (as in training) and
+    are NaN for the first WARMUP_BARS bars, where rolling windows are not full.
+    """
+    from bar_store import store as default_store
+    from data_providers import load_asx_symbols
+    store = store or default_store
+    symbols = list(dict.fromkeys(symbols or load_asx_symbols()))
+    bars = {symbol: store.read(symbol, start, end) for symbol in symbols}
+    bars = {symbol: b for symbol, b in bars.items() if len(b)}
+    symbols = list(bars)
+    timestamps = np.unique(np.concatenate([np.asarray(b.timestamp) for b in bars.values()])) \
+        if bars else np.empty(0, dtype=np.int64)
+    close = np.full((len(timestamps), len(symbols)), np.nan)
+    features = np.full((len(timestamps), len(symbols), len(FEATURE_COLS)), np.nan)
+    for j, b in enumerate(bars.values()):
+        rows = np.searchsorted(timestamps, np.asarray(b.timestamp))
+        close[rows, j] = b.close
+        feats = compute_features(b.close, b.volume)
+        feats[:WARMUP_BARS] = np.nan
+        features[rows, j] = feats
+    return MarketData(timestamps.astype('datetime64[s]'), symbols, close, features)
+
+
+# --- Signals: (thresholds, dates, symbols) int8 in {-1, 0, 1} ---
+def ma_diff_signals(data: MarketData, thresholds=DEFAULT_MA_DIFF_THRESHOLDS) -> np.ndarray:
+    ma_diff = data.features[:, :, FEATURE_COLS.index('ma_diff')]
+    t = np.asarray(thresholds, dtype=np.float64)[:, None, None]
+    with np.errstate(invalid='ignore'):
+        signals = np.where(ma_diff > t, 1, np.where(ma_diff < -t, -1, 0))
+    return signals.astype(np.int8)
+
+
+def model_signals(data: MarketData, thresholds=DEFAULT_CONFIDENCE_THRESHOLDS, loaded=None) -> np.ndarray:
+    """Labels from one predict_proba call over every (date, symbol) row; held when confidence < threshold."""
+    if loaded is None:
+        from model_registry import registry
+        loaded = registry.get()
+        if loaded is None:
+            raise LookupError("No trained model available")
+    T, S, F = data.features.shape
+    flat = data.features.reshape(T * S, F)
+    valid = np.isfinite(flat).all(axis=1)
+    labels = np.zeros(T * S, dtype=np.int8)
+    confidence = np.zeros(T * S)
+    if valid.any():
+        l, c = loaded.predict_label(flat[valid].astype(np.float32))
+        labels[valid], confidence[valid] = l, c
+    t = np.asarray(thresholds, dtype=np.float64)[:, None]
+    signals = np.where(confidence[None, :] >= t, labels[None, :], 0)
+    return signals.reshape(len(thresholds), T, S).astype(np.int8)
+
+
+# --- Engine ---
+def _forward_fill(x):
+    """Forward-fill NaNs down each column."""
+    idx = np.where(np.isnan(x), 0, np.arange(len(x))[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return x[idx, np.arange(x.shape[1])[None, :]]
+
+
+def daily_returns(close) -> np.ndarray:
+    """Close-to-close returns; 0 on a symbol's missing dates and before its first bar."""
+    filled = _forward_fill(close)
+    r = np.zeros_like(filled)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r[1:] = filled[1:] / filled[:-1] - 1
+    r[~np.isfinite(r)] = 0
+    return r
+
+
+def positions(signals, holding_periods) -> np.ndarray:
+    """(holding, threshold, date, symbol) positions.
+
+    A signal at date t's close is held for the next h dates; overlapping signals
+    are h equal tranches, so the position at t is the mean signal of t-h..t-1.
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    K, T, S = signals.shape
+    cs = np.zeros((K, T + 1, S))
+    np.cumsum(signals, axis=1, out=cs[:, 1:])
+    h = np.asarray(holding_periods)
+    hi = np.arange(T)
+    lo = np.maximum(hi[None, :] - h[:, None], 0)   # (H, T)
+    pos = (cs[:, hi][:, None] - cs[:, lo]) / h[None, :, None, None]  # (K, H, T, S)
+    return pos.transpose(1, 0, 2, 3)
+
+
+def _metrics(pnl, pos, axis):
+    """Performance of daily returns pnl along `axis` (the date axis)."""
+    n = pnl.shape[axis]
+    log_growth = np.log1p(pnl).sum(axis=axis)
+    equity = np.exp(np.cumsum(np.log1p(pnl), axis=axis))
+    drawdown = 1 - equity / np.maximum.accumulate(equity, axis=axis)
+    mean, std = pnl.mean(axis=axis), pnl.std(axis=axis)
+    active = pos != 0
+    n_active = active.sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.where(std > 0, mean / std * np.sqrt(PERIODS_PER_YEAR), 0.0)
+        hit_rate = np.where(n_active > 0, ((pnl > 0) & active).sum(axis=axis) / n_active, np.nan)
+    turnover = np.abs(np.diff(pos, axis=axis, prepend=0)).mean(axis=axis) * PERIODS_PER_YEAR
+    return {
+        "total_return": np.expm1(log_growth),
+        "annual_return": np.expm1(log_growth * PERIODS_PER_YEAR / max(n, 1)),
+        "annual_volatility": std * np.sqrt(PERIODS_PER_YEAR),
+        "sharpe": sharpe,
+        "max_drawdown": drawdown.max(axis=axis),
+        "hit_rate": hit_rate,
+        "annual_turnover": turnover,
+        "exposure": active.mean(axis=axis),
+    }
+
+
+class BacktestResult:
+    def __init__(self, holding_periods, thresholds, symbols, per_symbol, portfolio, dates):
+        self.holding_periods = list(holding_periods)
+        self.thresholds = list(thresholds)
+        self.symbols = list(symbols)
+        self.per_symbol = per_symbol    # metric -> (holding, threshold, symbol)
+        self.portfolio = portfolio      # metric -> (holding, threshold)
+        self.dates = dates
+
+    def table(self) -> list:
+        """One row per (holding period, threshold) with the equal-weight portfolio's metrics."""
+        rows = []
+        for i, h in enumerate(self.holding_periods):
+            for k, t in enumerate(self.thresholds):
+                rows.append({"holding": h, "threshold": t,
+                             **{m: float(v[i, k]) for m, v in self.portfolio.items()}})
+        return rows
+
+    def to_dict(self) -> dict:
+        return {
+            "start": str(self.dates[0]) if len(self.dates) else None,
+            "end": str(self.dates[-1]) if len(self.dates) else None,
+            "holding_periods": self.holding_periods,
+            "thresholds": self.thresholds,
+            "symbols": self.symbols,
+            "portfolio": self.table(),
+            "per_symbol": {m: np.where(np.isfinite(v), v, None).tolist() for m, v in self.per_symbol.items()},
+        }
+
+
+def run_backtest(close, signals, holding_periods=DEFAULT_HOLDING_PERIODS, thresholds=None,
+                 cost_bps: float = 10.0, symbols=None, dates=None) -> BacktestResult:
+    """Backtest (threshold, date, symbol) signals against a (date, symbol) close matrix.
+
+    cost_bps is charged on every unit of position change.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    signals = np.asarray(signals)
+    if signals.ndim == 2:
+        signals = signals[None]
+    listed = np.isfinite(_forward_fill(close))  # from a symbol's first bar on
+    signals = np.where(listed[None], signals, 0)
+    r = daily_returns(close)
+    pos = positions(signals, holding_periods)                 # (H, K, T, S)
+    trades = np.abs(np.diff(pos, axis=2, prepend=0))
+    pnl = pos * r[None, None] - trades * cost_bps / 10_000
+    per_symbol = _metrics(pnl, pos, axis=2)
+    # Equal weight across the symbols listed on each date
+    n_listed = np.maximum(listed.sum(axis=1), 1)
+    port_pnl = pnl.sum(axis=3) / n_listed
+    port_pos = pos.sum(axis=3) / n_listed
+    portfolio = _metrics(port_pnl, port_pos, axis=2)
+    thresholds = list(thresholds) if thresholds is not None else list(range(signals.shape[0]))
+    return BacktestResult(holding_periods, thresholds, symbols or list(range(close.shape[1])),
+                          per_symbol, portfolio, dates if dates is not None else np.arange(close.shape[0]))
+
+
+def backtest(signals: str = "ma_diff", holding_periods=DEFAULT_HOLDING_PERIODS, thresholds=None,
+             cost_bps: float = 10.0, symbols=None, start=None, end=None, store=None) -> BacktestResult:
+    """Load stored bars, build ma_diff or model signals and run every combination."""
+    data = load_market_data(symbols, start, end, store)
+    if not len(data.dates):
+        raise LookupError(f"No stored bars{f' since {start}' if start else ''} to backtest; fill the bar store "
+                          f"first (e.g. python generate_training_data.py)")
+    if signals == "ma_diff":
+        thresholds = thresholds or DEFAULT_MA_DIFF_THRESHOLDS
+        matrix = ma_diff_signals(data, thresholds)
+    elif signals == "model":
+        thresholds = thresholds or DEFAULT_CONFIDENCE_THRESHOLDS
+        matrix = model_signals(data, thresholds)
+    else:
+        raise ValueError(f"Unknown signal source '{signals}'")
+    return run_backtest(data.close, matrix, holding_periods, thresholds, cost_bps, data.symbols, data.dates)
+
+
+# --- Check against a straightforward loop ---
+def _loop_reference(close, signals, h, cost_bps):
+    """Per-symbol, per-day loop over a single (date, symbol) signal matrix."""
+    T, S = close.shape
+    pnl = np.zeros((T, S))
+    for j in range(S):
+        prev_close, prev_pos, listed = np.nan, 0.0, False
+        for t in range(T):
+            listed = listed or np.isfinite(close[t, j])
+            window = [signals[k, j] if listed_k else 0 for k, listed_k in
+                      ((k, np.isfinite(close[:k + 1, j]).any()) for k in range(max(t - h, 0), t))]
+            pos = sum(window) / h
+            r = 0.0
+            if np.isfinite(close[t, j]):
+                if np.isfinite(prev_close):
+                    r = close[t, j] / prev_close - 1
+                prev_close = close[t, j]
+            pnl[t, j] = pos * r - abs(pos - prev_pos) * cost_bps / 10_000
+            prev_pos = pos
+    return pnl
+
+
+def check_against_loop(T=120, S=6, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (T, S)), axis=0))
+    close[:rng.integers(0, 30), 0] = np.nan   # listed late
+    close[rng.integers(0, T, 10), rng.integers(0, S, 10)] = np.nan  # missing bars
+    signals = rng.integers(-1, 2, (2, T, S))
+    result = run_backtest(close, signals, holding_periods=(1, 3, 7), cost_bps=5)
+    for i, h in enumerate((1, 3, 7)):
+        for k in range(2):
+            pnl = _loop_reference(close, signals[k], h, 5)
+            expected = np.expm1(np.log1p(pnl).sum(axis=0))
+            np.testing.assert_allclose(result.per_symbol["total_return"][i, k], expected, rtol=1e-10, atol=1e-12)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest signals over the stored bars for every symbol")
+    parser.add_argument('--signals', choices=('ma_diff', 'model'), default='ma_diff')
+    parser.add_argument('--holding', default=','.join(map(str, DEFAULT_HOLDING_PERIODS)),
+                        help="comma-separated holding periods in bars")
+    parser.add_argument('--thresholds', help="comma-separated ma_diff or confidence thresholds")
+    parser.add_argument('--cost-bps', type=float, default=10.0, help="cost per unit of position change")
+    parser.add_argument('--years', type=float, default=5, help="history to backtest over")
+    parser.add_argument('--output', help="write the full result as JSON")
+    parser.add_argument('--check', action='store_true', help="compare the engine against a plain loop and exit")
+    args = parser.parse_args(argv)
+    if args.check:
+        check_against_loop()
+        print("Vectorized backtest matches the loop reference.")
+        return
+    start = datetime.date.today() - datetime.timedelta(days=int(args.years * 365))
+    thresholds = [float(t) for t in args.thresholds.split(',')] if args.thresholds else None
+    try:
+        result = backtest(args.signals, [int(h) for h in args.holding.split(',')], thresholds, args.cost_bps,
+                          start=start)
+    except LookupError as e:
+        parser.exit(1, f"{e}\n")
+    print(f"{len(result.symbols)} symbols, {result.dates[0]} to {result.dates[-1]}")
+    print(f"{'holding':>7} {'threshold':>9} {'return':>8} {'annual':>8} {'sharpe':>7} {'max_dd':>7} "
+          f"{'hit':>6} {'turnover':>8} {'exposure':>8}")
+    for row in result.table():
+        print(f"{row['holding']:>7} {row['threshold']:>9} {row['total_return']:>8.2%} {row['annual_return']:>8.2%} "
+              f"{row['sharpe']:>7.2f} {row['max_drawdown']:>7.2%} {row['hit_rate']:>6.2%} "
+              f"{row['annual_turnover']:>8.1f} {row['exposure']:>8.2%}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result.to_dict(), f)
+
+
+if __name__ == "__main__":
+    main()
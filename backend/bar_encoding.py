@@ -0,0 +1,99 @@
+# Response encodings for OHLCV bars served by /history
+# "json" keeps the original list of per-bar objects; the other formats are
+# columnar (one array per field, epoch-second timestamps, float32 prices).
+# msgpack and arrow need the msgpack and pyarrow packages (requirements.txt);
+# Accept negotiation skips a format whose package is missing.
+import importlib.util
+import json
+import math
+
+import numpy as np
+
+FORMATS = {
+    "json": "application/json",
+    "columnar": "application/vnd.anystock.columnar+json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# Accept header media types mapped to formats, in order of preference
+ACCEPT_TYPES = {
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.anystock.columnar+json": "columnar",
+    "application/json": "json",
+}
+# Formats that need an optional package
+FORMAT_MODULES = {"msgpack": "msgpack", "arrow": "pyarrow"}
+PRICE_FIELDS = ("open", "high", "low", "close")
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def available(fmt: str) -> bool:
+    module = FORMAT_MODULES.get(fmt)
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def negotiate(format_param: str = None, accept: str = None) -> str:
+    """Pick a format from ?format= first, then the Accept header (skipping formats this server can't encode), defaulting to json."""
+    if format_param:
+        if format_param not in FORMATS:
+            raise UnsupportedFormat(f"Unknown format '{format_param}', expected one of {sorted(FORMATS)}")
+        return format_param
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in ACCEPT_TYPES and available(ACCEPT_TYPES[media_type]):
+            return ACCEPT_TYPES[media_type]
+    return "json"
+
+
+def _columns(bars):
+    cols = {"timestamp": np.asarray(bars.timestamp, dtype=np.int64)}
+    for field in PRICE_FIELDS:
+        cols[field] = np.asarray(getattr(bars, field), dtype=np.float32)
+    cols["volume"] = np.nan_to_num(np.asarray(bars.volume)).astype(np.int64)
+    return cols
+
+
+def _json_array(arr) -> str:
+    if arr.dtype.kind == "f":
+        # str() of a float32 is its shortest round-trip repr
+        return "[" + ",".join(str(x) if math.isfinite(x) else "null" for x in arr) + "]"
+    return json.dumps(arr.tolist(), separators=(",", ":"))
+
+
+def encode(bars, symbol: str, fmt: str) -> bytes:
+    if fmt == "json":
+        return json.dumps({"symbol": symbol, "history": bars.to_records()}).encode()
+    cols = _columns(bars)
+    if fmt == "columnar":
+        fields = ",".join(f'"{name}":{_json_array(arr)}' for name, arr in cols.items())
+        return ('{"symbol":%s,%s}' % (json.dumps(symbol), fields)).encode()
+    if fmt == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise UnsupportedFormat("msgpack is not installed on this server")
+        # Columns travel as little-endian typed-array buffers
+        return msgpack.packb({
+            "symbol": symbol,
+            "dtypes": {name: arr.dtype.str for name, arr in cols.items()},
+            "columns": {name: arr.astype(arr.dtype.newbyteorder("<")).tobytes() for name, arr in cols.items()},
+        })
+    if fmt == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise UnsupportedFormat("pyarrow is not installed on this server")
+        table = pa.table({
+            "timestamp": pa.array(cols["timestamp"].astype("datetime64[s]")),
+            **{name: pa.array(arr) for name, arr in cols.items() if name != "timestamp"},
+        }).replace_schema_metadata({"symbol": symbol})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise UnsupportedFormat(f"Unknown format '{fmt}'")
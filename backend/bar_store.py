@@ -0,0 +1,306 @@
+# Local on-disk OHLCV bar store
+# Each symbol is a directory of raw little-endian column files (timestamp as
+# int64 epoch seconds of the bar date, OHLCV as float64) that are memory-mapped
+# for reads and only ever appended to. meta.json records the committed row
+# count, so a torn append is ignored until the metadata is rewritten. A rewrite
+# of the last (still forming) bar writes a new generation of column files and
+# switches meta.json to it, so readers never see a mix of old and new columns.
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from data_providers import get_default_provider, to_ticker
+from metrics import stage
+
+BAR_STORE_PATH = os.getenv("BAR_STORE_PATH", os.path.join(os.path.dirname(__file__), 'bar_store'))
+# Minimum seconds between provider refreshes of the same symbol
+BAR_STORE_MAX_AGE = float(os.getenv("BAR_STORE_MAX_AGE_SECONDS", "900"))
+# History fetched the first time a symbol is requested
+DEFAULT_HISTORY_DAYS = int(os.getenv("BAR_STORE_HISTORY_DAYS", str(5 * 365 + 7)))
+
+COLUMNS = {
+    'timestamp': np.dtype('<i8'),
+    'open': np.dtype('<f8'),
+    'high': np.dtype('<f8'),
+    'low': np.dtype('<f8'),
+    'close': np.dtype('<f8'),
+    'volume': np.dtype('<f8'),
+}
+
+
+def to_epoch(value) -> int:
+    """Epoch seconds for a date/datetime/string bar date (UTC midnight for dates)."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+class Bars:
+    """Column arrays for a contiguous range of one symbol's bars."""
+
+    def __init__(self, symbol: str, columns: dict, updated_at: float = None):
+        self.symbol = symbol
+        # Last write to the store when these bars were read
+        self.updated_at = updated_at
+        self.timestamp = columns['timestamp']
+        self.open = columns['open']
+        self.high = columns['high']
+        self.low = columns['low']
+        self.close = columns['close']
+        self.volume = columns['volume']
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def empty(self):
+        return len(self.timestamp) == 0
+
+    def _slice(self, s):
+        return Bars(self.symbol, {name: getattr(self, name)[s] for name in COLUMNS}, self.updated_at)
+
+    def tail(self, n: int):
+        return self._slice(slice(max(len(self) - n, 0), None))
+
+    def dates(self):
+        return self.timestamp.astype('datetime64[s]')
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame({
+            'Open': np.asarray(self.open),
+            'High': np.asarray(self.high),
+            'Low': np.asarray(self.low),
+            'Close': np.asarray(self.close),
+            'Volume': np.asarray(self.volume),
+        }, index=pd.DatetimeIndex(self.dates(), name='Date'))
+
+    def to_records(self):
+        return [
+            {
+                "timestamp": ts.isoformat(),
+                "open": float(o),
+                "high": float(h),
+                "low": float(lo),
+                "close": float(c),
+                "volume": float(v),
+            }
+            for ts, o, h, lo, c, v in zip(self.dates().tolist(), self.open, self.high,
+                                          self.low, self.close, self.volume)
+        ]
+
+
+class BarStore:
+    def __init__(self, root: str = BAR_STORE_PATH, provider=None, max_age: float = BAR_STORE_MAX_AGE):
+        self.root = root
+        self.provider = provider
+        self.max_age = max_age
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._maps = {}
+        # Called with the symbol after bars are written (e.g. cache invalidation)
+        self._listeners = []
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    # --- Layout ---
+    def _dir(self, symbol: str) -> str:
+        return os.path.join(self.root, to_ticker(symbol))
+
+    def _lock(self, symbol: str):
+        with self._locks_guard:
+            return self._locks.setdefault(to_ticker(symbol), threading.Lock())
+
+    def _read_meta(self, symbol: str) -> dict:
+        try:
+            with open(os.path.join(self._dir(symbol), 'meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"rows": 0, "fetched_at": 0}
+
+    def _path(self, symbol: str, name: str, generation: int = 0) -> str:
+        return os.path.join(self._dir(symbol), f"{name}.{generation}" if generation else name)
+
+    def _remove_stale(self, symbol: str, generation: int):
+        # Files of earlier generations; a file still mapped elsewhere (Windows) is left for a later rewrite
+        current = {os.path.basename(self._path(symbol, name, generation)) for name in COLUMNS}
+        for fname in os.listdir(self._dir(symbol)):
+            if fname.partition('.')[0] in COLUMNS and fname not in current:
+                try:
+                    os.remove(os.path.join(self._dir(symbol), fname))
+                except OSError:
+                    pass
+
+    def _write_meta(self, symbol: str, meta: dict):
+        path = os.path.join(self._dir(symbol), 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def _columns(self, symbol: str, meta: dict) -> dict:
+        key = to_ticker(symbol)
+        version = (meta["rows"], meta.get("generation", 0))
+        cached = self._maps.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rows, generation = version
+        if rows == 0:
+            cols = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        else:
+            cols = {
+                name: np.memmap(self._path(symbol, name, generation), dtype=dtype, mode='r', shape=(rows,))
+                for name, dtype in COLUMNS.items()
+            }
+        self._maps[key] = (version, cols)
+        return cols
+
+    def _snapshot(self, symbol: str):
+        """(meta, columns) of the current generation."""
+        while True:
+            meta = self._read_meta(symbol)
+            try:
+                return meta, self._columns(symbol, meta)
+            except FileNotFoundError:
+                # A rewrite replaced the generation after meta.json was read
+                continue
+
+    # --- Reads ---
+    def read(self, symbol: str, start=None, end=None) -> Bars:
+        """Bars with start <= date < end, as read-only memory-mapped slices."""
+        meta, cols = self._snapshot(symbol)
+        ts = cols['timestamp']
+        lo = int(np.searchsorted(ts, to_epoch(start), 'left')) if start is not None else 0
+        hi = int(np.searchsorted(ts, to_epoch(end), 'left')) if end is not None else len(ts)
+        return Bars(symbol, {name: arr[lo:hi] for name, arr in cols.items()}, meta.get("updated_at"))
+
+    def last_timestamp(self, symbol: str):
+        cols = self._snapshot(symbol)[1]
+        return int(cols['timestamp'][-1]) if len(cols['timestamp']) else None
+
+    def updated_at(self, symbol: str):
+        """Epoch seconds of the last write to the symbol's bars, or None if never written."""
+        return self._read_meta(symbol).get("updated_at")
+
+    # --- Writes ---
+    def append(self, symbol: str, df) -> int:
+        """Append bars newer than the stored ones; a bar for the last stored date replaces it.
+
+        Returns the number of rows written.
+        """
+        with self._lock(symbol):
+            written = self._append_locked(symbol, df)
+        self._notify(symbol, written)
+        return written
+
+    def _append_locked(self, symbol: str, df) -> int:
+        # Caller holds the symbol's lock
+        if df is None or df.empty:
+            return 0
+        ts = (df.index.values.astype('datetime64[s]').astype(np.int64))
+        new = {
+            'timestamp': ts,
+            'open': df['Open'].to_numpy(np.float64),
+            'high': df['High'].to_numpy(np.float64),
+            'low': df['Low'].to_numpy(np.float64),
+            'close': df['Close'].to_numpy(np.float64),
+            'volume': df['Volume'].to_numpy(np.float64),
+        }
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        meta = self._read_meta(symbol)
+        rows = meta["rows"]
+        last = self.last_timestamp(symbol)
+        keep = ts >= last if last is not None else np.ones(len(ts), dtype=bool)
+        if not keep.any():
+            return 0
+        # Rewriting the last stored bar covers a still-forming daily bar
+        offset = rows - 1 if last is not None and ts[keep][0] == last else rows
+        generation = meta.get("generation", 0)
+        if offset < rows:
+            stored = self._columns(symbol, meta)
+            if keep.sum() == 1 and all(stored[name][-1] == new[name][keep][0] for name in COLUMNS):
+                return 0  # unchanged
+            # Copy into a new generation: readers mapping the current files keep a consistent snapshot
+            generation += 1
+            for name, dtype in COLUMNS.items():
+                with open(self._path(symbol, name, generation), 'wb') as f:
+                    f.write(np.ascontiguousarray(stored[name][:offset]).tobytes())
+                    f.write(np.ascontiguousarray(new[name][keep], dtype=dtype).tobytes())
+        else:
+            for name, dtype in COLUMNS.items():
+                path = self._path(symbol, name, generation)
+                with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                    f.seek(offset * dtype.itemsize)
+                    f.write(np.ascontiguousarray(new[name][keep], dtype=dtype).tobytes())
+        # Publish the row count (and generation) only after every column is written
+        meta["rows"] = offset + int(keep.sum())
+        meta["generation"] = generation
+        meta["updated_at"] = time.time()
+        self._write_meta(symbol, meta)
+        if offset < rows:
+            self._remove_stale(symbol, generation)
+        return int(keep.sum())
+
+    def _notify(self, symbol: str, written: int):
+        if written:
+            for listener in self._listeners:
+                listener(symbol)
+
+    # --- Provider refresh ---
+    def _provider(self):
+        if self.provider is None:
+            self.provider = get_default_provider()
+        return self.provider
+
+    def refresh(self, symbol: str, force: bool = False) -> int:
+        """Fill the gap since the last stored bar from the provider. Returns rows written.
+
+        The staleness check and the fetch run under the symbol's lock, so
+        concurrent callers for one symbol fetch from the provider once.
+        """
+        with self._lock(symbol):
+            meta = self._read_meta(symbol)
+            if not force and time.time() - meta.get("fetched_at", 0) < self.max_age:
+                return 0
+            last = self.last_timestamp(symbol)
+            if last is None:
+                start = datetime.date.today() - datetime.timedelta(days=DEFAULT_HISTORY_DAYS)
+            else:
+                start = datetime.datetime.fromtimestamp(last, datetime.timezone.utc).date()
+            provider = self._provider()
+            with stage("fetch"):
+                df = provider.fetch(to_ticker(symbol), start)
+            with stage("bar_append"):
+                written = self._append_locked(symbol, df)
+            meta = self._read_meta(symbol)
+            if meta["rows"] or written:
+                meta["fetched_at"] = time.time()
+                if not df.empty:
+                    meta["provider"] = df.attrs.get('provider', provider.name)
+                self._write_meta(symbol, meta)
+        self._notify(symbol, written)
+        return written
+
+    def get_bars(self, symbol: str, start=None, end=None, refresh: bool = True) -> Bars:
+        """Range read, refreshing from the provider first if the stored bars are stale."""
+        if refresh:
+            try:
+                self.refresh(symbol)
+            except Exception as e:
+                # Serve whatever is stored when the provider is unavailable
+                logging.warning("%s: bar refresh failed: %s", to_ticker(symbol), e)
+        return self.read(symbol, start, end)
+
+
+store = BarStore()
@@ -0,0 +1,445 @@
+# Offline benchmark suite for the serving and training hot paths
+# Everything runs in a scratch directory against deterministic synthetic bars
+# (data_providers.StubProvider): bar store, SQLite database, training dataset
+# and model. Results are written as JSON so runs can be compared across commits.
+#
+#   python benchmarks.py [--quick] [--only predict,features] [--output results.json]
+#   python benchmarks.py --compare old.json new.json
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED = 0
+# stock_signals rows for /signal_history are written under their own symbol
+HISTORY_SYMBOL = 'BENCH'
+
+
+def _configure(workdir: str):
+    """Point every module at the scratch directory; must run before they are imported."""
+    for module in ('db', 'bar_store', 'model_registry', 'training_dataset', 'main'):
+        if module in sys.modules:
+            raise RuntimeError(f"{module} was imported before the benchmark environment was set up")
+    os.environ.pop('AZURE_SQL_CONNECTION_STRING', None)
+    os.environ.update({
+        'BAR_PROVIDER': 'stub',
+        'BAR_STORE_PATH': os.path.join(workdir, 'bar_store'),
+        'SQLITE_DB_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'MODEL_PATH': os.path.join(workdir, 'best_model.pkl'),
+        'TRAINING_DATASET_PATH': os.path.join(workdir, 'training_data'),
+    })
+
+
+def _percentiles(samples) -> dict:
+    samples = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+class Context:
+    def __init__(self, workdir: str, quick: bool):
+        from data_providers import load_asx_symbols
+        self.workdir = workdir
+        self.quick = quick
+        self.symbols = list(dict.fromkeys(load_asx_symbols()))
+        self._prepared = False
+
+    def prepare(self):
+        """Fill the bar store for every symbol and train a small model on it (once)."""
+        if self._prepared:
+            return
+        from bar_store import store
+        from data_providers import StubProvider
+        from db import Base, engine
+        Base.metadata.create_all(bind=engine)
+        store.provider = StubProvider(seed=SEED)
+        for symbol in self.symbols:
+            store.refresh(symbol, force=True)
+        self._train_small_model()
+        self._prepared = True
+
+    def _train_small_model(self):
+        import joblib
+        from sklearn.ensemble import RandomForestClassifier
+        from bar_store import store
+        from generate_training_data import symbol_rows
+        from training_dataset import LABEL_PENDING
+        X, y = [], []
+        for symbol in self.symbols:
+            _, features, labels, _ = symbol_rows(store.read(symbol), 50)
+            keep = np.isfinite(features).all(axis=1) & (labels != LABEL_PENDING)
+            X.append(features[keep])
+            y.append(labels[keep])
+        model = RandomForestClassifier(n_estimators=50, max_depth=5, random_state=SEED, n_jobs=-1)
+        model.fit(np.vstack(X), np.concatenate(y))
+        joblib.dump(model, os.environ['MODEL_PATH'])
+
+
+# --- /predict ---
+async def _drive(client, path_for, n_requests: int, concurrency: int):
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.get(path_for(i))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path_for(i)} returned {response.status_code}: {response.text}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def bench_predict(ctx: Context) -> dict:
+    """/predict latency and throughput through the ASGI app: computed, from the prediction cache and from latest_signals."""
+    import httpx
+    import main
+    from bar_store import store
+    from prediction_cache import cache
+    from signal_sweep import run_sweep
+    from signal_writer import writer
+    ctx.prepare()
+    n_requests = 300 if ctx.quick else 3000
+    concurrency = 16
+    symbols = ctx.symbols
+    path_for = lambda i: f"/predict?symbol={symbols[i % len(symbols)]}"
+    # The store was just filled, so requests never wait on the provider
+    store.max_age = 1e9
+
+    async def run():
+        writer.start()
+        results = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            main.LATEST_SIGNAL_MAX_AGE = -1
+            cache.enabled = False
+            await _drive(client, path_for, len(symbols), concurrency)  # warm-up: model load, page cache
+            latencies, elapsed = await _drive(client, path_for, n_requests, concurrency)
+            results["on_demand"] = {**_percentiles(latencies), "throughput_rps": n_requests / elapsed}
+            cache.enabled = True
+            await _drive(client, path_for, len(symbols), concurrency)  # fill the cache
+            latencies, elapsed = await _drive(client, path_for, n_requests, concurrency)
+            results["prediction_cache"] = {**_percentiles(latencies), "throughput_rps": n_requests / elapsed,
+                                           "hit_ratio": cache.stats()["hit_ratio"]}
+            main.LATEST_SIGNAL_MAX_AGE = 1e9
+            await main.run_blocking(run_sweep, symbols, store)
+            latencies, elapsed = await _drive(client, path_for, n_requests, concurrency)
+            results["latest_signals"] = {**_percentiles(latencies), "throughput_rps": n_requests / elapsed}
+        await main.run_blocking(writer.close)
+        return results
+
+    try:
+        return {"concurrency": concurrency, "symbols": len(symbols), **asyncio.run(run())}
+    finally:
+        main.LATEST_SIGNAL_MAX_AGE = float(os.getenv("LATEST_SIGNAL_MAX_AGE_SECONDS", "600"))
+        cache.enabled = True
+
+
+# --- Feature computation ---
+def _rate(fn, units: int, repeats: int) -> float:
+    """Best-of-repeats units per second."""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return units / best
+
+
+def bench_features(ctx: Context) -> dict:
+    """Rows per second of the serving (ml_model) and training (generate_training_data) feature paths."""
+    from bar_store import store
+    from features import WARMUP_BARS, FeatureState, FeatureStates, latest_features
+    from generate_training_data import symbol_rows
+    from ml_model import predict_buy_sell_batch
+    ctx.prepare()
+    repeats = 3 if ctx.quick else 10
+    bars = {symbol: store.read(symbol) for symbol in ctx.symbols}
+    windows = {s: (np.asarray(b.close[-WARMUP_BARS - 1:]), np.asarray(b.volume[-WARMUP_BARS - 1:]))
+               for s, b in bars.items()}
+    stamped = {s: (*windows[s], np.asarray(b.timestamp[-WARMUP_BARS - 1:])) for s, b in bars.items()}
+    history_rows = sum(len(b) for b in bars.values())
+    kept = FeatureStates()
+
+    def incremental():
+        for b in bars.values():
+            state = FeatureState()
+            for c, v in zip(b.close.tolist(), b.volume.tolist()):
+                state.update(c, v)
+
+    return {
+        "symbols": len(bars),
+        "history_rows": history_rows,
+        "ml_model_latest_rows_per_sec": _rate(
+            lambda: [latest_features(c, v) for c, v in windows.values()], len(windows), repeats),
+        # Serving with the rolling state kept between calls (the first repeat builds it)
+        "ml_model_latest_kept_state_rows_per_sec": _rate(
+            lambda: [kept.latest(s, t, c, v) for s, (c, v, t) in stamped.items()], len(stamped), repeats),
+        "ml_model_predict_batch_symbols_per_sec": _rate(
+            lambda: predict_buy_sell_batch(windows), len(windows), repeats),
+        "training_rows_per_sec": _rate(
+            lambda: [symbol_rows(b, 0) for b in bars.values()], history_rows, repeats),
+        "incremental_rows_per_sec": _rate(incremental, history_rows, 1),
+    }
+
+
+# --- /signal_history ---
+def bench_signal_history(ctx: Context) -> dict:
+    """First-page latency and a full keyset walk as stock_signals grows."""
+    from fastapi.testclient import TestClient
+    import main
+    import signal_history
+    from db import SessionLocal, StockSignal, session_scope
+    ctx.prepare()
+    sizes = (1_000, 10_000) if ctx.quick else (1_000, 10_000, 100_000)
+    rng = np.random.default_rng(SEED)
+    other = ctx.symbols
+    start = datetime.datetime(2020, 1, 1)
+    results = []
+    inserted = 0
+    with TestClient(main.app) as client:
+        for size in sizes:
+            # Grow HISTORY_SYMBOL to `size` rows, with four rows for other symbols per row
+            n = size - inserted
+            rows = []
+            for i in range(n):
+                ts = start + datetime.timedelta(minutes=5 * (inserted + i))
+                for symbol in [HISTORY_SYMBOL] + [other[j] for j in rng.integers(0, len(other), 4)]:
+                    rows.append(dict(symbol=symbol, buy_signal=0, sell_signal=0, hold_signal=1,
+                                     confidence=0.5, timestamp=ts, current_price=100.0, open_price=100.0,
+                                     high_price=101.0, low_price=99.0))
+            with session_scope() as db:
+                db.execute(StockSignal.__table__.insert(), rows)
+            inserted = size
+
+            timings = []
+            for _ in range(5 if ctx.quick else 20):
+                started = time.perf_counter()
+                response = client.get("/signal_history", params={"symbol": HISTORY_SYMBOL, "limit": 500})
+                timings.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                cursor, walked = None, 0
+                while True:
+                    page, cursor = signal_history.fetch_page(db, HISTORY_SYMBOL, signal_history.MAX_PAGE_SIZE, cursor)
+                    walked += len(page)
+                    if cursor is None:
+                        break
+            finally:
+                db.close()
+            walk = time.perf_counter() - started
+
+            started = time.perf_counter()
+            export = client.get("/signal_history", params={"symbol": HISTORY_SYMBOL, "format": "ndjson"})
+            export_seconds = time.perf_counter() - started
+
+            results.append({
+                "symbol_rows": size,
+                "table_rows": size * 5,
+                "first_page": _percentiles(timings),
+                "walk_all_pages_seconds": walk,
+                "walked_rows": walked,
+                "ndjson_export_seconds": export_seconds,
+                "ndjson_rows": export.text.count("\n"),
+            })
+    return {"sizes": results}
+
+
+# --- WebSocket fan-out ---
+class _BenchSocket:
+    """Stands in for a WebSocket: accepts and counts messages."""
+
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += 1
+
+    async def close(self):
+        pass
+
+
+def bench_ws_fanout(ctx: Context) -> dict:
+    """Time to queue broadcasts and to drain them to N subscribed clients."""
+    from ws_fanout import FanoutManager
+    client_counts = (10, 100, 1000) if ctx.quick else (10, 100, 1000, 5000)
+    n_messages = 200
+    symbols = ctx.symbols
+
+    async def run(n_clients):
+        manager = FanoutManager(policy='drop_oldest', max_queue=n_messages)
+        sockets = [_BenchSocket() for _ in range(n_clients)]
+        for i, ws in enumerate(sockets):
+            # Half the clients take everything, the rest follow a few symbols
+            await manager.connect(ws, None if i % 2 == 0 else symbols[i % len(symbols):][:5])
+        messages = [{"symbol": symbols[i % len(symbols)], "buy_signal": True, "confidence": 0.5, "i": i}
+                    for i in range(n_messages)]
+        started = time.perf_counter()
+        for message in messages:
+            manager.broadcast(message)
+        queued = time.perf_counter() - started
+        while any(manager.queue_depths()):
+            await asyncio.sleep(0)
+        drained = time.perf_counter() - started
+        for client in list(manager.clients):
+            manager.disconnect(client)
+        await asyncio.sleep(0)
+        return {
+            "clients": n_clients,
+            "messages": n_messages,
+            "delivered": sum(ws.received for ws in sockets),
+            "broadcast_us_per_message": queued / n_messages * 1e6,
+            "drain_seconds": drained,
+        }
+
+    return {"runs": [asyncio.run(run(n)) for n in client_counts]}
+
+
+# --- Training ---
+def bench_train(ctx: Context) -> dict:
+    """End-to-end dataset build and train_model.py run."""
+    import generate_training_data
+    generate_training_data.MANIFEST_PATH = os.path.join(ctx.workdir, 'training_manifest.json')
+    started = time.perf_counter()
+    generate_training_data.main(['--fresh'])
+    dataset_seconds = time.perf_counter() - started
+
+    budget = '20' if ctx.quick else '300'
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, 'train_model.py'), '--skip-data',
+                    '--budget-seconds', budget], cwd=ctx.workdir, check=True, stdout=subprocess.DEVNULL)
+    train_seconds = time.perf_counter() - started
+    with open(os.path.join(ctx.workdir, 'model_search_report.json')) as f:
+        report = json.load(f)
+    from training_dataset import load_dataset
+    return {
+        "dataset_rows": len(load_dataset()),
+        "dataset_seconds": dataset_seconds,
+        "train_seconds": train_seconds,
+        "budget_seconds": float(budget),
+        "evaluations": len(report["evaluations"]),
+        "best": report["best"],
+        "test_accuracy": report.get("test_accuracy"),
+    }
+
+
+BENCHMARKS = {
+    "features": bench_features,
+    "predict": bench_predict,
+    "signal_history": bench_signal_history,
+    "ws_fanout": bench_ws_fanout,
+    "train": bench_train,
+}
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'], cwd=BACKEND_DIR, capture_output=True,
+                                    text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(names, quick: bool = False, workdir: str = None) -> dict:
+    workdir = workdir or tempfile.mkdtemp(prefix='anystock-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    _configure(workdir)
+    ctx = Context(workdir, quick)
+    commit, dirty = _git_commit()
+    results = {}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        started = time.perf_counter()
+        results[name] = BENCHMARKS[name](ctx)
+        results[name]["elapsed_seconds"] = time.perf_counter() - started
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": quick,
+        "workdir": workdir,
+        "results": results,
+    }
+
+
+# --- Comparing runs ---
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from _flatten(item, f"{prefix}[{i}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(old_path: str, new_path: str):
+    """Print every numeric result side by side with the new/old ratio."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"old: {old.get('commit')}  new: {new.get('commit')}")
+    old_values = dict(_flatten(old["results"]))
+    for key, value in _flatten(new["results"]):
+        if key in old_values:
+            ratio = value / old_values[key] if old_values[key] else float('nan')
+            print(f"{key:70s} {old_values[key]:14.4f} {value:14.4f} {ratio:8.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks against synthetic data")
+    parser.add_argument('--only', help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes and shorter training budget")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the JSON results")
+    parser.add_argument('--workdir', help="scratch directory (default: a new temporary directory)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = run(names, quick=args.quick, workdir=args.workdir)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Async helpers for the request path
+# A bounded executor for blocking I/O and CPU work, single-flight coalescing of
+# identical in-flight computations, and fire-and-forget tasks that are kept
+# alive until they finish.
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", str(min(8, (os.cpu_count() or 1) + 4))))
+
+executor = ThreadPoolExecutor(max_workers=PREDICT_WORKERS, thread_name_prefix="predict")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking callable on the bounded executor, in a copy of the caller's context."""
+    loop = asyncio.get_running_loop()
+    # Context variables (e.g. the request's stage timings) follow the work into the thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        """Await fn() for key, or join the call already running for it."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # Shield so one cancelled caller doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+_background = set()
+
+
+def spawn(coro):
+    """Schedule coro on the running loop and keep a reference until it completes."""
+    task = asyncio.get_running_loop().create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_finish)
+    return task
+
+
+def _finish(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Background task failed", exc_info=task.exception())
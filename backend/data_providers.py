@@ -0,0 +1,279 @@
+# Pluggable OHLCV data providers used to fill the local bar store
+# Each provider returns a DataFrame indexed by bar date (tz-naive) with
+# Open, High, Low, Close and Volume columns, or an empty DataFrame.
+import datetime
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (if present)
+load_dotenv()
+
+ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+EODHD_API_KEY = os.getenv('EODHD_API_KEY')
+
+OHLCV_COLS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# ASX symbols shipped with the frontend
+ASX_SYMBOLS_PATH = os.path.join(os.path.dirname(__file__), '../frontend/public/asx_symbols.json')
+
+
+# Ticker suffix per market. US tickers carry EODHD's .US suffix so a bare
+# symbol keeps meaning ASX; Yahoo and Alpha Vantage get it stripped.
+MARKET_SUFFIXES = {'ASX': '.AX', 'US': '.US'}
+DEFAULT_MARKET = 'ASX'
+# Tickers double as bar store directory names: letters, digits and dots only
+TICKER_PATTERN = re.compile(r'[A-Z0-9][A-Z0-9.]{0,9}')
+
+
+def to_ticker(symbol: str, market: str = None) -> str:
+    """Store/provider ticker for symbol on market (default ASX); already suffixed tickers are unchanged.
+
+    Raises ValueError for anything that isn't a plain ticker (e.g. a path).
+    """
+    ticker = symbol.strip().upper()
+    if not ticker.endswith(tuple(MARKET_SUFFIXES.values())):
+        market = (market or DEFAULT_MARKET).upper()
+        if market not in MARKET_SUFFIXES:
+            raise ValueError(f"Unknown market '{market}'; expected one of {', '.join(MARKET_SUFFIXES)}")
+        ticker += MARKET_SUFFIXES[market]
+    if not TICKER_PATTERN.fullmatch(ticker):
+        raise ValueError(f"Invalid symbol '{symbol}'")
+    return ticker
+
+
+def to_symbol(ticker: str) -> str:
+    """Inverse of to_ticker for the default market: the symbol /predict and stock_signals use (CBA.AX -> CBA, AAPL.US unchanged)."""
+    suffix = MARKET_SUFFIXES[DEFAULT_MARKET]
+    return ticker[:-len(suffix)] if ticker.endswith(suffix) else ticker
+
+
+def _us_symbol(ticker: str, class_separator: str = '.') -> str:
+    # AAPL.US -> AAPL; share classes like BRK.B use the provider's separator
+    if not ticker.endswith(MARKET_SUFFIXES['US']):
+        return ticker
+    return ticker[:-len(MARKET_SUFFIXES['US'])].replace('.', class_separator)
+
+
+def load_asx_symbols(path: str = ASX_SYMBOLS_PATH) -> list:
+    import json
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _empty_frame():
+    return pd.DataFrame(columns=OHLCV_COLS, index=pd.DatetimeIndex([], name='Date'), dtype=float)
+
+
+def _normalize(df):
+    """Return a sorted, de-duplicated OHLCV frame indexed by tz-naive bar date."""
+    if df is None or df.empty:
+        return _empty_frame()
+    # Flatten MultiIndex columns if present (e.g., ('Close', 'WTC.AX') -> 'Close')
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = [col[0] for col in df.columns]
+    df = df[OHLCV_COLS].astype(float)
+    idx = pd.DatetimeIndex(df.index)
+    if idx.tz is not None:
+        idx = idx.tz_localize(None)
+    df.index = idx.normalize().rename('Date')
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    return df.dropna(subset=['Close'])
+
+
+class BarProvider:
+    name = 'base'
+
+    def fetch(self, ticker: str, start: datetime.date, end: datetime.date = None):
+        """Return daily bars for ticker with start <= date (< end when given)."""
+        raise NotImplementedError
+
+
+class YFinanceProvider(BarProvider):
+    name = 'yfinance'
+
+    def fetch(self, ticker, start, end=None):
+        import yfinance as yf
+        data = yf.Ticker(_us_symbol(ticker, '-')).history(start=start, end=end, interval='1d')
+        return _normalize(data)
+
+
+class AlphaVantageProvider(BarProvider):
+    name = 'alphavantage'
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or ALPHA_VANTAGE_API_KEY
+
+    def fetch(self, ticker, start, end=None):
+        # The compact output holds the latest 100 bars, enough for incremental updates
+        recent = (datetime.date.today() - start).days < 100
+        av_url = (f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={_us_symbol(ticker)}'
+                  f'&outputsize={"compact" if recent else "full"}&apikey={self.api_key}')
+        av_json = requests.get(av_url, timeout=30).json()
+        if 'Time Series (Daily)' not in av_json:
+            return _empty_frame()
+        av_df = pd.DataFrame.from_dict(av_json['Time Series (Daily)'], orient='index')
+        av_df = av_df.rename(columns={
+            '1. open': 'Open',
+            '2. high': 'High',
+            '3. low': 'Low',
+            '4. close': 'Close',
+            '6. volume': 'Volume',
+        })
+        av_df.index = pd.to_datetime(av_df.index)
+        av_df = _normalize(av_df)
+        av_df = av_df[av_df.index >= pd.Timestamp(start)]
+        return av_df[av_df.index < pd.Timestamp(end)] if end else av_df
+
+
+class EODHDProvider(BarProvider):
+    name = 'eodhd'
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or EODHD_API_KEY
+
+    def fetch(self, ticker, start, end=None):
+        eod_url = f'https://eodhistoricaldata.com/api/eod/{ticker}?fmt=json&api_token={self.api_key}&period=d&from={start.isoformat()}'
+        if end:
+            eod_url += f'&to={end.isoformat()}'
+        eod_resp = requests.get(eod_url, timeout=30)
+        if eod_resp.status_code != 200:
+            return _empty_frame()
+        eod_json = eod_resp.json()
+        if not isinstance(eod_json, list) or not eod_json:
+            return _empty_frame()
+        eod_df = pd.DataFrame(eod_json).rename(columns={
+            'open': 'Open',
+            'high': 'High',
+            'low': 'Low',
+            'close': 'Close',
+            'volume': 'Volume',
+        })
+        eod_df.index = pd.to_datetime(eod_df['date'])
+        return _normalize(eod_df)
+
+
+class RateLimiter:
+    """Thread-safe token bucket: at most `rate` acquisitions per second after a burst."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedProvider(BarProvider):
+    """Wrap a provider with a per-provider rate limit and retry with exponential backoff."""
+
+    def __init__(self, provider: BarProvider, rate: float, burst: int = 1,
+                 retries: int = 3, backoff: float = 1.0):
+        self.provider = provider
+        self.name = provider.name
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(self, ticker, start, end=None):
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                return self.provider.fetch(ticker, start, end)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+class FallbackProvider(BarProvider):
+    """Try each provider in turn until one returns bars."""
+    name = 'fallback'
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+
+    def fetch(self, ticker, start, end=None):
+        for provider in self.providers:
+            try:
+                df = provider.fetch(ticker, start, end)
+            except Exception as e:
+                logging.warning("%s: %s failed: %s", ticker, provider.name, e)
+                continue
+            if not df.empty:
+                # Record which provider served the bars
+                df.attrs['provider'] = provider.name
+                return df
+        return _empty_frame()
+
+
+def synthetic_bars(ticker: str, start: datetime.date, end: datetime.date, seed: int = 0):
+    """Deterministic random-walk OHLCV bars for business days in [start, end)."""
+    import numpy as np
+    # Anchor every symbol's walk at a fixed date so overlapping ranges agree
+    anchor = pd.Timestamp('2000-01-03')
+    dates = pd.bdate_range(anchor, pd.Timestamp(end) - pd.Timedelta(days=1), name='Date')
+    digest = hashlib.sha256(f'{ticker}:{seed}'.encode()).digest()
+    base = int.from_bytes(digest[:8], 'little')
+    # One stream per field so a bar's values don't depend on the range length
+    rngs = [np.random.default_rng([base, k]) for k in range(6)]
+    n = len(dates)
+    close = (10 + rngs[0].random() * 90) * np.exp(np.cumsum(rngs[1].normal(0.0002, 0.015, n)))
+    open_ = close * np.exp(rngs[2].normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rngs[3].normal(0, 0.006, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rngs[4].normal(0, 0.006, n)))
+    volume = rngs[5].integers(100_000, 5_000_000, n).astype(float)
+    df = pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}, index=dates)
+    return df.loc[pd.Timestamp(start):]
+
+
+class StubProvider(BarProvider):
+    """Offline provider serving deterministic synthetic bars (local runs and benchmarks)."""
+    name = 'stub'
+
+    def __init__(self, seed: int = 0, today: datetime.date = None, latency: float = 0.0):
+        self.seed = seed
+        self.today = today
+        # Seconds slept per fetch to stand in for a remote provider's round trip
+        self.latency = latency
+        self.calls = 0
+
+    def fetch(self, ticker, start, end=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        today = self.today or datetime.date.today()
+        end = min(end, today + datetime.timedelta(days=1)) if end else today + datetime.timedelta(days=1)
+        return synthetic_bars(ticker, start, end, self.seed)
+
+
+def get_default_provider() -> BarProvider:
+    """Provider selected by BAR_PROVIDER: 'stub', or the yfinance -> Alpha Vantage -> EODHD chain."""
+    if os.getenv('BAR_PROVIDER', '').lower() == 'stub':
+        return StubProvider(latency=float(os.getenv('STUB_PROVIDER_LATENCY_SECONDS', '0')))
+    return FallbackProvider([
+        RateLimitedProvider(YFinanceProvider(), float(os.getenv('YFINANCE_RATE_PER_SEC', '2')), burst=4),
+        # Alpha Vantage's free tier allows 5 requests per minute
+        RateLimitedProvider(AlphaVantageProvider(), float(os.getenv('ALPHA_VANTAGE_RATE_PER_SEC', '0.08'))),
+        RateLimitedProvider(EODHDProvider(), float(os.getenv('EODHD_RATE_PER_SEC', '5')), burst=5),
+    ])
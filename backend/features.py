@@ -0,0 +1,363 @@
+# Shared feature engine for serving (ml_model) and training (generate_training_data)
+# Batch mode works on NumPy arrays with cumulative-sum rolling windows; incremental
+# mode keeps O(1) rolling state per symbol and updates it one bar at a time.
+# Serving keeps that state between predictions (FeatureStates): bars that have a
+# successor are final and committed once, the still-forming last bar is only
+# peeked at.
+import os
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+FEATURE_COLS = [
+    'pct_change', 'ma_5', 'ma_10', 'ma_20', 'ma_50',
+    'bb_upper', 'bb_lower', 'rsi', 'vol_pct_change', 'ma_diff'
+]
+MA_WINDOWS = (5, 10, 20, 50)
+BB_WINDOW = 20
+RSI_WINDOW = 14
+# Bars needed before every rolling window is full
+WARMUP_BARS = max(MA_WINDOWS)
+# Symbols whose rolling state is kept between predictions
+FEATURE_STATE_CACHE_SIZE = int(os.getenv("FEATURE_STATE_CACHE_SIZE", "5000"))
+# Running sums are recomputed from the window after this many pushes to bound drift
+RESYNC_EVERY = 1000
+
+
+# --- Batch mode ---
+def _pct_change(x):
+    out = np.zeros_like(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[1:] = x[1:] / x[:-1] - 1
+    out[np.isnan(out)] = 0
+    return out
+
+
+def _rolling_sum(x, window):
+    c = np.cumsum(x)
+    out = c[window - 1:].copy()
+    out[1:] -= c[:-window]
+    return out
+
+
+def _finite_windows(x, window):
+    # False for windows that contain a NaN, which pandas leaves NaN (and the callers fill)
+    return _rolling_sum(np.isnan(x).astype(np.int64), window) == 0
+
+
+def _centered(x):
+    # Shift by the mean of the finite values so long cumulative sums don't lose
+    # precision; NaNs become 0 so they only affect the windows that contain them
+    finite = np.isfinite(x)
+    offset = x[finite].mean() if finite.any() else 0.0
+    return np.where(finite, x - offset, 0.0), offset
+
+
+def _rolling_mean(x, window, fill):
+    out = fill.copy()
+    if len(x) >= window:
+        centered, offset = _centered(x)
+        mean = _rolling_sum(centered, window) / window + offset
+        out[window - 1:] = np.where(_finite_windows(x, window), mean, fill[window - 1:])
+    return out
+
+
+def _rolling_std(x, window):
+    out = np.zeros_like(x)
+    if len(x) >= window:
+        centered, _ = _centered(x)
+        s = _rolling_sum(centered, window)
+        sq = _rolling_sum(centered * centered, window)
+        var = (sq - s * s / window) / (window - 1)
+        out[window - 1:] = np.where(_finite_windows(x, window), np.sqrt(np.maximum(var, 0)), 0.0)
+    return out
+
+
+def compute_features(close, volume) -> np.ndarray:
+    """Return an (n, len(FEATURE_COLS)) float64 feature matrix for one symbol's bars."""
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    ma = {w: _rolling_mean(close, w, close) for w in MA_WINDOWS}
+    bb_std = _rolling_std(close, BB_WINDOW)
+    delta = np.zeros_like(close)
+    delta[1:] = np.diff(close)
+    zeros = np.zeros_like(close)
+    gain = _rolling_mean(np.where(delta > 0, delta, 0), RSI_WINDOW, zeros)
+    loss = _rolling_mean(np.where(delta < 0, -delta, 0), RSI_WINDOW, zeros)
+    rsi = 100 - 100 / (1 + gain / (loss + 1e-6))
+    out = np.empty((len(close), len(FEATURE_COLS)))
+    out[:, 0] = _pct_change(close)
+    out[:, 1] = ma[5]
+    out[:, 2] = ma[10]
+    out[:, 3] = ma[20]
+    out[:, 4] = ma[50]
+    out[:, 5] = ma[BB_WINDOW] + 2 * bb_std
+    out[:, 6] = ma[BB_WINDOW] - 2 * bb_std
+    out[:, 7] = rsi
+    out[:, 8] = _pct_change(volume)
+    out[:, 9] = ma[5] - ma[20]
+    return out
+
+
+def latest_features(close, volume, symbol: str = None, timestamps=None) -> np.ndarray:
+    """Feature row for the last bar, computed from the trailing warm-up window only.
+
+    With symbol and bar timestamps the symbol's kept rolling state is advanced
+    instead of being rebuilt (see FeatureStates).
+    """
+    if symbol is not None and timestamps is not None:
+        return states.latest(symbol, timestamps, close, volume)
+    close = np.asarray(close, dtype=np.float64)[-(WARMUP_BARS + 1):]
+    volume = np.asarray(volume, dtype=np.float64)[-(WARMUP_BARS + 1):]
+    if len(close) > WARMUP_BARS:
+        return FeatureState.from_history(close, volume).row()
+    return compute_features(close, volume)[-1]
+
+
+def add_feature_columns(df, close_col='Close', volume_col='Volume'):
+    """Add the FEATURE_COLS columns to a DataFrame of bars in place and return it."""
+    feats = compute_features(df[close_col].to_numpy(), df[volume_col].to_numpy())
+    for i, col in enumerate(FEATURE_COLS):
+        df[col] = feats[:, i]
+    return df
+
+
+# --- Incremental mode ---
+class _RollingWindow:
+    def __init__(self, size: int):
+        self.size = size
+        self.values = deque(maxlen=size)
+        # Sums over the finite values; a window holding a NaN reports itself not full
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.nans = 0
+        self.pushes = 0
+
+    def pushed(self, x: float):
+        """(full and NaN-free, total, total_sq) as they would be after pushing x."""
+        total, total_sq, nans = self.total, self.total_sq, self.nans
+        if len(self.values) == self.size:
+            old = self.values[0]
+            if old != old:
+                nans -= 1
+            else:
+                total -= old
+                total_sq -= old * old
+        if x != x:
+            nans += 1
+        else:
+            total += x
+            total_sq += x * x
+        return len(self.values) + 1 >= self.size and not nans, total, total_sq
+
+    def push(self, x: float):
+        if len(self.values) == self.size:
+            self.nans -= self.values[0] != self.values[0]
+        _, self.total, self.total_sq = self.pushed(x)
+        self.nans += x != x
+        self.values.append(x)
+        self.pushes += 1
+        if self.pushes % RESYNC_EVERY == 0:
+            self.total = sum(v for v in self.values if v == v)
+            self.total_sq = sum(v * v for v in self.values if v == v)
+
+    @staticmethod
+    def std(total: float, total_sq: float, size: int) -> float:
+        var = (total_sq - total * total / size) / (size - 1)
+        return var ** 0.5 if var > 0 else 0.0
+
+
+class FeatureState:
+    """Rolling indicator state for one symbol, updated with one bar at a time."""
+
+    def __init__(self):
+        self.ma = {w: _RollingWindow(w) for w in MA_WINDOWS}
+        self.gain = _RollingWindow(RSI_WINDOW)
+        self.loss = _RollingWindow(RSI_WINDOW)
+        self.prev_close = None
+        self.prev_volume = None
+        self.bars = 0
+        # Timestamp of the last bar pushed, when the caller tracks it
+        self.last_timestamp = None
+        self._row = None
+
+    @classmethod
+    def from_history(cls, close, volume):
+        # Only the trailing warm-up window affects the state once every window is full
+        state = cls()
+        for c, v in zip(close[-(WARMUP_BARS + 1):], volume[-(WARMUP_BARS + 1):]):
+            state.update(c, v)
+        return state
+
+    @staticmethod
+    def _pct(curr, prev):
+        if prev is None:
+            return 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.float64(curr) / np.float64(prev) - 1
+        return 0.0 if np.isnan(r) else float(r)
+
+    def peek(self, close: float, volume: float) -> np.ndarray:
+        """Feature row for a next bar, without adding it to the state."""
+        close = float(close)
+        volume = float(volume)
+        delta = 0.0 if self.prev_close is None else close - self.prev_close
+        ma = {}
+        for size, w in self.ma.items():
+            full, total, _ = w.pushed(close)
+            ma[size] = total / size if full else close
+        full, total, total_sq = self.ma[BB_WINDOW].pushed(close)
+        bb_std = _RollingWindow.std(total, total_sq, BB_WINDOW) if full else 0.0
+        full, gain, _ = self.gain.pushed(delta if delta > 0 else 0.0)
+        gain = gain / RSI_WINDOW if full else 0.0
+        full, loss, _ = self.loss.pushed(-delta if delta < 0 else 0.0)
+        loss = loss / RSI_WINDOW if full else 0.0
+        rsi = 100 - 100 / (1 + gain / (loss + 1e-6))
+        return np.array([
+            self._pct(close, self.prev_close),
+            ma[5], ma[10], ma[20], ma[50],
+            ma[BB_WINDOW] + 2 * bb_std,
+            ma[BB_WINDOW] - 2 * bb_std,
+            rsi,
+            self._pct(volume, self.prev_volume),
+            ma[5] - ma[20],
+        ])
+
+    def update(self, close: float, volume: float) -> np.ndarray:
+        self._row = self.peek(close, volume)
+        close = float(close)
+        volume = float(volume)
+        delta = 0.0 if self.prev_close is None else close - self.prev_close
+        for w in self.ma.values():
+            w.push(close)
+        self.gain.push(delta if delta > 0 else 0.0)
+        self.loss.push(-delta if delta < 0 else 0.0)
+        self.prev_close = close
+        self.prev_volume = volume
+        self.bars += 1
+        return self._row
+
+    def row(self) -> np.ndarray:
+        return self._row
+
+
+class FeatureStates:
+    """Per-symbol FeatureState kept between predictions (LRU).
+
+    Each state covers the symbol's bars up to the second-to-last one: a bar
+    with a successor no longer changes, while the last bar may still be
+    forming and is scored with peek(). New bars are pushed with update();
+    a state that can't be advanced from the given bars (evicted, too far
+    behind, or bars that disagree with it) is rebuilt from the warm-up window.
+    """
+
+    def __init__(self, max_size: int = FEATURE_STATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.advanced = 0
+        self.rebuilt = 0
+
+    def _advance(self, state: FeatureState, timestamps, close, volume) -> bool:
+        # Index of the state's last bar, then push every final bar after it
+        i = int(np.searchsorted(timestamps, state.last_timestamp))
+        if i >= len(timestamps) - 1 or timestamps[i] != state.last_timestamp:
+            return False
+        # NaN-aware: a missing close matches a missing close
+        if close[i] != state.prev_close and not (close[i] != close[i] and state.prev_close != state.prev_close):
+            return False
+        for j in range(i + 1, len(timestamps) - 1):
+            state.update(close[j], volume[j])
+        state.last_timestamp = int(timestamps[-2])
+        return True
+
+    def latest(self, symbol: str, timestamps, close, volume) -> np.ndarray:
+        """Feature row for the last of the symbol's bars (ordered oldest first)."""
+        if len(close) <= WARMUP_BARS:
+            return latest_features(close, volume)
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is not None and self._advance(state, timestamps, close, volume):
+                self._states.move_to_end(symbol)
+                self.advanced += 1
+            else:
+                state = FeatureState.from_history(close[:-1], volume[:-1])
+                state.last_timestamp = int(timestamps[-2])
+                self._states[symbol] = state
+                self.rebuilt += 1
+                while len(self._states) > self.max_size:
+                    self._states.popitem(last=False)
+            return state.peek(close[-1], volume[-1])
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+    def __len__(self):
+        return len(self._states)
+
+
+states = FeatureStates()
+
+
+# --- Parity check against the original pandas implementation ---
+def _pandas_reference(close, volume):
+    import pandas as pd
+    df = pd.DataFrame({'close': close, 'volume': volume})
+    df['pct_change'] = df['close'].pct_change().fillna(0)
+    df['ma_5'] = df['close'].rolling(window=5).mean().fillna(df['close'])
+    df['ma_10'] = df['close'].rolling(window=10).mean().fillna(df['close'])
+    df['ma_20'] = df['close'].rolling(window=20).mean().fillna(df['close'])
+    df['ma_50'] = df['close'].rolling(window=50).mean().fillna(df['close'])
+    df['bb_middle'] = df['close'].rolling(window=20).mean().fillna(df['close'])
+    df['bb_std'] = df['close'].rolling(window=20).std().fillna(0)
+    df['bb_upper'] = df['bb_middle'] + 2 * df['bb_std']
+    df['bb_lower'] = df['bb_middle'] - 2 * df['bb_std']
+    delta = df['close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean().fillna(0)
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean().fillna(0)
+    rs = gain / (loss + 1e-6)
+    df['rsi'] = 100 - (100 / (1 + rs))
+    df['vol_pct_change'] = df['volume'].pct_change().fillna(0)
+    df['ma_diff'] = df['ma_5'] - df['ma_20']
+    return df[FEATURE_COLS].to_numpy()
+
+
+def check_parity(n_bars=1300, seeds=range(5), rtol=1e-7, atol=1e-7):
+    """Compare batch and incremental features with the pandas implementation."""
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+        flat = rng.integers(1, n_bars, 20)
+        close[flat] = close[flat - 1]  # unchanged-price bars
+        volume = rng.integers(0, 1_000_000, n_bars).astype(float)
+        volume[rng.integers(0, n_bars, 20)] = 0  # zero-volume bars
+        if seed % 2:
+            close[rng.integers(0, n_bars, 3)] = np.nan  # missing closes only affect their windows
+        expected = _pandas_reference(close, volume)
+        batch = compute_features(close, volume)
+        np.testing.assert_allclose(batch, expected, rtol=rtol, atol=atol)
+        state = FeatureState()
+        incremental = np.array([state.update(c, v) for c, v in zip(close, volume)])
+        np.testing.assert_allclose(incremental, expected, rtol=rtol, atol=atol)
+        for n in (3, 20, 51, n_bars):
+            np.testing.assert_allclose(latest_features(close[:n], volume[:n]), expected[n - 1],
+                                       rtol=rtol, atol=atol)
+        # Serving: a forming bar rewritten before it closes, then the next bar
+        timestamps = np.arange(n_bars) * 86400
+        served = FeatureStates()
+        for n in range(3, n_bars + 1):
+            forming = served.latest("SYM", timestamps[:n], np.append(close[:n - 1], close[n - 1] * 1.01),
+                                    np.append(volume[:n - 1], volume[n - 1]))
+            np.testing.assert_allclose(forming, compute_features(
+                np.append(close[:n - 1], close[n - 1] * 1.01), volume[:n])[-1], rtol=rtol, atol=atol)
+            row = served.latest("SYM", timestamps[:n], close[:n], volume[:n])
+            np.testing.assert_allclose(row, expected[n - 1], rtol=rtol, atol=atol)
+        assert served.rebuilt == 1, served.rebuilt
+    return True
+
+
+if __name__ == "__main__":
+    check_parity()
+    print("Batch and incremental features match the pandas implementation.")
@@ -1,173 +1,198 @@
 
-import yfinance as yf
-import pandas as pd
+import numpy as np
+import argparse
+import datetime
 import json
 import os
-import requests
-from dotenv import load_dotenv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bar_store import store as bar_store, to_epoch
+from data_providers import load_asx_symbols, to_ticker
+from features import WARMUP_BARS, compute_features
+from labels import LABEL_HORIZONS, LABEL_KINDS, LABEL_THRESHOLDS, compute_label_sets, label_specs
+from training_dataset import DATASET_PATH, LABEL_PENDING, DatasetWriter
 
-# Load environment variables from .env file (if present)
-load_dotenv()
+OUTPUT_PATH = DATASET_PATH
+# Per-symbol download checkpoint so interrupted runs resume where they stopped
+MANIFEST_PATH = os.path.join(os.path.dirname(__file__), 'training_manifest.json')
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '8'))
+HISTORY_DAYS = 5 * 365
 
-# Load ASX symbols from the frontend public directory
 
-# --- API KEYS ---
-ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
-EODHD_API_KEY = os.getenv('EODHD_API_KEY')
+def report(event: str, **fields):
+    # One JSON object per line for structured progress
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}), flush=True)
 
-SYMBOLS_PATH = os.path.join(os.path.dirname(__file__), '../frontend/public/asx_symbols.json')
-OUTPUT_PATH = os.path.join(os.path.dirname(__file__), 'training_data.csv')
 
-with open(SYMBOLS_PATH, 'r') as f:
-    symbols = json.load(f)
+# --- Download manifest ---
+class Manifest:
+    def __init__(self, path: str, as_of: str, fresh: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        data = {}
+        if not fresh and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+        # A manifest from an earlier day is stale: every symbol needs new bars
+        if data.get("as_of") != as_of:
+            data = {"as_of": as_of, "symbols": {}}
+        self.data = data
 
-all_data = []
+    def done(self, symbol: str) -> bool:
+        return self.data["symbols"].get(symbol, {}).get("status") == "done"
 
-for symbol in symbols:
-    ticker = symbol if symbol.endswith('.AX') else symbol + '.AX'
-    print(f"Downloading {ticker}...")
-    try:
-        # Try yfinance first
-        data = yf.download(ticker, period="5y")
-        # Flatten MultiIndex columns if present (e.g., ('Close', 'WTC.AX') -> 'Close')
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = [col[0] for col in data.columns]
-            print(f"{ticker}: yfinance columns flattened: {list(data.columns)}")
-        print(f"{ticker}: yfinance columns: {list(data.columns)}")
-        print(f"{ticker}: yfinance head:\n{data.head()}\n")
-        if data.empty:
-            print(f"{ticker}: No data from yfinance. Trying Alpha Vantage...")
-            # Try Alpha Vantage
-            av_url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={ticker}&outputsize=full&apikey={ALPHA_VANTAGE_API_KEY}'
-            av_resp = requests.get(av_url)
-            av_json = av_resp.json()
-            if 'Time Series (Daily)' in av_json:
-                av_df = pd.DataFrame.from_dict(av_json['Time Series (Daily)'], orient='index').sort_index()
-                av_df = av_df.rename(columns={
-                    '1. open': 'Open',
-                    '2. high': 'High',
-                    '3. low': 'Low',
-                    '4. close': 'Close',
-                    '5. adjusted close': 'Adj Close',
-                    '6. volume': 'Volume',
-                })
-                av_df = av_df[['Open', 'High', 'Low', 'Close', 'Volume']].astype(float)
-                av_df.index = pd.to_datetime(av_df.index)
-                av_df = av_df.sort_index()
-                print(f"{ticker}: Alpha Vantage columns: {list(av_df.columns)}")
-                print(f"{ticker}: Alpha Vantage head:\n{av_df.head()}\n")
-                df = av_df.reset_index().rename(columns={'index': 'Date'})
-            else:
-                print(f"{ticker}: No data from Alpha Vantage. Trying EODHD...")
-                # Try EODHD
-                eod_url = f'https://eodhistoricaldata.com/api/eod/{ticker}?fmt=json&api_token={EODHD_API_KEY}&period=d&from=2010-01-01'
-                eod_resp = requests.get(eod_url)
-                if eod_resp.status_code == 200:
-                    eod_json = eod_resp.json()
-                    if isinstance(eod_json, list) and len(eod_json) > 0:
-                        eod_df = pd.DataFrame(eod_json)
-                        eod_df = eod_df.rename(columns={
-                            'open': 'Open',
-                            'high': 'High',
-                            'low': 'Low',
-                            'close': 'Close',
-                            'volume': 'Volume',
-                        })
-                        eod_df = eod_df[['Open', 'High', 'Low', 'Close', 'Volume', 'date']]
-                        eod_df['date'] = pd.to_datetime(eod_df['date'])
-                        eod_df = eod_df.sort_values('date')
-                        print(f"{ticker}: EODHD columns: {list(eod_df.columns)}")
-                        print(f"{ticker}: EODHD head:\n{eod_df.head()}\n")
-                        df = eod_df.rename(columns={'date': 'Date'}).reset_index(drop=True)
-                    else:
-                        print(f"{ticker}: No data from EODHD.")
-                        continue
-                else:
-                    print(f"{ticker}: No data from EODHD (HTTP {eod_resp.status_code}).")
-                    continue
-        else:
-            df = data.reset_index()
-        # Check for required raw columns
-        required_raw_cols = ['Close', 'Volume']
-        if not all(col in df.columns for col in required_raw_cols):
-            print(f"{ticker}: Missing required raw columns: {[col for col in required_raw_cols if col not in df.columns]}")
-            continue
-        # Check for minimum length (largest rolling window is 50)
-        if len(df) < 55:
-            print(f"{ticker}: Not enough data points ({len(df)}) for feature engineering. Skipping.")
-            continue
-        df['pct_change'] = df['Close'].pct_change().fillna(0)
-        df['ma_5'] = df['Close'].rolling(window=5).mean().fillna(df['Close'])
-        df['ma_10'] = df['Close'].rolling(window=10).mean().fillna(df['Close'])
-        df['ma_20'] = df['Close'].rolling(window=20).mean().fillna(df['Close'])
-        df['ma_50'] = df['Close'].rolling(window=50).mean().fillna(df['Close'])
-        df['bb_middle'] = df['Close'].rolling(window=20).mean().fillna(df['Close'])
-        df['bb_std'] = df['Close'].rolling(window=20).std().fillna(0)
-        df['bb_upper'] = df['bb_middle'] + 2 * df['bb_std']
-        df['bb_lower'] = df['bb_middle'] - 2 * df['bb_std']
-        delta = df['Close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean().fillna(0)
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean().fillna(0)
-        rs = gain / (loss + 1e-6)
-        df['rsi'] = 100 - (100 / (1 + rs))
-        df['vol_pct_change'] = df['Volume'].pct_change().fillna(0)
-        df['ma_diff'] = df['ma_5'] - df['ma_20']
-        # Smart labeling: future returns and simulated trades
-        N = 5  # lookahead days
-        PROFIT_THRESHOLD = 0.03  # +3%
-        LOSS_THRESHOLD = -0.03   # -3%
-        future_close = df['Close'].shift(-N)
-        future_return = (future_close - df['Close']) / df['Close']
-        # Drop NaNs from features before labeling
-        feature_cols_no_label = [
-            'pct_change', 'ma_5', 'ma_10', 'ma_20', 'ma_50',
-            'bb_upper', 'bb_lower', 'rsi', 'vol_pct_change', 'ma_diff'
-        ]
-        df = df.dropna(subset=feature_cols_no_label)
-        def smart_label(ret):
+    def record(self, symbol: str, **entry):
+        with self._lock:
+            self.data["symbols"][symbol] = {**entry, "updated_at": time.time()}
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.data, f, indent=1)
+            os.replace(self.path + '.tmp', self.path)
+
+
+# --- Concurrent download ---
+def download_all(symbols, manifest: Manifest, workers: int = DOWNLOAD_WORKERS):
+    """Refresh the bar store for every symbol not yet done today, `workers` at a time.
+
+    Provider rate limits and retries live in data_providers, so wall-clock time
+    follows the providers' limits rather than symbols x latency.
+    """
+    pending = [s for s in symbols if not manifest.done(s)]
+    report("download_start", total=len(symbols), pending=len(pending), resumed=len(symbols) - len(pending))
+
+    def fetch(symbol):
+        started = time.monotonic()
+        # force: the manifest, not the store's max age, decides what is stale here
+        rows = bar_store.refresh(symbol, force=True)
+        return rows, time.monotonic() - started
+
+    completed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, symbol): symbol for symbol in pending}
+        for future in as_completed(futures):
+            symbol = futures[future]
             try:
-                # If ret is a Series, take the first value or return 0
-                if isinstance(ret, pd.Series):
-                    print(f"Label error for {ticker}: ret is a Series, using first value.")
-                    ret = ret.iloc[0] if not ret.empty else 0
-                if ret > PROFIT_THRESHOLD:
-                    return 1  # buy
-                elif ret < LOSS_THRESHOLD:
-                    return -1  # sell
-                else:
-                    return 0  # hold
+                rows, elapsed = future.result()
             except Exception as e:
-                print(f"Label error for {ticker}: ret={ret}, error={e}")
-                return 0
-        df['label'] = future_return.apply(smart_label)
-        df['symbol'] = symbol
-        feature_cols = [
-            'symbol', 'pct_change', 'ma_5', 'ma_10', 'ma_20', 'ma_50',
-            'bb_upper', 'bb_lower', 'rsi', 'vol_pct_change', 'ma_diff', 'label'
-        ]
-        # Check for missing columns
-        missing_cols = [col for col in feature_cols if col not in df.columns]
-        if missing_cols:
-            print(f"Error downloading {ticker}: {missing_cols}")
-            continue
-        # Drop NaNs from label after labeling
-        clean_df = df[feature_cols].dropna(subset=['label'])
-        print(f"{ticker}: clean_df shape: {clean_df.shape}")
-        if clean_df.empty:
-            print(f"{ticker}: No usable data after feature engineering and labeling.")
-        else:
-            all_data.append(clean_df)
-    except Exception as e:
-        print(f"Error downloading {ticker}: {e}")
-
-if all_data:
-    result = pd.concat(all_data, ignore_index=True)
-    # Final safeguard: drop any rows with NaN in features or label
-    result = result.dropna()
-    if result.empty:
-        print("No usable data after concatenation and NaN removal.")
+                failed += 1
+                manifest.record(symbol, status="failed", error=str(e))
+                report("symbol_failed", symbol=symbol, error=str(e), completed=completed, failed=failed, pending=len(pending))
+                continue
+            completed += 1
+            stored = len(bar_store.read(symbol))
+            status = "done" if stored else "empty"
+            manifest.record(symbol, status=status, new_rows=rows, stored_rows=stored)
+            report("symbol_" + status, symbol=symbol, new_rows=rows, stored_rows=stored, seconds=round(elapsed, 3),
+                   completed=completed, failed=failed, pending=len(pending))
+    report("download_finish", completed=completed, failed=failed)
+
+
+# --- Feature engineering and labeling ---
+# Smart labeling: future returns and simulated trades
+N = 5  # lookahead days
+PROFIT_THRESHOLD = 0.03  # +3%
+LOSS_THRESHOLD = -0.03   # -3%
+
+
+def compute_labels(close):
+    """1 buy / -1 sell / 0 hold from the N-day future return; LABEL_PENDING for the last N bars."""
+    close = np.asarray(close, dtype=np.float64)
+    labels = np.full(len(close), LABEL_PENDING, dtype=np.int8)
+    if len(close) > N:
+        future_return = (close[N:] - close[:-N]) / close[:-N]
+        labels[:-N] = np.where(future_return > PROFIT_THRESHOLD, 1,
+                               np.where(future_return < LOSS_THRESHOLD, -1, 0))
+    return labels
+
+
+def symbol_rows(bars, first: int, specs: dict = None):
+    """(dates, features, labels, label sets) for bars[first:], computing features over the warm-up window before it."""
+    start = max(first - WARMUP_BARS, 0)
+    close = np.asarray(bars.close[start:])
+    X = compute_features(close, np.asarray(bars.volume[start:]))[first - start:]
+    labels = compute_labels(close)[first - start:]
+    label_sets = {name: values[first - start:] for name, values in compute_label_sets(close, specs or {}).items()}
+    return bars.dates()[first:], X, labels, label_sets
+
+
+def write_symbol(writer: DatasetWriter, symbol: str, start_date, end_date, incremental: bool):
+    """Append the symbol's new rows and resolve labels whose lookahead has closed. Returns (new rows, resolved)."""
+    ticker = to_ticker(symbol)
+    # Only completed daily bars (before end_date): today's bar may still be forming
+    bars = bar_store.read(symbol, end=end_date)
+    ts = bars.timestamp
+    last = writer.last_dates.get(symbol) if incremental else None
+    resolved = 0
+    if last is not None:
+        # Fill labels of earlier rows now that more bars may exist
+        rows, dates = writer.pending_rows(symbol)
+        if len(rows):
+            idx = np.searchsorted(ts, dates)
+            # Pending rows sit within the largest horizon of the last bar, so only the tail is relabeled
+            start = int(idx.min())
+            close = np.asarray(bars.close[start:])
+            labels = compute_labels(close)[idx - start]
+            label_sets = {name: values[idx - start]
+                          for name, values in compute_label_sets(close, writer.label_specs).items()}
+            resolved = writer.resolve_labels(symbol, rows, labels, label_sets)
+        first = int(np.searchsorted(ts, last, 'right'))
     else:
-        result.to_csv(OUTPUT_PATH, index=False)
-        print(f"Saved training data to {OUTPUT_PATH}")
-else:
-    print("No data downloaded.")
+        first = int(np.searchsorted(ts, to_epoch(start_date)))
+        # Check for minimum length (largest rolling window is 50)
+        if len(ts) - first < 55:
+            print(f"{ticker}: Not enough data points ({len(ts) - first}) for feature engineering. Skipping.")
+            return 0, 0
+    if first >= len(ts):
+        return 0, resolved
+    dates, X, labels, label_sets = symbol_rows(bars, first, writer.label_specs)
+    return writer.append(symbol, dates, X, labels, label_sets), resolved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download bars and build the binary training dataset")
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS, help="concurrent downloads")
+    parser.add_argument('--fresh', action='store_true', help="ignore the download manifest and refetch every symbol")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append only bars newer than the existing dataset and fill in resolved labels")
+    parser.add_argument('--label-kinds', nargs='+', choices=LABEL_KINDS, default=list(LABEL_KINDS),
+                        help="label set kinds to store next to the features")
+    parser.add_argument('--label-horizons', nargs='+', type=int, default=list(LABEL_HORIZONS),
+                        help="label set horizons in bars")
+    parser.add_argument('--label-thresholds', nargs='+', type=float, default=list(LABEL_THRESHOLDS),
+                        help="label set return thresholds, e.g. 0.03 for +-3%%")
+    args = parser.parse_args(argv)
+    specs = label_specs(args.label_kinds, args.label_horizons, args.label_thresholds)
+
+    # Load ASX symbols from the frontend public directory
+    symbols = list(dict.fromkeys(load_asx_symbols()))
+    today = datetime.date.today()
+    manifest = Manifest(MANIFEST_PATH, today.isoformat(), fresh=args.fresh)
+    download_all(symbols, manifest, workers=args.workers)
+
+    start_date = today - datetime.timedelta(days=HISTORY_DAYS)
+    # Stream each symbol's rows straight to the binary dataset
+    try:
+        writer = DatasetWriter(OUTPUT_PATH, append=args.incremental, label_specs=specs)
+    except ValueError as e:
+        # Different label sets (or features) than the stored dataset: rebuild it
+        report("dataset_rebuild", reason=str(e))
+        writer = DatasetWriter(OUTPUT_PATH, label_specs=specs)
+    incremental = writer.append_mode
+    new_rows = resolved = 0
+    for symbol in symbols:
+        try:
+            added, filled = write_symbol(writer, symbol, start_date, today, incremental)
+        except Exception as e:
+            print(f"Error processing {to_ticker(symbol)}: {e}")
+            continue
+        new_rows += added
+        resolved += filled
+    writer.close()
+    report("dataset_written", path=OUTPUT_PATH, incremental=incremental, symbols=len(writer.symbols),
+           rows=writer.rows, new_rows=new_rows, resolved_labels=resolved)
+    if not writer.rows:
+        print("No data downloaded.")
+
+
+if __name__ == "__main__":
+    main()
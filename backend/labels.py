@@ -0,0 +1,66 @@
+# Label sets for the training dataset
+# Every (kind, horizon, threshold) combination is labeled from one matrix of
+# future returns per symbol, so trying another horizon or threshold is a
+# matter of picking a stored label set in train_model.py.
+#   ret:     1 / -1 / 0 when the return `horizon` bars ahead is above +t / below -t / in between
+#   barrier: 1 / -1 when the close first moves above +t / below -t within `horizon` bars, else 0
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from training_dataset import LABEL_PENDING
+
+LABEL_KINDS = ('ret', 'barrier')
+LABEL_HORIZONS = (1, 5, 10, 20)
+LABEL_THRESHOLDS = (0.01, 0.02, 0.03, 0.05)
+
+
+def label_set_name(kind: str, horizon: int, threshold: float) -> str:
+    """e.g. ret_h5_t3 for the 5-bar return against +-3%."""
+    return f"{kind}_h{horizon}_t{round(threshold * 100, 4):g}"
+
+
+def label_specs(kinds=LABEL_KINDS, horizons=LABEL_HORIZONS, thresholds=LABEL_THRESHOLDS) -> dict:
+    return {
+        label_set_name(kind, h, t): {"kind": kind, "horizon": int(h), "threshold": float(t)}
+        for kind in kinds for h in horizons for t in thresholds
+    }
+
+
+def compute_label_sets(close, specs: dict) -> dict:
+    """name -> int8 labels for every spec; LABEL_PENDING where the outcome is not known yet."""
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    if not specs:
+        return {}
+    H = max(spec["horizon"] for spec in specs.values())
+    # R[i, k]: return from bar i to bar i + k + 1 (NaN past the last bar)
+    future = sliding_window_view(np.concatenate([close[1:], np.full(H, np.nan)]), H)[:n]
+    with np.errstate(invalid='ignore'):
+        R = (future - close[:, None]) / close[:, None]
+    known = np.minimum(n - 1 - np.arange(n), H)  # future bars available per row
+    first_touch = {}
+    out = {}
+    for name, spec in specs.items():
+        h, t = spec["horizon"], spec["threshold"]
+        if spec["kind"] == "ret":
+            r = R[:, h - 1]
+            with np.errstate(invalid='ignore'):
+                labels = np.where(r > t, 1, np.where(r < -t, -1, 0)).astype(np.int8)
+            labels[known < h] = LABEL_PENDING
+        elif spec["kind"] == "barrier":
+            if t not in first_touch:
+                # Index of the first bar beyond each barrier, H if never within the window
+                with np.errstate(invalid='ignore'):
+                    up, down = R > t, R < -t
+                first_touch[t] = (np.where(up.any(axis=1), up.argmax(axis=1), H),
+                                  np.where(down.any(axis=1), down.argmax(axis=1), H))
+            first_up, first_down = first_touch[t]
+            labels = np.where((first_up < h) & (first_up < first_down), 1,
+                              np.where((first_down < h) & (first_down < first_up), -1, 0)).astype(np.int8)
+            # Resolved once a barrier was touched or the whole window is known
+            resolved = (np.minimum(first_up, first_down) < np.minimum(h, known)) | (known >= h)
+            labels[~resolved] = LABEL_PENDING
+        else:
+            raise ValueError(f"Unknown label kind '{spec['kind']}'")
+        out[name] = labels
+    return out
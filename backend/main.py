@@ -2,25 +2,60 @@
 
 
 # --- Imports ---
-from fastapi import FastAPI, Query, Depends, WebSocket, WebSocketDisconnect, Body
+from fastapi import FastAPI, Query, Depends, WebSocket, WebSocketDisconnect, Body, Request, Response
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from db import SessionLocal, StockSignal
+from backplane import create_backplane
+from db import SessionLocal, session_scope
+from bar_store import store as bar_store
+from concurrency import SingleFlight, run_blocking, spawn
+from data_providers import to_symbol, to_ticker
+from ws_fanout import FanoutManager
+import bar_encoding
+import metrics
+import portfolio
+import prediction_cache
+import signal_history
+from signal_writer import writer as signal_writer
+from warmup import warmup
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+import contextvars
+import datetime
+import os
 import smtplib
 import requests
 
 # --- App Initialization ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    signal_writer.start()
+    # Connect to the other workers before any broadcast
+    await manager.backplane.start()
+    # Imports, tables, model (and optionally bars/features) load in the background;
+    # /ready turns 200 once they are done
+    spawn(run_blocking(warmup.run))
+    yield
+    # Flush queued signal rows before the worker exits
+    await run_blocking(signal_writer.close)
+    await manager.backplane.close()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Per-stage timings on every response and request latency for /metrics
+app.add_middleware(metrics.ServerTimingMiddleware)
 
 
 # --- Models ---
@@ -35,6 +70,53 @@ class SignalResponse(BaseModel):
     open_price: float = None
     high_price: float = None
     low_price: float = None
+    model_version: Optional[str] = None
+
+class BatchPredictRequest(BaseModel):
+    symbols: Union[List[str], Literal["all"]] = "all"
+
+class BatchPredictError(BaseModel):
+    symbol: str
+    detail: str
+
+class BatchPredictResponse(BaseModel):
+    signals: List[SignalResponse]
+    errors: List[BatchPredictError]
+
+class PortfolioHolding(BaseModel):
+    symbol: str
+    market: Optional[str] = None
+    name: Optional[str] = None
+    shares: Optional[float] = None
+    percent_portfolio: Optional[float] = None
+
+class PortfolioRequest(BaseModel):
+    # Defaults to the bundled 13F holdings
+    holdings: Optional[List[PortfolioHolding]] = None
+    # Market of holdings without one (ASX when a holdings list is given)
+    market: Optional[str] = None
+
+class PortfolioHoldingSignal(SignalResponse):
+    ticker: str
+    name: Optional[str] = None
+    market: str
+    weight: float
+    cached: bool
+
+class PortfolioAggregate(BaseModel):
+    signal: Optional[Literal["buy", "sell", "hold"]] = None
+    score: Optional[float] = None
+    buy_weight: float
+    sell_weight: float
+    hold_weight: float
+    confidence: Optional[float] = None
+    weight_basis: str
+    holdings: int
+
+class PortfolioResponse(BaseModel):
+    holdings: List[PortfolioHoldingSignal]
+    aggregate: PortfolioAggregate
+    errors: List[BatchPredictError]
 
 # --- DB Dependency ---
 def get_db():
@@ -45,134 +127,327 @@ def get_db():
         db.close()
 
 # --- WebSocket manager ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# BROADCAST_BACKPLANE=ipc or redis relays broadcasts between uvicorn workers and replicas
+manager = FanoutManager(backplane=create_backplane())
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def _signal_row(response: SignalResponse, bars) -> dict:
+    # Column values for stock_signals and latest_signals
+    from signal_sweep import signal_row
+    return signal_row(response.dict(), bars)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+predict_flight = SingleFlight()
+# Concurrent bar refreshes per /predict/batch call
+PREDICT_BATCH_WORKERS = int(os.getenv("PREDICT_BATCH_WORKERS", "8"))
 
-manager = ConnectionManager()
+# Sweep results in latest_signals are served while younger than this
+# (the fetch_asx_data timer runs every 5 minutes)
+LATEST_SIGNAL_MAX_AGE = float(os.getenv("LATEST_SIGNAL_MAX_AGE_SECONDS", "600"))
 
-# --- Endpoints ---
-@app.get("/predict", response_model=SignalResponse)
-def predict_signal(symbol: str = Query(..., description="ASX stock symbol")):
-    from ml_model import predict_buy_sell
-    import yfinance as yf
-    ticker = symbol if symbol.endswith('.AX') else symbol + '.AX'
-    data = yf.Ticker(ticker)
-    price = None
-    open_price = None
-    high_price = None
-    low_price = None
+def _latest_signal(symbol: str) -> Optional[SignalResponse]:
+    from db import LatestSignal
+    from model_registry import registry
     try:
-        hist = data.history(period="1d")
-        if hist.empty:
-            raise ValueError("No data found for symbol")
-        price = hist['Close'].iloc[-1]
-        open_price = hist['Open'].iloc[-1]
-        high_price = hist['High'].iloc[-1]
-        low_price = hist['Low'].iloc[-1]
+        with metrics.stage("latest_lookup"), session_scope() as db:
+            row = db.get(LatestSignal, symbol)
+            if row is None:
+                return None
+            signal = SignalResponse(
+                symbol=row.symbol, buy_signal=bool(row.buy_signal), sell_signal=bool(row.sell_signal),
+                hold_signal=bool(row.hold_signal), confidence=row.confidence, timestamp=row.timestamp.isoformat(),
+                current_price=row.current_price, open_price=row.open_price, high_price=row.high_price,
+                low_price=row.low_price, model_version=row.model_version)
     except Exception:
+        # No latest_signals table yet: compute on demand
+        return None
+    age = (datetime.datetime.utcnow() - datetime.datetime.fromisoformat(signal.timestamp)).total_seconds()
+    if age > LATEST_SIGNAL_MAX_AGE:
+        return None
+    # A signal from a replaced model is stale regardless of age
+    loaded = registry.get()
+    if loaded is not None and signal.model_version != loaded.version:
+        return None
+    return signal
+
+def _latest_bars(symbol: str):
+    from features import WARMUP_BARS
+    # Last 1 year of daily bars from the local bar store (filled from the provider when stale)
+    start = datetime.date.today() - datetime.timedelta(days=365)
+    with metrics.stage("bars"):
+        bars = bar_store.get_bars(symbol, start=start)
+    # The model only needs the trailing warm-up window of bars
+    return bars.tail(WARMUP_BARS + 1)
+
+def _with_prices(result: dict, bars) -> SignalResponse:
+    return SignalResponse(**result, current_price=float(bars.close[-1]), open_price=float(bars.open[-1]),
+                          high_price=float(bars.high[-1]), low_price=float(bars.low[-1]))
+
+# Bar store writes in this process drop the symbol's cached predictions
+bar_store.add_listener(prediction_cache.cache.invalidate)
+
+def _cache_key(symbol: str, bars) -> tuple:
+    from model_registry import registry
+    loaded = registry.get()
+    return prediction_cache.cache.key(symbol, bars.timestamp[-1], loaded.version if loaded is not None else None)
+
+def _cached_signal(symbol: str, bars, key) -> Optional[SignalResponse]:
+    with metrics.stage("cache_lookup"):
+        cached = prediction_cache.cache.get(key, bars.updated_at)
+    return SignalResponse(**{**cached, "symbol": symbol}) if cached is not None else None
+
+def _compute_signal(symbol: str):
+    """(signal, computed); computed is False for a cached signal, already stored and broadcast."""
+    from ml_model import predict_buy_sell_batch
+    bars = _latest_bars(symbol)
+    if bars.empty:
         raise HTTPException(status_code=404, detail=f"Stock symbol '{symbol}' not found or has no data.")
-    # Fetch last 1 year of price data for ML model
-    price_data = []
-    try:
-        hist_long = data.history(period="1y")
-        for idx, row in hist_long.iterrows():
-            price_data.append({
-                "timestamp": idx.isoformat(),
-                "open": row["Open"],
-                "high": row["High"],
-                "low": row["Low"],
-                "close": row["Close"],
-                "volume": row["Volume"]
-            })
-    except Exception:
-        price_data = []
-    result = predict_buy_sell(symbol, price_data)
-    response = SignalResponse(**result, current_price=price, open_price=open_price, high_price=high_price, low_price=low_price)
-    # Store in DB
-    db = next(get_db())
-    import datetime
-    signal = StockSignal(
-        symbol=symbol,
-        buy_signal=int(response.buy_signal),
-        sell_signal=int(response.sell_signal),
-        hold_signal=int(response.hold_signal),
-        confidence=response.confidence,
-        timestamp=datetime.datetime.fromisoformat(response.timestamp),
-        current_price=price,
-        open_price=open_price,
-        high_price=high_price,
-        low_price=low_price
-    )
-    db.add(signal)
-    db.commit()
-    db.refresh(signal)
-    # Broadcast to WebSocket clients
-    import asyncio
+    key = _cache_key(symbol, bars)
+    response = _cached_signal(symbol, bars, key)
+    if response is not None:
+        return response, False
+    result = predict_buy_sell_batch({symbol: (bars.close, bars.volume, bars.timestamp)})[symbol]
+    response = _with_prices(result, bars)
+    prediction_cache.cache.put(key, response.dict(), bars.updated_at)
+    # Store in DB off the request path
+    with metrics.stage("db_submit"):
+        signal_writer.submit([_signal_row(response, bars)])
+    return response, True
+
+async def _predict_and_broadcast(symbol: str) -> SignalResponse:
+    # Serve the precomputed signal when it is fresh, otherwise recompute
+    response = await run_blocking(_latest_signal, symbol)
+    if response is not None:
+        return response
+    response, computed = await run_blocking(_compute_signal, symbol)
+    if computed:
+        # Broadcast to WebSocket clients from the event loop
+        with metrics.stage("broadcast"):
+            manager.broadcast(response.dict())
+    return response
+
+def _checked_symbol(symbol: str) -> str:
+    # One spelling per stock (" cba", "CBA" and "CBA.AX" are all "CBA"), so the prediction
+    # cache, bar store and stock_signals rows share a key. Symbols name bar store
+    # directories, so anything that isn't a plain ticker is a 400
     try:
-        asyncio.create_task(manager.broadcast(response.dict()))
-    except Exception:
-        pass
+        return to_symbol(to_ticker(symbol))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Endpoints ---
+@app.get("/predict", response_model=SignalResponse)
+async def predict_signal(symbol: str = Query(..., description="ASX stock symbol")):
+    symbol = _checked_symbol(symbol)
+    # Concurrent requests for the same symbol share one fetch, inference and DB write
+    return await predict_flight.do(symbol, lambda: _predict_and_broadcast(symbol))
+
+def _predict_batch(symbols: list):
+    """(response, computed signals): cached signals are returned but not stored again."""
+    from ml_model import predict_buy_sell_batch
+
+    def fetch(symbol):
+        try:
+            return symbol, _latest_bars(symbol), None
+        except Exception as e:
+            return symbol, None, str(e)
+
+    # Stale symbols are refreshed from the provider concurrently; each task gets
+    # a copy of the request context so its stage timings are still recorded
+    with ThreadPoolExecutor(max_workers=PREDICT_BATCH_WORKERS) as pool:
+        fetched = [f.result() for f in [pool.submit(contextvars.copy_context().run, fetch, s) for s in symbols]]
+    latest_bars = {}
+    cached = {}
+    errors = []
+    for symbol, bars, error in fetched:
+        if error is not None:
+            errors.append(BatchPredictError(symbol=symbol, detail=error))
+            continue
+        if bars.empty:
+            errors.append(BatchPredictError(symbol=symbol, detail=f"Stock symbol '{symbol}' not found or has no data."))
+            continue
+        key = _cache_key(symbol, bars)
+        signal = _cached_signal(symbol, bars, key)
+        if signal is not None:
+            cached[symbol] = signal
+        else:
+            latest_bars[symbol] = (bars, key)
+    # One feature pass and one predict_proba call for every symbol with data
+    results = predict_buy_sell_batch({s: (b.close, b.volume, b.timestamp) for s, (b, _) in latest_bars.items()})
+    computed = {}
+    for symbol, (bars, key) in latest_bars.items():
+        computed[symbol] = _with_prices(results[symbol], bars)
+        prediction_cache.cache.put(key, computed[symbol].dict(), bars.updated_at)
+    # Store every new signal in a single bulk insert
+    if computed:
+        with metrics.stage("db_submit"):
+            signal_writer.submit([_signal_row(computed[s], bars) for s, (bars, _) in latest_bars.items()])
+    signals = [computed.get(s) or cached[s] for s in symbols if s in computed or s in cached]
+    return BatchPredictResponse(signals=signals, errors=errors), list(computed.values())
+
+@app.post("/predict/batch", response_model=BatchPredictResponse)
+async def predict_batch(request: BatchPredictRequest = Body(...)):
+    from data_providers import load_asx_symbols
+    symbols, invalid = [], []
+    for symbol in load_asx_symbols() if request.symbols == "all" else request.symbols:
+        try:
+            symbols.append(_checked_symbol(symbol))
+        except HTTPException as e:
+            invalid.append(BatchPredictError(symbol=symbol, detail=e.detail))
+    response, computed = await run_blocking(_predict_batch, list(dict.fromkeys(symbols)))
+    response.errors[:0] = invalid
+    # Broadcast new signals to WebSocket clients
+    with metrics.stage("broadcast"):
+        for signal in computed:
+            manager.broadcast(signal.dict())
+    return response
+
+async def _portfolio_signals(holdings, market) -> PortfolioResponse:
+    # Cached holdings are reused; the rest are scored in one batch and stored
+    result = await run_blocking(portfolio.portfolio_signals, holdings, market, record=signal_writer.submit)
+    response = PortfolioResponse(**result)
+    with metrics.stage("broadcast"):
+        for holding in response.holdings:
+            if not holding.cached:
+                # WebSocket subscriptions are keyed by ticker
+                manager.broadcast({**SignalResponse(**holding.dict()).dict(), "symbol": holding.ticker})
     return response
 
+@app.get("/portfolio/signals", response_model=PortfolioResponse)
+async def get_portfolio_signals(market: Optional[str] = Query(None, description="Market of the 13F holdings (default US)")):
+    return await _portfolio_signals(None, market)
+
+@app.post("/portfolio/signals", response_model=PortfolioResponse)
+async def post_portfolio_signals(request: PortfolioRequest = Body(...)):
+    holdings = None
+    if request.holdings is not None:
+        holdings = [h.dict(exclude_none=True) for h in request.holdings]
+    return await _portfolio_signals(holdings, request.market)
+
+# --- Metrics ---
+metrics.gauge("anystock_ws_connections", "Open WebSocket connections", lambda: len(manager.clients))
+metrics.gauge("anystock_ws_queue_depth", "Messages queued across WebSocket clients", lambda: sum(manager.queue_depths()))
+metrics.gauge("anystock_ws_queue_depth_max", "Deepest WebSocket client queue", lambda: max(manager.queue_depths(), default=0))
+metrics.gauge("anystock_ws_dropped_messages", "Messages dropped or coalesced for connected clients",
+              lambda: sum(client.dropped for client in manager.clients))
+metrics.counter("anystock_ws_evicted_total", "WebSocket clients evicted for stalled sends", lambda: manager.evicted)
+metrics.gauge("anystock_backplane_connected", "1 while the broadcast backplane reaches the other workers",
+              lambda: int(manager.backplane.connected))
+metrics.counter("anystock_backplane_published_total", "Broadcasts published by this worker",
+                lambda: manager.backplane.published)
+metrics.counter("anystock_backplane_received_total", "Broadcasts received from other workers",
+                lambda: manager.backplane.received)
+metrics.counter("anystock_backplane_dropped_total", "Backplane messages dropped while disconnected or backed up",
+                lambda: manager.backplane.dropped)
+metrics.gauge("anystock_predict_inflight", "Distinct symbols being computed by /predict", predict_flight.inflight)
+metrics.gauge("anystock_signal_writer_pending", "Signal rows waiting to be written", signal_writer.pending)
+metrics.counter("anystock_signal_writer_written_total", "Signal rows written", lambda: signal_writer.written)
+metrics.counter("anystock_signal_writer_dropped_total", "Signal rows dropped on backlog overflow, after WRITER_MAX_RETRIES failed flushes or a failed shutdown flush", lambda: signal_writer.dropped)
+metrics.counter("anystock_signal_writer_failed_flushes_total", "Failed signal writer flushes",
+                lambda: signal_writer.failed_flushes)
+metrics.counter("anystock_prediction_cache_hits_total", "Predictions served from the prediction cache",
+                lambda: prediction_cache.cache.hits)
+metrics.counter("anystock_prediction_cache_misses_total", "Predictions computed after a prediction cache miss",
+                lambda: prediction_cache.cache.misses)
+metrics.counter("anystock_prediction_cache_evictions_total", "Prediction cache entries evicted by the LRU bound",
+                lambda: prediction_cache.cache.evictions)
+metrics.counter("anystock_prediction_cache_invalidations_total", "Prediction cache entries dropped by bar writes",
+                lambda: prediction_cache.cache.invalidations)
+metrics.gauge("anystock_prediction_cache_entries", "Signals held in the prediction cache", lambda: len(prediction_cache.cache))
+
+@app.get("/ready", include_in_schema=False)
+def get_ready():
+    # Readiness probe: 503 until warm-up has finished
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/predict/cache", include_in_schema=False)
+def get_prediction_cache():
+    # Hit/miss statistics of this worker's prediction cache
+    return prediction_cache.cache.stats()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 # --- Signal History Endpoint ---
 @app.get("/signal_history")
-def get_signal_history(symbol: str):
-    db = next(get_db())
-    signals = db.query(StockSignal).filter(StockSignal.symbol == symbol).order_by(StockSignal.timestamp.desc()).all()
-    history = []
-    for s in signals:
-        history.append({
-            "symbol": s.symbol,
-            "timestamp": s.timestamp.isoformat() if s.timestamp else None,
-            "buy_signal": bool(s.buy_signal),
-            "sell_signal": bool(s.sell_signal),
-            "hold_signal": bool(s.hold_signal) if hasattr(s, 'hold_signal') else False,
-            "confidence": s.confidence,
-            "current_price": s.current_price,
-            "open_price": s.open_price,
-            "high_price": s.high_price,
-            "low_price": s.low_price
-        })
-    return {"symbol": symbol, "history": history}
+def get_signal_history(
+    symbol: str,
+    limit: Optional[int] = Query(None, ge=1, le=signal_history.MAX_PAGE_SIZE, description="Page size (default 500)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    start: Optional[datetime.datetime] = Query(None, description="Only signals at or after this time"),
+    end: Optional[datetime.datetime] = Query(None, description="Only signals before this time"),
+    format: Literal["json", "ndjson"] = "json",
+    db: Session = Depends(get_db),
+):
+    symbol = _checked_symbol(symbol)
+    if format == "ndjson":
+        # Streams the whole range (or `limit` rows) for exports
+        return StreamingResponse(signal_history.iter_ndjson(symbol, start, end, limit),
+                                 media_type="application/x-ndjson")
+    try:
+        history, next_cursor = signal_history.fetch_page(
+            db, symbol, limit or signal_history.DEFAULT_PAGE_SIZE, cursor, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"symbol": symbol, "history": history, "next_cursor": next_cursor}
 
 @app.get("/history")
-def get_history(symbol: str):
-    import yfinance as yf
-    ticker = symbol if symbol.endswith('.AX') else symbol + '.AX'
-    data = yf.download(ticker, period="1y")
-    history = []
-    for idx, row in data.iterrows():
-        history.append({
-            "timestamp": idx.isoformat(),
-            "open": row["Open"],
-            "high": row["High"],
-            "low": row["Low"],
-            "close": row["Close"],
-            "volume": row["Volume"]
-        })
-    return {"symbol": symbol, "history": history}
+def get_history(
+    request: Request,
+    symbol: str,
+    format: Optional[str] = Query(None, description="json (default), columnar, msgpack or arrow"),
+):
+    try:
+        fmt = bar_encoding.negotiate(format, request.headers.get("accept"))
+    except bar_encoding.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    symbol = _checked_symbol(symbol)
+    start = datetime.date.today() - datetime.timedelta(days=365)
+    bars = bar_store.get_bars(symbol, start=start)
+    # Validators follow the latest bar and its last rewrite
+    updated_at = bar_store.updated_at(symbol) or 0
+    last_ts = int(bars.timestamp[-1]) if len(bars) else 0
+    first_ts = int(bars.timestamp[0]) if len(bars) else 0
+    etag = f'W/"{symbol}-{fmt}-{first_ts}-{last_ts}-{len(bars)}-{int(updated_at * 1000)}"'
+    last_modified = formatdate(max(updated_at, last_ts), usegmt=True)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    else:
+        since = request.headers.get("if-modified-since")
+        try:
+            not_modified = since is not None and int(max(updated_at, last_ts)) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    try:
+        body = bar_encoding.encode(bars, symbol, fmt)
+    except bar_encoding.UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    return Response(content=body, media_type=bar_encoding.FORMATS[fmt], headers=headers)
 
 @app.websocket("/ws/signals")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, symbols: Optional[str] = None):
+    # Optional ?symbols=CBA,BHP subscription; clients can change it later with
+    # {"action": "subscribe" | "unsubscribe", "symbols": [...]} or {"action": "subscribe_all"}
+    subscription = symbols.split(",") if symbols else None
+    try:
+        FanoutManager._tickers(subscription or ())
+    except ValueError:
+        await websocket.close(code=1008)  # policy violation: not a ticker
+        return
+    client = await manager.connect(websocket, subscription)
     try:
         while True:
-            await websocket.receive_text()  # Keep connection alive
+            manager.handle_message(client, await websocket.receive_text())
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        manager.disconnect(client)
 
 if __name__ == "__main__":
-    from db import Base, engine
+    from db import Base, engine, ensure_indexes
     Base.metadata.create_all(bind=engine)
+    ensure_indexes()
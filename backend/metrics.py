@@ -0,0 +1,195 @@
+# Stage timings and Prometheus metrics
+# stage("features") times a block into the anystock_stage_duration_seconds
+# histogram and, inside an HTTP request, into that response's Server-Timing
+# header. Gauges are read from callbacks when /metrics is scraped, so they
+# cost nothing between scrapes.
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+# Set METRICS_ENABLED=0 to turn stage timing and Server-Timing off
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (stage, seconds) pairs recorded while handling the current request
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge:
+    """Value read from fn() at scrape time; fn may return a number or {label value: number}."""
+
+    def __init__(self, name: str, help: str, fn, labelname: str = None, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelname = labelname
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                yield f"{self.name}{_format_labels((self.labelname,), (label,))} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name (e.g. a reloaded module) replaces the old metric
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "anystock_stage_duration_seconds", "Time spent in each stage of signal computation", ("stage",)))
+request_seconds = registry.register(Histogram(
+    "anystock_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")))
+
+
+def gauge(name: str, help: str, fn, labelname: str = None):
+    return registry.register(Gauge(name, help, fn, labelname))
+
+
+def counter(name: str, help: str, fn, labelname: str = None):
+    """A monotonically increasing total read from fn() at scrape time."""
+    return registry.register(Gauge(name, help, fn, labelname, kind="counter"))
+
+
+# --- Stage timing ---
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """Context manager timing a block as `name`."""
+    return _Stage(name) if ENABLED else _NO_STAGE
+
+
+def record(name: str, seconds: float):
+    stage_seconds.observe(seconds, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def server_timing(timings) -> str:
+    """Server-Timing header value; repeated stages are summed."""
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: request latency histogram plus a Server-Timing header of the request's stages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            return await self.app(scope, receive, send)
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                elapsed = time.perf_counter() - started
+                header = server_timing(timings + [("total", elapsed)])
+                message = {**message, "headers": list(message.get("headers", [])) +
+                           [(b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded
+            path = getattr(route, "path", None) or "unmatched"
+            request_seconds.observe(time.perf_counter() - started, scope["method"], path, status[0])
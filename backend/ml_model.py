@@ -1,96 +1,97 @@
 # Placeholder ML model for buy/sell signal prediction
 # Replace with your actual model logic and Azure ML integration
 
-def predict_buy_sell(symbol: str, price_data: list) -> dict:
-    import numpy as np
-    import pandas as pd
-    from sklearn.linear_model import LogisticRegression
-    import random, datetime
+import datetime
+import random
 
-    # If no price data, fallback to random
-    if not price_data or len(price_data) < 20:
-        label = random.choice([-1, 0, 1])  # -1: sell, 0: hold, 1: buy
-        buy_signal = label == 1
-        sell_signal = label == -1
-        hold_signal = label == 0
-        confidence = None  # No real confidence available
-        return {
-            "symbol": symbol,
-            "buy_signal": buy_signal,
-            "sell_signal": sell_signal,
-            "hold_signal": hold_signal,
-            "confidence": confidence,
-            "timestamp": datetime.datetime.utcnow().isoformat()
-        }
-
-    # Create a DataFrame from price_data
-    df = pd.DataFrame(price_data)
-    # Price percent change
-    df['pct_change'] = df['close'].pct_change().fillna(0)
-    # Moving averages
-    df['ma_5'] = df['close'].rolling(window=5).mean().fillna(df['close'])
-    df['ma_10'] = df['close'].rolling(window=10).mean().fillna(df['close'])
-    df['ma_20'] = df['close'].rolling(window=20).mean().fillna(df['close'])
-    df['ma_50'] = df['close'].rolling(window=50).mean().fillna(df['close'])
-    # Bollinger Bands
-    df['bb_middle'] = df['close'].rolling(window=20).mean().fillna(df['close'])
-    df['bb_std'] = df['close'].rolling(window=20).std().fillna(0)
-    df['bb_upper'] = df['bb_middle'] + 2 * df['bb_std']
-    df['bb_lower'] = df['bb_middle'] - 2 * df['bb_std']
-    # RSI (Relative Strength Index)
-    delta = df['close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean().fillna(0)
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean().fillna(0)
-    rs = gain / (loss + 1e-6)
-    df['rsi'] = 100 - (100 / (1 + rs))
-    # Volume percent change
-    df['vol_pct_change'] = df['volume'].pct_change().fillna(0)
-    # Feature: short vs long MA
-    df['ma_diff'] = df['ma_5'] - df['ma_20']
-
-    # Use trained model for prediction and confidence if available
-    import joblib
-    import os
-    model_path = os.path.join(os.path.dirname(__file__), 'best_model.pkl')
-    feature_cols = [
-        'pct_change', 'ma_5', 'ma_10', 'ma_20', 'ma_50',
-        'bb_upper', 'bb_lower', 'rsi', 'vol_pct_change', 'ma_diff'
-    ]
-    X_pred = df[feature_cols].iloc[[-1]]
-    if os.path.exists(model_path):
-        try:
-            model = joblib.load(model_path)
-            proba = model.predict_proba(X_pred)[0]
-            pred_label = model.predict(X_pred)[0]
-            last_label = int(pred_label)
-            confidence = proba[model.classes_.tolist().index(last_label)]
-        except Exception:
-            # fallback: use ma_diff
-            if df['ma_diff'].iloc[-1] > 0.01:
-                last_label = 1
-            elif df['ma_diff'].iloc[-1] < -0.01:
-                last_label = -1
-            else:
-                last_label = 0
-            confidence = 0
-    else:
-        # fallback: use ma_diff
-        if df['ma_diff'].iloc[-1] > 0.01:
-            last_label = 1
-        elif df['ma_diff'].iloc[-1] < -0.01:
-            last_label = -1
-        else:
-            last_label = 0
-        confidence = 0
-    buy_signal = last_label == 1
-    sell_signal = last_label == -1
-    hold_signal = last_label == 0
 
+def _signal(symbol: str, label: int, confidence, model_version) -> dict:
     return {
         "symbol": symbol,
-        "buy_signal": buy_signal,
-        "sell_signal": sell_signal,
-        "hold_signal": hold_signal,
+        "buy_signal": label == 1,
+        "sell_signal": label == -1,
+        "hold_signal": label == 0,
         "confidence": confidence,
-        "timestamp": datetime.datetime.utcnow().isoformat()
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "model_version": model_version
     }
+
+
+def _random_signal(symbol: str) -> dict:
+    # No real confidence available without enough price data
+    label = random.choice([-1, 0, 1])  # -1: sell, 0: hold, 1: buy
+    return _signal(symbol, label, None, None)
+
+
+def _ma_diff_label(ma_diff: float) -> int:
+    if ma_diff > 0.01:
+        return 1
+    elif ma_diff < -0.01:
+        return -1
+    return 0
+
+
+def predict_from_features(symbols: list, X) -> list:
+    """Score a stacked (n_symbols, n_features) matrix with one predict_proba call.
+
+    Tree ensembles run through the compiled NumPy predictor (see tree_ensemble.py).
+    """
+    from features import FEATURE_COLS
+    from metrics import stage
+    from model_registry import registry
+    with stage("model_load"):
+        loaded = registry.get()
+    try:
+        if loaded is None:
+            raise LookupError("No trained model available")
+        with stage("inference"):
+            labels, confidences = loaded.predict_label(X)
+        return [
+            _signal(symbol, int(label), float(conf), loaded.version)
+            for symbol, label, conf in zip(symbols, labels, confidences)
+        ]
+    except Exception:
+        # fallback: use ma_diff
+        ma_diff = X[:, FEATURE_COLS.index('ma_diff')]
+        return [_signal(symbol, _ma_diff_label(d), 0, None) for symbol, d in zip(symbols, ma_diff)]
+
+
+def predict_buy_sell_batch(price_arrays: dict) -> dict:
+    """Predict signals for many symbols at once.
+
+    price_arrays maps symbol -> (close, volume) or (close, volume, bar timestamps)
+    arrays ordered oldest first; with timestamps the symbol's rolling feature
+    state is kept between calls. Returns symbol -> signal dict.
+    """
+    import numpy as np
+    from features import latest_features
+    from metrics import stage
+    results = {}
+    scored, rows = [], []
+    with stage("features"):
+        for symbol, (close, volume, *timestamps) in price_arrays.items():
+            # If no price data, fallback to random
+            if len(close) < 20:
+                results[symbol] = _random_signal(symbol)
+                continue
+            scored.append(symbol)
+            rows.append(latest_features(close, volume, symbol, timestamps[0] if timestamps else None))
+    if scored:
+        for symbol, signal in zip(scored, predict_from_features(scored, np.vstack(rows))):
+            results[symbol] = signal
+    return results
+
+
+def predict_buy_sell(symbol: str, price_data: list) -> dict:
+    import numpy as np
+    from features import WARMUP_BARS
+
+    # If no price data, fallback to random
+    if not price_data or len(price_data) < 20:
+        return _random_signal(symbol)
+
+    # Only the trailing warm-up window is needed for the latest feature row
+    recent = price_data[-(WARMUP_BARS + 1):]
+    close = np.array([bar["close"] for bar in recent], dtype=np.float64)
+    volume = np.array([bar["volume"] for bar in recent], dtype=np.float64)
+    return predict_buy_sell_batch({symbol: (close, volume)})[symbol]
@@ -0,0 +1,144 @@
+# Process-wide model registry
+# Loads best_model.pkl once per process and hot-swaps it when train_model.py
+# writes a new file, so /predict never unpickles the model on the request path.
+# Tree ensembles are served through their compiled NumPy form (tree_ensemble.py).
+import hashlib
+import os
+import threading
+import time
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), 'best_model.pkl'))
+# How often (seconds) to stat the model file for changes
+RELOAD_CHECK_SECONDS = float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", "1.0"))
+# Set to 0 to always predict through sklearn/xgboost
+USE_COMPILED = os.getenv("COMPILED_PREDICTOR", "1") == "1"
+# Larger batches are faster through the library's native predictor
+COMPILED_MAX_ROWS = int(os.getenv("COMPILED_PREDICTOR_MAX_ROWS", "256"))
+
+
+def compiled_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+class LoadedModel:
+    """An immutable snapshot of a loaded model and the labels of its classes."""
+
+    def __init__(self, model, version: str, labels, mtime_ns: int, size: int, compiled=None):
+        self.model = model
+        self.version = version
+        self.labels = labels
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.compiled = compiled
+
+    def _as_input(self, X):
+        # Models fitted on a DataFrame expect the same column names
+        names = getattr(self.model, 'feature_names_in_', None)
+        if names is not None and not hasattr(X, 'columns'):
+            import pandas as pd
+            return pd.DataFrame(X, columns=names)
+        return X
+
+    def predict_proba(self, X):
+        if self.compiled is not None and len(X) <= COMPILED_MAX_ROWS:
+            return self.compiled.predict_proba(X)
+        return self.model.predict_proba(self._as_input(X))
+
+    def predict_label(self, X):
+        """Return (labels, confidences) from a single predict_proba call."""
+        import numpy as np
+        proba = self.predict_proba(X)
+        idx = np.argmax(proba, axis=1)
+        return self.labels[idx], proba[np.arange(len(idx)), idx]
+
+
+def _signal_labels(model):
+    import numpy as np
+    classes = np.asarray(model.classes_)
+    # XGBoost is trained on labels mapped -1 -> 0, 0 -> 1, 1 -> 2 (see train_model.py)
+    if type(model).__name__.startswith('XGB') and classes.tolist() == [0, 1, 2]:
+        return np.array([-1, 0, 1])
+    return classes.astype(int)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _compiled(model, model_path: str, sha256: str):
+    """The exported compiled ensemble for this exact model file, else compile it here; None if unsupported."""
+    from tree_ensemble import CompiledEnsemble, compile_model
+    try:
+        compiled = CompiledEnsemble.load(compiled_path(model_path))
+        if compiled.meta.get('model_sha256') == sha256:
+            return compiled
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        return compile_model(model)
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    def __init__(self, path: str = MODEL_PATH, check_interval: float = RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._current = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, stat) -> LoadedModel:
+        import joblib
+        mtime_ns, size = stat
+        sha256 = file_sha256(self.path)
+        version = f"{sha256[:12]}-{mtime_ns // 1_000_000_000}"
+        model = joblib.load(self.path)
+        compiled = _compiled(model, self.path, sha256) if USE_COMPILED else None
+        return LoadedModel(model, version, _signal_labels(model), mtime_ns, size, compiled)
+
+    def reload(self, force: bool = False):
+        """Reload the model if the file changed. Returns the current snapshot or None."""
+        with self._lock:
+            self._last_check = time.monotonic()
+            stat = self._stat()
+            if stat is None:
+                self._current = None
+                return None
+            current = self._current
+            if not force and current is not None and (current.mtime_ns, current.size) == stat:
+                return current
+            # Swap in the new snapshot with a single reference assignment;
+            # in-flight requests keep using the snapshot they already hold.
+            self._current = self._load(stat)
+            return self._current
+
+    def get(self):
+        """Return the current model snapshot, reloading if the file changed."""
+        current = self._current
+        if current is not None and time.monotonic() - self._last_check < self.check_interval:
+            return current
+        try:
+            return self.reload()
+        except Exception:
+            # A half-written or incompatible file keeps the previous model serving
+            return current
+
+    @property
+    def version(self):
+        current = self._current
+        return current.version if current is not None else None
+
+
+registry = ModelRegistry()
@@ -0,0 +1,264 @@
+# Pluggable hyperparameter search for train_model.py
+# Candidates are scored on time-ordered walk-forward folds (no future bars in
+# training), strategies decide how much fitting each candidate gets, and every
+# evaluation is recorded with fit time and inference latency per row.
+import itertools
+import json
+import time
+
+import numpy as np
+
+# Rows closer than this many days to a validation block are left out of the
+# fold's training set, since their labels look ahead into it (see generate_training_data.N)
+EMBARGO_DAYS = 5
+# sell, hold, buy; every fold's training rows must contain all three
+CLASSES = (-1, 0, 1)
+# Share of the latest training days XGBoost holds out for early stopping
+EARLY_STOPPING_FRACTION = 0.1
+
+
+# --- Walk-forward folds ---
+def walk_forward_folds(dates, n_folds: int = 3, embargo_days: int = EMBARGO_DAYS):
+    """Expanding-window folds over row dates: train on every block before the validation block."""
+    dates = np.asarray(dates)
+    days = np.unique(dates)
+    blocks = np.array_split(days, n_folds + 1)
+    folds = []
+    for k in range(1, n_folds + 1):
+        val_start, val_end = blocks[k][0], blocks[k][-1]
+        embargo_start = days[max(np.searchsorted(days, val_start) - embargo_days, 0)]
+        train = np.flatnonzero(dates < embargo_start)
+        val = np.flatnonzero((dates >= val_start) & (dates <= val_end))
+        if len(train) and len(val):
+            folds.append((train, val))
+    return folds
+
+
+def has_every_class(y) -> bool:
+    return set(np.unique(y).tolist()) >= set(CLASSES)
+
+
+def early_stopping_split(dates, fraction: float = EARLY_STOPPING_FRACTION, embargo_days: int = EMBARGO_DAYS):
+    """(fit rows, eval rows): eval is the latest `fraction` of days, fit stops embargo_days before it.
+
+    Rows are stored symbol by symbol, so the split has to go by date rather than row position.
+    """
+    dates = np.asarray(dates)
+    days = np.unique(dates)
+    cut = min(max(int(len(days) * (1 - fraction)), 1), len(days) - 1)
+    fit = np.flatnonzero(dates < days[max(cut - embargo_days, 0)])
+    return fit, np.flatnonzero(dates >= days[cut])
+
+
+# --- Candidates ---
+class Candidate:
+    """One estimator configuration. `resource` is the number of trees it may grow."""
+
+    def __init__(self, family: str, params: dict):
+        self.family = family
+        self.params = dict(params)
+
+    @property
+    def name(self):
+        return f"{self.family}(" + ", ".join(f"{k}={v}" for k, v in sorted(self.params.items())) + ")"
+
+    def build(self, resource: int):
+        if self.family == 'RandomForest':
+            from sklearn.ensemble import RandomForestClassifier
+            return RandomForestClassifier(n_estimators=resource, n_jobs=-1, random_state=42, **self.params)
+        if self.family == 'XGBoost':
+            from xgboost import XGBClassifier
+            return XGBClassifier(n_estimators=resource, eval_metric='mlogloss', early_stopping_rounds=10,
+                                 n_jobs=-1, random_state=42, **self.params)
+        raise ValueError(f"Unknown model family {self.family}")
+
+    def encode(self, y):
+        # XGBoost needs labels 0..2: -1 -> 0, 0 -> 1, 1 -> 2
+        return y + 1 if self.family == 'XGBoost' else y
+
+    def fit(self, X, y, resource: int, dates=None, embargo_days: int = EMBARGO_DAYS):
+        """Fit on every row; XGBoost early-stops on the rows of the latest days (needs their dates)."""
+        model = self.build(resource)
+        if self.family == 'XGBoost':
+            if dates is None:
+                raise ValueError("XGBoost early stopping needs the training rows' dates")
+            fit, held_out = early_stopping_split(dates, embargo_days=embargo_days)
+            if len(fit) and len(held_out) and has_every_class(y[fit]):
+                model.fit(X[fit], self.encode(y[fit]), eval_set=[(X[held_out], self.encode(y[held_out]))],
+                          verbose=False)
+                return model
+            # Too few days, or the early part lacks a class: fit every row for the full tree count
+            model.set_params(early_stopping_rounds=None)
+        model.fit(X, self.encode(y))
+        return model
+
+    def score(self, model, X, y):
+        return float(np.mean(model.predict(X) == self.encode(y)))
+
+
+def default_candidates():
+    grids = {
+        'RandomForest': {'max_depth': [3, 5, 10], 'min_samples_split': [2, 5]},
+        'XGBoost': {'max_depth': [3, 5, 10], 'learning_rate': [0.01, 0.1]},
+    }
+    candidates = []
+    for family, grid in grids.items():
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            candidates.append(Candidate(family, dict(zip(keys, values))))
+    return candidates
+
+
+def inference_latency(model, X, repeats: int = 20):
+    """(single-row seconds, per-row seconds in a batch of up to 1000) for predict_proba."""
+    row = np.ascontiguousarray(X[-1:])
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - started)
+    batch = np.ascontiguousarray(X[-1000:])
+    started = time.perf_counter()
+    model.predict_proba(batch)
+    return float(np.median(timings)), (time.perf_counter() - started) / len(batch)
+
+
+# --- Search strategies ---
+class BudgetExceeded(Exception):
+    pass
+
+
+class SearchStrategy:
+    name = 'base'
+
+    def __init__(self, budget_seconds: float = None, latency_penalty: float = 0.0):
+        self.budget_seconds = budget_seconds
+        self.latency_penalty = latency_penalty
+        self.report = []
+        self._deadline = None
+        self._dates = None
+        self.embargo_days = EMBARGO_DAYS
+
+    def _check_budget(self):
+        # The first evaluation always completes so there is a model to return
+        if self.report and self._deadline is not None and time.monotonic() > self._deadline:
+            raise BudgetExceeded()
+
+    def selection_score(self, entry: dict) -> float:
+        # Accuracy minus a penalty per millisecond of single-row inference
+        return entry['score'] - self.latency_penalty * entry['latency_ms_single_row']
+
+    def evaluate(self, candidate: Candidate, X, y, folds, resource: int, round_: int = 0) -> dict:
+        scores, fit_seconds, model = [], 0.0, None
+        for train, val in folds:
+            self._check_budget()
+            started = time.perf_counter()
+            model = candidate.fit(X[train], y[train], resource, self._dates[train], self.embargo_days)
+            fit_seconds += time.perf_counter() - started
+            scores.append(candidate.score(model, X[val], y[val]))
+        single, per_row = inference_latency(model, X[folds[-1][1]])
+        entry = {
+            'candidate': candidate.name,
+            'family': candidate.family,
+            'params': candidate.params,
+            'round': round_,
+            'resource': resource,
+            'fold_scores': scores,
+            'score': float(np.mean(scores)),
+            'fit_seconds': fit_seconds,
+            'latency_ms_single_row': single * 1000,
+            'latency_us_per_row_batch': per_row * 1e6,
+        }
+        entry['selection_score'] = self.selection_score(entry)
+        self.report.append(entry)
+        print(f"[{self.name}] round {round_} {candidate.name} trees={resource}: "
+              f"score={entry['score']:.4f} fit={fit_seconds:.1f}s latency={entry['latency_ms_single_row']:.2f}ms")
+        return entry
+
+    def run(self, candidates, X, y, folds, dates, embargo_days: int = EMBARGO_DAYS):
+        """Return (best candidate, its resource); evaluations accumulate in self.report.
+
+        dates are the rows' dates (for XGBoost's early-stopping holdout). Folds whose
+        training rows lack a class are skipped for every candidate.
+        """
+        self._deadline = time.monotonic() + self.budget_seconds if self.budget_seconds else None
+        self._dates = np.asarray(dates)
+        self.embargo_days = embargo_days
+        usable = [(train, val) for train, val in folds if has_every_class(y[train])]
+        if len(usable) < len(folds):
+            print(f"[{self.name}] skipping {len(folds) - len(usable)} fold(s) whose training rows lack a class")
+        if not usable:
+            return None
+        folds = usable
+        best = None
+        try:
+            best = self._search(candidates, X, y, folds)
+        except BudgetExceeded:
+            print(f"[{self.name}] wall-clock budget of {self.budget_seconds}s reached")
+        if best is None and self.report:
+            # Budget ran out mid-search: take the best completed evaluation so far
+            top = max(self.report, key=lambda e: e['selection_score'])
+            best = (next(c for c in candidates if c.name == top['candidate']), top['resource'])
+        return best
+
+    def _search(self, candidates, X, y, folds):
+        raise NotImplementedError
+
+
+class GridSearch(SearchStrategy):
+    """Every candidate at each tree count (the original exhaustive search)."""
+    name = 'grid'
+
+    def __init__(self, resources=(50, 100), **kwargs):
+        super().__init__(**kwargs)
+        self.resources = resources
+
+    def _search(self, candidates, X, y, folds):
+        entries = []
+        for candidate in candidates:
+            for resource in self.resources:
+                entries.append((self.evaluate(candidate, X, y, folds, resource), candidate))
+        entry, candidate = max(entries, key=lambda e: e[0]['selection_score'])
+        return candidate, entry['resource']
+
+
+class SuccessiveHalving(SearchStrategy):
+    """Start every candidate with few trees and keep the best 1/eta, growing trees by eta each round."""
+    name = 'halving'
+
+    def __init__(self, min_resource: int = 12, max_resource: int = 300, eta: int = 3, **kwargs):
+        super().__init__(**kwargs)
+        self.min_resource = min_resource
+        self.max_resource = max_resource
+        self.eta = eta
+
+    def _search(self, candidates, X, y, folds):
+        survivors = list(candidates)
+        resource = self.min_resource
+        round_ = 0
+        while True:
+            entries = [(self.evaluate(c, X, y, folds, resource, round_), c) for c in survivors]
+            entries.sort(key=lambda e: e[0]['selection_score'], reverse=True)
+            if len(entries) == 1 or resource >= self.max_resource:
+                return entries[0][1], resource
+            survivors = [c for _, c in entries[:max(len(entries) // self.eta, 1)]]
+            resource = min(resource * self.eta, self.max_resource)
+            round_ += 1
+
+
+STRATEGIES = {
+    GridSearch.name: GridSearch,
+    SuccessiveHalving.name: SuccessiveHalving,
+}
+
+
+def write_report(path: str, strategy: SearchStrategy, best, extra: dict = None):
+    with open(path, 'w') as f:
+        json.dump({
+            'strategy': strategy.name,
+            'budget_seconds': strategy.budget_seconds,
+            'latency_penalty': strategy.latency_penalty,
+            'best': {'candidate': best[0].name, 'resource': best[1]} if best else None,
+            'evaluations': strategy.report,
+            **(extra or {}),
+        }, f, indent=1)
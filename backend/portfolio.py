@@ -0,0 +1,167 @@
+# Portfolio signals
+# Scores every holding of a portfolio (by default the 13F list the frontend
+# shows) with one feature pass and one predict_proba call, and aggregates the
+# signals by position weight (normalised by gross exposure, so short positions
+# can't cancel the total out). Per-holding signals share the prediction cache
+# with /predict, keyed by (ticker, latest bar timestamp, model version), so
+# dashboard refreshes only recompute holdings with a new bar or model and
+# never store a signal twice.
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import prediction_cache
+from data_providers import DEFAULT_MARKET, to_symbol, to_ticker
+from features import WARMUP_BARS
+
+HOLDINGS_PATH = os.path.join(os.path.dirname(__file__), '../frontend/public/berkshire_13f.json')
+# 13F filings list US securities; holdings without a market field use this
+HOLDINGS_MARKET = os.getenv("PORTFOLIO_HOLDINGS_MARKET", "US")
+PORTFOLIO_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "8"))
+
+
+def load_holdings(path: str = HOLDINGS_PATH) -> list:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _signal(signal: dict, bars) -> dict:
+    return {**signal, "current_price": float(bars.close[-1]), "open_price": float(bars.open[-1]),
+            "high_price": float(bars.high[-1]), "low_price": float(bars.low[-1])}
+
+
+def _fetch(tickers: list, store, workers: int):
+    """(ticker -> latest bars, ticker -> error), fetched concurrently."""
+    start = datetime.date.today() - datetime.timedelta(days=365)
+
+    def fetch(ticker):
+        try:
+            return ticker, store.get_bars(ticker, start=start).tail(WARMUP_BARS + 1), None
+        except Exception as e:
+            return ticker, None, str(e)
+
+    latest_bars, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for ticker, bars, error in pool.map(fetch, tickers):
+            if error is None and bars.empty:
+                error = f"{ticker}: no data"
+            if error is not None:
+                errors[ticker] = error
+            else:
+                latest_bars[ticker] = bars
+    return latest_bars, errors
+
+
+def _score(latest_bars: dict) -> dict:
+    """ticker -> signal with prices, from one batched prediction."""
+    from ml_model import predict_buy_sell_batch
+    results = predict_buy_sell_batch({t: (b.close, b.volume, b.timestamp) for t, b in latest_bars.items()})
+    return {t: _signal({**results[t], "symbol": to_symbol(t)}, b) for t, b in latest_bars.items()}
+
+
+def _weights(holdings: list, signals: list):
+    """Position weights of the scored holdings and the basis they were taken from."""
+    if all(h.get("shares") for h in holdings):
+        return [h["shares"] * s["current_price"] for h, s in zip(holdings, signals)], "market_value"
+    if all(h.get("percent_portfolio") for h in holdings):
+        return [h["percent_portfolio"] for h in holdings], "percent_portfolio"
+    return [1.0] * len(holdings), "equal"
+
+
+def aggregate(holdings: list, signals: list) -> dict:
+    """Position-weighted buy/sell/hold shares, net score (buy - sell, -1..1) and confidence.
+
+    Weights are divided by the gross exposure (sum of absolute weights), so a
+    short position counts against the signal it carries.
+    """
+    weights, basis = _weights(holdings, signals)
+    total = sum(abs(w) for w in weights)
+    if not total:
+        return {"signal": None, "score": None, "buy_weight": 0.0, "sell_weight": 0.0, "hold_weight": 0.0,
+                "confidence": None, "weight_basis": basis, "holdings": len(signals),
+                "weights": [0.0] * len(signals)}
+    shares = {
+        kind: sum(w for w, s in zip(weights, signals) if s[kind + "_signal"]) / total
+        for kind in ("buy", "sell", "hold")
+    }
+    confident = [(w, s["confidence"]) for w, s in zip(weights, signals) if s.get("confidence") is not None]
+    confident_total = sum(abs(w) for w, _ in confident)
+    confidence = sum(abs(w) * c for w, c in confident) / confident_total if confident_total else None
+    return {
+        "signal": max(shares, key=shares.get),
+        "score": shares["buy"] - shares["sell"],
+        "buy_weight": shares["buy"],
+        "sell_weight": shares["sell"],
+        "hold_weight": shares["hold"],
+        "confidence": confidence,
+        "weight_basis": basis,
+        "holdings": len(signals),
+        "weights": [w / total for w in weights],
+    }
+
+
+def portfolio_signals(holdings=None, market: str = None, store=None, cache=prediction_cache.cache,
+                      record=None, workers: int = PORTFOLIO_WORKERS) -> dict:
+    """Signals for every holding plus their position-weighted aggregate.
+
+    holdings are dicts with symbol and optionally market, name, shares and
+    percent_portfolio; the default is the bundled 13F file. record(rows), when
+    given, receives stock_signals rows for the signals computed by this call.
+    """
+    from model_registry import registry
+    from signal_sweep import signal_row
+    if store is None:
+        from bar_store import store
+    if holdings is None:
+        holdings = load_holdings()
+        market = market or HOLDINGS_MARKET
+
+    resolved, errors = [], {}
+    for holding in holdings:
+        symbol = holding["symbol"].strip().upper()
+        holding_market = (holding.get("market") or market or DEFAULT_MARKET).upper()
+        try:
+            ticker = to_ticker(symbol, holding_market)
+        except ValueError as e:
+            errors[symbol] = str(e)
+            continue
+        resolved.append((holding, symbol, holding_market, ticker))
+    tickers = list(dict.fromkeys(ticker for *_, ticker in resolved))
+
+    latest_bars, failed = _fetch(tickers, store, workers)
+    symbols = {ticker: symbol for _, symbol, _, ticker in resolved}
+    errors.update({symbols[t]: detail for t, detail in failed.items()})
+
+    # Signals from another model are stale even before they expire
+    loaded = registry.get()
+    version = loaded.version if loaded is not None else None
+    keys = {t: prediction_cache.PredictionCache.key(t, b.timestamp[-1], version) for t, b in latest_bars.items()}
+    signals = {}
+    if cache is not None:
+        for ticker, bars in latest_bars.items():
+            hit = cache.get(keys[ticker], bars.updated_at)
+            if hit is not None:
+                signals[ticker] = hit
+    missing = {t: b for t, b in latest_bars.items() if t not in signals}
+    computed = _score(missing) if missing else {}
+    for ticker, signal in computed.items():
+        if cache is not None:
+            cache.put(keys[ticker], signal, latest_bars[ticker].updated_at)
+    signals.update(computed)
+    if record is not None and computed:
+        # Stored under the symbol /predict uses, so /signal_history and latest_signals see one key
+        record([signal_row(computed[t], latest_bars[t]) for t in computed])
+
+    scored = [entry for entry in resolved if entry[-1] in signals]
+    agg = aggregate([entry[0] for entry in scored], [signals[entry[-1]] for entry in scored])
+    weights = agg.pop("weights")
+    return {
+        "holdings": [
+            {**signals[ticker], "symbol": symbol, "ticker": ticker, "name": holding.get("name"),
+             "market": holding_market, "weight": weight, "cached": ticker not in computed}
+            for (holding, symbol, holding_market, ticker), weight in zip(scored, weights)
+        ],
+        "aggregate": agg,
+        "errors": [{"symbol": s, "detail": d} for s, d in errors.items()],
+    }
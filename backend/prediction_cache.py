@@ -0,0 +1,121 @@
+# Prediction result cache
+# A daily-bar signal only changes when a new bar arrives, the forming bar is
+# rewritten or the model changes, so results are cached per
+# (ticker, latest bar timestamp, model version). While the ASX session is live
+# the forming bar can change at any refresh, so entries expire after
+# PREDICTION_CACHE_SESSION_TTL_SECONDS; outside it they last until the next
+# open. Appending bars drops the symbol's entries, in this process through a
+# bar store listener and in others through the bar store's updated_at.
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import asx_calendar
+from data_providers import to_ticker
+
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "1") == "1"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_SESSION_TTL = float(os.getenv("PREDICTION_CACHE_SESSION_TTL_SECONDS", "300"))
+# Providers publish the final daily bar some time after the closing auction
+PREDICTION_CACHE_SETTLE = datetime.timedelta(minutes=float(os.getenv("PREDICTION_CACHE_SETTLE_MINUTES", "30")))
+
+
+def expires_at(at: datetime.datetime = None) -> float:
+    """Epoch seconds until which a signal computed at `at` (default now) stays valid."""
+    at = at or asx_calendar.now()
+    if asx_calendar.in_session(at, after_close=PREDICTION_CACHE_SETTLE):
+        return at.timestamp() + PREDICTION_CACHE_SESSION_TTL
+    return asx_calendar.next_open(at).timestamp()
+
+
+class PredictionCache:
+    """LRU of signals keyed by (ticker, latest bar timestamp, model version)."""
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE, enabled: bool = PREDICTION_CACHE_ENABLED):
+        self.max_size = max_size
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> (expires, bars updated_at, signal)
+        self._keys = {}  # ticker -> keys, for invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(symbol: str, bar_timestamp: int, model_version) -> tuple:
+        return to_ticker(symbol.upper()), int(bar_timestamp), model_version
+
+    def get(self, key: tuple, updated_at=None):
+        """The cached signal, or None. updated_at: the bars' last write, to catch ingest by other processes."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, stored_updated_at, signal = entry
+            if expires <= time.time() or (updated_at is not None and updated_at != stored_updated_at):
+                self._remove(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return signal
+
+    def put(self, key: tuple, signal, updated_at=None, expires: float = None):
+        if not self.enabled:
+            return
+        expires = expires if expires is not None else expires_at()
+        with self._lock:
+            self._entries[key] = (expires, updated_at, signal)
+            self._entries.move_to_end(key)
+            self._keys.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def invalidate(self, symbol: str = None):
+        """Drop the symbol's entries (every entry when symbol is None)."""
+        with self._lock:
+            if symbol is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._keys.clear()
+                return
+            for key in list(self._keys.get(to_ticker(symbol.upper()), ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+cache = PredictionCache()
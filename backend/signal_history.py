@@ -0,0 +1,184 @@
+# Keyset-paginated, column-projected queries over stock_signals
+# Pages are ordered newest first by (timestamp, id) and walk the
+# (symbol, timestamp) index; rows come back as tuples, not ORM objects.
+# Rows past the retention window live on as daily rollups in
+# stock_signals_daily (see signal_retention.py); pages merge them in by their
+# last timestamp with id 0, below every raw row of the same instant.
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, literal, or_, select
+
+from db import SessionLocal, StockSignal, StockSignalDaily
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+
+_COLUMNS = (
+    StockSignal.id,
+    StockSignal.symbol,
+    StockSignal.timestamp,
+    StockSignal.buy_signal,
+    StockSignal.sell_signal,
+    StockSignal.hold_signal,
+    StockSignal.confidence,
+    StockSignal.current_price,
+    StockSignal.open_price,
+    StockSignal.high_price,
+    StockSignal.low_price,
+)
+
+_DAILY_COLUMNS = (
+    literal(0).label("id"),
+    StockSignalDaily.symbol,
+    StockSignalDaily.last_timestamp.label("timestamp"),
+    StockSignalDaily.buy_signal,
+    StockSignalDaily.sell_signal,
+    StockSignalDaily.hold_signal,
+    StockSignalDaily.confidence,
+    StockSignalDaily.close_price.label("current_price"),
+    StockSignalDaily.open_price,
+    StockSignalDaily.high_price,
+    StockSignalDaily.low_price,
+    StockSignalDaily.day,
+    StockSignalDaily.signal_count,
+    StockSignalDaily.buy_count,
+    StockSignalDaily.sell_count,
+    StockSignalDaily.hold_count,
+    StockSignalDaily.mean_confidence,
+)
+
+
+def encode_cursor(timestamp: datetime.datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """Return (timestamp, id) from an opaque cursor; raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(ts), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _to_dict(row) -> dict:
+    if row.id == 0:
+        return _daily_to_dict(row)
+    return {
+        "symbol": row.symbol,
+        "resolution": "raw",
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "buy_signal": bool(row.buy_signal),
+        "sell_signal": bool(row.sell_signal),
+        "hold_signal": bool(row.hold_signal),
+        "confidence": row.confidence,
+        "current_price": row.current_price,
+        "open_price": row.open_price,
+        "high_price": row.high_price,
+        "low_price": row.low_price
+    }
+
+
+def _daily_to_dict(row) -> dict:
+    # The day's last signal and price, plus what happened over the whole day
+    return {
+        "symbol": row.symbol,
+        "resolution": "1d",
+        "day": row.day.isoformat(),
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "buy_signal": bool(row.buy_signal),
+        "sell_signal": bool(row.sell_signal),
+        "hold_signal": bool(row.hold_signal),
+        "confidence": row.confidence,
+        "current_price": row.current_price,
+        "open_price": row.open_price,
+        "high_price": row.high_price,
+        "low_price": row.low_price,
+        "signal_count": row.signal_count,
+        "buy_count": row.buy_count,
+        "sell_count": row.sell_count,
+        "hold_count": row.hold_count,
+        "mean_confidence": row.mean_confidence,
+    }
+
+
+def _page_query(symbol, limit, after=None, start=None, end=None):
+    query = select(*_COLUMNS).where(StockSignal.symbol == symbol)
+    if start is not None:
+        query = query.where(StockSignal.timestamp >= start)
+    if end is not None:
+        query = query.where(StockSignal.timestamp < end)
+    if after is not None:
+        ts, row_id = after
+        query = query.where(or_(
+            StockSignal.timestamp < ts,
+            and_(StockSignal.timestamp == ts, StockSignal.id < row_id),
+        ))
+    return query.order_by(StockSignal.timestamp.desc(), StockSignal.id.desc()).limit(limit)
+
+
+def _daily_page_query(symbol, limit, after=None, start=None, end=None):
+    query = select(*_DAILY_COLUMNS).where(StockSignalDaily.symbol == symbol)
+    if start is not None:
+        query = query.where(StockSignalDaily.last_timestamp >= start)
+    if end is not None:
+        query = query.where(StockSignalDaily.last_timestamp < end)
+    if after is not None:
+        ts, row_id = after
+        # Rollups sort as id 0: after a raw row at ts, the rollup at ts comes next
+        query = query.where(StockSignalDaily.last_timestamp < ts if row_id <= 0 else
+                            StockSignalDaily.last_timestamp <= ts)
+    return query.order_by(StockSignalDaily.last_timestamp.desc()).limit(limit)
+
+
+def _rows(db, symbol, limit, after=None, start=None, end=None) -> list:
+    """Up to `limit` raw and rolled-up rows after the cursor, newest first by (timestamp, id)."""
+    rows = db.execute(_page_query(symbol, limit, after, start, end)).all()
+    query = _daily_page_query(symbol, limit, after, start, end)
+    if len(rows) == limit:
+        # Only rollups newer than the page's oldest raw row can make it in (usually none)
+        query = query.where(StockSignalDaily.last_timestamp >= rows[-1].timestamp)
+    daily = db.execute(query).all()
+    if daily:
+        rows = sorted(rows + daily, key=lambda r: (r.timestamp, r.id), reverse=True)[:limit]
+    return rows
+
+
+def fetch_page(db, symbol: str, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+               start: datetime.datetime = None, end: datetime.datetime = None):
+    """Return (history dicts, next_cursor or None) for one page, newest first."""
+    after = decode_cursor(cursor) if cursor else None
+    # Fetch one extra row to know whether another page exists
+    rows = _rows(db, symbol, limit + 1, after, start, end)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [_to_dict(row) for row in rows], next_cursor
+
+
+def iter_ndjson(symbol: str, start: datetime.datetime = None, end: datetime.datetime = None,
+                limit: int = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield NDJSON lines for an export, paging through keyset batches on its own session."""
+    db = SessionLocal()
+    try:
+        after = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            rows = _rows(db, symbol, size, after, start, end)
+            if not rows:
+                break
+            yield ''.join(json.dumps(_to_dict(row)) + '\n' for row in rows)
+            if len(rows) < size:
+                break
+            after = (rows[-1].timestamp, rows[-1].id)
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        db.close()
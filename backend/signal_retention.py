@@ -0,0 +1,240 @@
+# stock_signals retention and daily rollup
+# Rows from the last SIGNAL_RETENTION_DAYS stay at full resolution. Older
+# rows are folded into per-symbol, per-UTC-day aggregates in
+# stock_signals_daily and deleted in the same transaction, at most
+# SIGNAL_RETENTION_BATCH_SIZE rows at a time, so the signal writer and
+# /signal_history never wait long on a lock. Rollups older than
+# SIGNAL_ROLLUP_RETENTION_DAYS are purged in batches too.
+# Run daily by the signal_retention timer function; locally:
+#   python signal_retention.py [--retention-days 30] [--dry-run]
+import argparse
+import datetime
+import json
+import os
+import time
+
+from sqlalchemy import delete, func, select
+
+from db import _IN_CHUNK, StockSignal, StockSignalDaily, session_scope
+
+SIGNAL_RETENTION_DAYS = int(os.getenv("SIGNAL_RETENTION_DAYS", "30"))
+# 0 keeps rollups forever
+SIGNAL_ROLLUP_RETENTION_DAYS = int(os.getenv("SIGNAL_ROLLUP_RETENTION_DAYS", str(5 * 365)))
+SIGNAL_RETENTION_BATCH_SIZE = int(os.getenv("SIGNAL_RETENTION_BATCH_SIZE", "2000"))
+# Pause between batches so other writers get the database
+SIGNAL_RETENTION_PAUSE = float(os.getenv("SIGNAL_RETENTION_PAUSE_SECONDS", "0.05"))
+
+_ROW_COLUMNS = (
+    StockSignal.id,
+    StockSignal.symbol,
+    StockSignal.timestamp,
+    StockSignal.buy_signal,
+    StockSignal.sell_signal,
+    StockSignal.hold_signal,
+    StockSignal.confidence,
+    StockSignal.current_price,
+    StockSignal.open_price,
+    StockSignal.high_price,
+    StockSignal.low_price,
+)
+_DAILY_COLUMNS = [c.key for c in StockSignalDaily.__table__.columns]
+
+
+def cutoff(retention_days: int, now: datetime.datetime = None) -> datetime.datetime:
+    """Start of the oldest UTC day kept at full resolution (timestamps are stored as naive UTC)."""
+    now = now or datetime.datetime.utcnow()
+    day = (now - datetime.timedelta(days=retention_days)).date()
+    return datetime.datetime(day.year, day.month, day.day)
+
+
+# --- Aggregates ---
+def _from_row(row) -> dict:
+    price = row.current_price
+    return {
+        "symbol": row.symbol,
+        "day": row.timestamp.date(),
+        "buy_signal": row.buy_signal,
+        "sell_signal": row.sell_signal,
+        "hold_signal": row.hold_signal,
+        "confidence": row.confidence,
+        "first_timestamp": row.timestamp,
+        "last_timestamp": row.timestamp,
+        "signal_count": 1,
+        "buy_count": int(bool(row.buy_signal)),
+        "sell_count": int(bool(row.sell_signal)),
+        "hold_count": int(bool(row.hold_signal)),
+        "mean_confidence": row.confidence,
+        "confidence_count": int(row.confidence is not None),
+        "open_price": row.open_price if row.open_price is not None else price,
+        "high_price": row.high_price if row.high_price is not None else price,
+        "low_price": row.low_price if row.low_price is not None else price,
+        "close_price": price,
+    }
+
+
+def _extreme(fn, a, b):
+    values = [v for v in (a, b) if v is not None]
+    return fn(values) if values else None
+
+
+def merge(a: dict, b: dict) -> dict:
+    """Combine two aggregates of the same symbol and day, in either order."""
+    first = a if a["first_timestamp"] <= b["first_timestamp"] else b
+    last = a if a["last_timestamp"] >= b["last_timestamp"] else b
+    n_confidence = a["confidence_count"] + b["confidence_count"]
+    mean_confidence = None
+    if n_confidence:
+        mean_confidence = sum(x["mean_confidence"] * x["confidence_count"]
+                              for x in (a, b) if x["confidence_count"]) / n_confidence
+    return {
+        "symbol": a["symbol"],
+        "day": a["day"],
+        "buy_signal": last["buy_signal"],
+        "sell_signal": last["sell_signal"],
+        "hold_signal": last["hold_signal"],
+        "confidence": last["confidence"],
+        "first_timestamp": first["first_timestamp"],
+        "last_timestamp": last["last_timestamp"],
+        "signal_count": a["signal_count"] + b["signal_count"],
+        "buy_count": a["buy_count"] + b["buy_count"],
+        "sell_count": a["sell_count"] + b["sell_count"],
+        "hold_count": a["hold_count"] + b["hold_count"],
+        "mean_confidence": mean_confidence,
+        "confidence_count": n_confidence,
+        "open_price": first["open_price"],
+        "high_price": _extreme(max, a["high_price"], b["high_price"]),
+        "low_price": _extreme(min, a["low_price"], b["low_price"]),
+        "close_price": last["close_price"],
+    }
+
+
+# --- Batches ---
+def rollup_batch(db, before: datetime.datetime, batch_size: int = SIGNAL_RETENTION_BATCH_SIZE):
+    """Fold up to batch_size raw rows older than `before` into their daily rollups and delete them.
+
+    Returns (rows rolled up, daily rows written). Commit per call to keep locks short.
+    """
+    # Oldest ids first: rows are inserted in time order, so the scan stops early
+    rows = db.execute(select(*_ROW_COLUMNS).where(StockSignal.timestamp < before)
+                      .order_by(StockSignal.id).limit(batch_size)).all()
+    if not rows:
+        return 0, 0
+    groups = {}
+    for row in rows:
+        agg = _from_row(row)
+        key = (agg["symbol"], agg["day"])
+        groups[key] = merge(groups[key], agg) if key in groups else agg
+
+    # Days already rolled up by an earlier batch or run
+    symbols = sorted({symbol for symbol, _ in groups})
+    days = sorted({day for _, day in groups})
+    existing = {}
+    for i in range(0, len(symbols), _IN_CHUNK):
+        query = select(StockSignalDaily).where(StockSignalDaily.symbol.in_(symbols[i:i + _IN_CHUNK]),
+                                               StockSignalDaily.day.in_(days))
+        for daily in db.scalars(query):
+            existing[(daily.symbol, daily.day)] = daily
+    for key, agg in groups.items():
+        daily = existing.get(key)
+        if daily is None:
+            db.add(StockSignalDaily(**agg))
+            continue
+        for column, value in merge({c: getattr(daily, c) for c in _DAILY_COLUMNS}, agg).items():
+            setattr(daily, column, value)
+
+    ids = [row.id for row in rows]
+    for i in range(0, len(ids), _IN_CHUNK):
+        db.execute(delete(StockSignal).where(StockSignal.id.in_(ids[i:i + _IN_CHUNK])))
+    return len(rows), len(groups)
+
+
+def purge_rollup_batch(db, before: datetime.date, batch_size: int = SIGNAL_RETENTION_BATCH_SIZE) -> int:
+    """Delete up to batch_size daily rollups older than `before`. Returns rows deleted."""
+    keys = db.execute(select(StockSignalDaily.symbol, StockSignalDaily.day)
+                      .where(StockSignalDaily.day < before).limit(batch_size)).all()
+    by_symbol = {}
+    for symbol, day in keys:
+        by_symbol.setdefault(symbol, []).append(day)
+    # Per symbol: SQL Server has no row-value IN
+    for symbol, days in by_symbol.items():
+        db.execute(delete(StockSignalDaily).where(StockSignalDaily.symbol == symbol, StockSignalDaily.day.in_(days)))
+    return len(keys)
+
+
+def pending(retention_days: int = SIGNAL_RETENTION_DAYS, rollup_retention_days: int = SIGNAL_ROLLUP_RETENTION_DAYS,
+            now: datetime.datetime = None) -> dict:
+    """Rows a run would roll up or purge, without changing anything."""
+    before = cutoff(retention_days, now)
+    with session_scope() as db:
+        raw = db.scalar(select(func.count()).select_from(StockSignal).where(StockSignal.timestamp < before))
+        rollups = 0
+        if rollup_retention_days:
+            rollups = db.scalar(select(func.count()).select_from(StockSignalDaily)
+                                .where(StockSignalDaily.day < cutoff(rollup_retention_days, now).date()))
+    return {"cutoff": before.isoformat(), "raw_rows": raw, "rollups_to_purge": rollups}
+
+
+def run_retention(retention_days: int = SIGNAL_RETENTION_DAYS,
+                  rollup_retention_days: int = SIGNAL_ROLLUP_RETENTION_DAYS,
+                  batch_size: int = SIGNAL_RETENTION_BATCH_SIZE, pause: float = SIGNAL_RETENTION_PAUSE,
+                  max_batches: int = None, now: datetime.datetime = None) -> dict:
+    """Roll up raw rows past the retention window and purge expired rollups, one batch per transaction."""
+    started = time.monotonic()
+    before = cutoff(retention_days, now)
+    rolled = written = batches = purged = 0
+    while max_batches is None or batches < max_batches:
+        with session_scope() as db:
+            n_rows, n_daily = rollup_batch(db, before, batch_size)
+        if not n_rows:
+            break
+        rolled += n_rows
+        written += n_daily
+        batches += 1
+        time.sleep(pause)
+    rolled_up = time.monotonic()
+    if rollup_retention_days:
+        purge_before = cutoff(rollup_retention_days, now).date()
+        while max_batches is None or batches < max_batches:
+            with session_scope() as db:
+                n = purge_rollup_batch(db, purge_before, batch_size)
+            if not n:
+                break
+            purged += n
+            batches += 1
+            time.sleep(pause)
+    return {
+        "cutoff": before.isoformat(),
+        "rolled_up_rows": rolled,
+        "daily_rows_written": written,
+        "purged_rollups": purged,
+        "batches": batches,
+        "rollup_seconds": round(rolled_up - started, 3),
+        "purge_seconds": round(time.monotonic() - rolled_up, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roll up and purge old stock_signals rows")
+    parser.add_argument('--retention-days', type=int, default=SIGNAL_RETENTION_DAYS,
+                        help="days of full-resolution rows to keep")
+    parser.add_argument('--rollup-retention-days', type=int, default=SIGNAL_ROLLUP_RETENTION_DAYS,
+                        help="days of daily rollups to keep (0 keeps them forever)")
+    parser.add_argument('--batch-size', type=int, default=SIGNAL_RETENTION_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument('--max-batches', type=int, default=None, help="stop after this many transactions")
+    parser.add_argument('--dry-run', action='store_true', help="only count the rows a run would touch")
+    args = parser.parse_args(argv)
+
+    from db import Base, engine, ensure_indexes
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    if args.dry_run:
+        summary = pending(args.retention_days, args.rollup_retention_days)
+    else:
+        summary = run_retention(args.retention_days, args.rollup_retention_days, args.batch_size,
+                                max_batches=args.max_batches)
+    print(json.dumps(summary, indent=1))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Scheduled batch signal sweep
+# Run by the fetch_asx_data timer function: refresh bars for every ASX symbol,
+# score all of them with one feature pass and one predict_proba call, and
+# bulk-write stock_signals plus the latest_signals table /predict serves from.
+# Locally: python signal_sweep.py --stub
+import argparse
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bar_store import store as default_store
+from data_providers import load_asx_symbols, to_ticker
+from db import session_scope, write_signals
+from features import WARMUP_BARS
+
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", "8"))
+
+
+def signal_row(signal: dict, bars) -> dict:
+    """Row for db.write_signals from an ml_model signal and the bars it was computed from."""
+    return dict(
+        symbol=signal["symbol"],
+        buy_signal=int(signal["buy_signal"]),
+        sell_signal=int(signal["sell_signal"]),
+        hold_signal=int(signal["hold_signal"]),
+        confidence=signal["confidence"],
+        timestamp=datetime.datetime.fromisoformat(signal["timestamp"]),
+        bar_timestamp=datetime.datetime.utcfromtimestamp(int(bars.timestamp[-1])),
+        current_price=float(bars.close[-1]),
+        open_price=float(bars.open[-1]),
+        high_price=float(bars.high[-1]),
+        low_price=float(bars.low[-1]),
+        model_version=signal.get("model_version"),
+    )
+
+
+def _refresh(store, symbols, workers: int) -> dict:
+    """Refresh every symbol's bars concurrently; returns symbol -> error for failures."""
+    def refresh(symbol):
+        try:
+            store.refresh(symbol, force=True)
+        except Exception as e:
+            return symbol, str(e)
+        return symbol, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return {symbol: error for symbol, error in pool.map(refresh, symbols) if error}
+
+
+def run_sweep(symbols=None, store=None, workers: int = SWEEP_WORKERS) -> dict:
+    """Refresh, score and store every symbol. Returns a summary of the run."""
+    from ml_model import predict_buy_sell_batch
+    store = store or default_store
+    symbols = list(dict.fromkeys(symbols or load_asx_symbols()))
+    started = time.monotonic()
+    errors = _refresh(store, symbols, workers)
+    refreshed = time.monotonic()
+
+    latest_bars = {}
+    for symbol in symbols:
+        bars = store.read(symbol).tail(WARMUP_BARS + 1)
+        if bars.empty:
+            errors.setdefault(symbol, f"{to_ticker(symbol)}: no data")
+            continue
+        latest_bars[symbol] = bars
+    signals = predict_buy_sell_batch({s: (b.close, b.volume, b.timestamp) for s, b in latest_bars.items()})
+    rows = [signal_row(signals[symbol], bars) for symbol, bars in latest_bars.items()]
+    scored = time.monotonic()
+
+    with session_scope() as db:
+        write_signals(db, rows)
+    return {
+        "symbols": len(symbols),
+        "signals": len(rows),
+        "errors": errors,
+        "refresh_seconds": round(refreshed - started, 3),
+        "predict_seconds": round(scored - refreshed, 3),
+        "write_seconds": round(time.monotonic() - scored, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute and store the latest signal for every ASX symbol")
+    parser.add_argument('--stub', action='store_true', help="use deterministic synthetic bars instead of the providers")
+    parser.add_argument('--symbols', help="comma-separated symbols (default: asx_symbols.json)")
+    parser.add_argument('--workers', type=int, default=SWEEP_WORKERS, help="concurrent bar refreshes")
+    args = parser.parse_args(argv)
+
+    from db import Base, engine
+    Base.metadata.create_all(bind=engine)
+    store = default_store
+    if args.stub:
+        from data_providers import StubProvider
+        store.provider = StubProvider()
+    summary = run_sweep(args.symbols.split(",") if args.symbols else None, store, args.workers)
+    print(json.dumps(summary, indent=1))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Write-behind persistence for StockSignal rows
+# Request handlers hand rows to submit() and return immediately; a background
+# thread bulk-inserts them when WRITER_BATCH_SIZE rows are pending or
+# WRITER_FLUSH_SECONDS have passed, and close() flushes whatever is left.
+# A failed batch is retried first, with exponential backoff, up to
+# WRITER_MAX_RETRIES times; then it is dropped (appended to
+# WRITER_DEAD_LETTER_PATH when set) so one bad row can't block later writes.
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from db import session_scope, write_signals
+from metrics import stage
+
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "500"))
+WRITER_FLUSH_SECONDS = float(os.getenv("WRITER_FLUSH_SECONDS", "0.5"))
+# Oldest rows are dropped (and counted) beyond this many pending rows
+WRITER_MAX_PENDING = int(os.getenv("WRITER_MAX_PENDING", "100000"))
+WRITER_MAX_RETRIES = int(os.getenv("WRITER_MAX_RETRIES", "5"))
+# JSON lines file for dropped batches (empty: only logged)
+WRITER_DEAD_LETTER_PATH = os.getenv("WRITER_DEAD_LETTER_PATH", "")
+
+
+class SignalWriter:
+    def __init__(self, batch_size: int = WRITER_BATCH_SIZE, flush_interval: float = WRITER_FLUSH_SECONDS,
+                 max_pending: int = WRITER_MAX_PENDING, max_retries: int = WRITER_MAX_RETRIES,
+                 dead_letter_path: str = WRITER_DEAD_LETTER_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self._pending = deque()
+        # (rows, failed attempts) of the batch to retry before any new rows
+        self._retry = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="signal-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, rows: list):
+        """Queue signal row dicts (see db.write_signals) for insertion; never blocks on the database."""
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            self._pending.extend(rows)
+            overflow = len(self._pending) - self.max_pending
+            for _ in range(max(overflow, 0)):
+                self._pending.popleft()
+                self.dropped += 1
+            if overflow > 0:
+                logging.warning("Signal writer backlog full, dropped %d rows", overflow)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._pending) + (len(self._retry[0]) if self._retry is not None else 0)
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            n = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _write(self, rows: list, attempts: int = 0):
+        try:
+            with stage("db_write"), session_scope() as db:
+                # executemany-style bulk insert, no ORM objects; also refreshes latest_signals
+                write_signals(db, rows)
+            self.written += len(rows)
+        except Exception:
+            self.failed_flushes += 1
+            attempts += 1
+            if attempts >= self.max_retries:
+                logging.exception("Signal writer flush of %d rows failed %d times, dropping them", len(rows), attempts)
+                self._drop(rows)
+                return
+            logging.exception("Signal writer flush of %d rows failed (attempt %d of %d)",
+                              len(rows), attempts, self.max_retries)
+            self._retry = (rows, attempts)
+            raise
+
+    def _drop(self, rows: list):
+        self.dropped += len(rows)
+        logging.error("Signal writer dropped rows: %s",
+                      ", ".join(f"{row.get('symbol')}@{row.get('timestamp')}" for row in rows))
+        if not self.dead_letter_path:
+            return
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+        except OSError:
+            logging.exception("Signal writer could not write %s", self.dead_letter_path)
+
+    def flush(self):
+        """Write every pending row now (a batch that failed before goes first)."""
+        with self._flush_lock:
+            if self._retry is not None:
+                rows, attempts = self._retry
+                self._retry = None
+                self._write(rows, attempts)
+            while True:
+                rows = self._take_batch()
+                if not rows:
+                    return
+                self._write(rows)
+
+    def _backoff(self) -> float:
+        attempts = self._retry[1] if self._retry is not None else 1
+        return self.flush_interval * 2 ** (attempts - 1)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                if stopping:
+                    return
+                # Back off before retrying a failing database
+                with self._cond:
+                    self._cond.wait(self._backoff())
+            if stopping:
+                return
+
+    def close(self, timeout: float = 30):
+        """Stop the writer thread after a final flush; rows that still can't be written are dropped."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+        if self.pending():
+            try:
+                self.flush()
+            except Exception:
+                # Logged by _write; don't let an unreachable database break shutdown
+                with self._cond:
+                    lost = list(self._retry[0]) if self._retry is not None else []
+                    lost.extend(self._pending)
+                    self._retry = None
+                    self._pending.clear()
+                logging.error("Signal writer closed with the database unavailable")
+                self._drop(lost)
+
+
+writer = SignalWriter()
+atexit.register(writer.close)
@@ -1,22 +1,43 @@
 # SignalR server using signalrcore for real-time updates
 from signalrcore.async_signalr_core import AsyncHubConnectionBuilder
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from backplane import create_backplane
+from data_providers import to_ticker
 import asyncio
-
-app = FastAPI()
+import json
 
 # Placeholder: This would be run as a separate process or thread
 # In production, use Azure SignalR Service and proper authentication
 
 class SignalRManager:
-    def __init__(self):
+    # Publishes through the same backplane as the WebSocket fan-out, so hub
+    # connections on every process receive each signal
+    def __init__(self, backplane=None):
         self.connections = []
+        self.backplane = backplane or create_backplane()
+        self.backplane.attach(self._deliver)
 
-    async def broadcast_signal(self, signal_data):
+    def _deliver(self, symbol, text):
         for conn in self.connections:
-            await conn.send("signalUpdate", [signal_data])
+            asyncio.ensure_future(conn.send("signalUpdate", [json.loads(text)]))
+
+    async def broadcast_signal(self, signal_data):
+        # Keyed by ticker like FanoutManager.broadcast, so both reach the same subscribers
+        symbol = signal_data.get("symbol")
+        ticker = to_ticker(symbol.upper()) if symbol else None
+        self.backplane.publish(ticker, json.dumps(signal_data, default=str))
 
 signalr_manager = SignalRManager()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect to the other workers before any broadcast, disconnect on shutdown
+    await signalr_manager.backplane.start()
+    yield
+    await signalr_manager.backplane.close()
+
+app = FastAPI(lifespan=lifespan)
+
 # Example usage:
 # await signalr_manager.broadcast_signal({"symbol": "CBA", "buy_signal": True, ...})
@@ -1,88 +1,85 @@
-import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
-from sklearn.model_selection import GridSearchCV, train_test_split
-from sklearn.metrics import accuracy_score
+import argparse
 import joblib
 import os
-import subprocess
 
-# Load your historical price data here (CSV, DB, or API)
-# For demo, we'll expect a CSV file with all features already computed
-DATA_PATH = 'training_data.csv'  # You must generate this file with your feature engineering pipeline
-MODEL_PATH = 'best_model.pkl'
+from model_registry import MODEL_PATH, compiled_path, file_sha256
+from model_search import STRATEGIES, default_candidates, walk_forward_folds, write_report, EMBARGO_DAYS
+from training_dataset import DATASET_PATH, load_dataset
 
-# Always fetch new data before training
-subprocess.run(['python', 'generate_training_data.py'], check=True)
+# Binary dataset written by generate_training_data.py (see training_dataset.py);
+# both paths honour TRAINING_DATASET_PATH / MODEL_PATH, whatever the working directory
+DATA_PATH = DATASET_PATH
+# Fit time, inference latency and score of every evaluated candidate, next to the model
+REPORT_PATH = os.getenv('MODEL_SEARCH_REPORT_PATH',
+                        os.path.join(os.path.dirname(os.path.abspath(MODEL_PATH)), 'model_search_report.json'))
 
-# Load data
-df = pd.read_csv(DATA_PATH)
+parser = argparse.ArgumentParser(description="Search for and train the signal model")
+parser.add_argument('--search', choices=sorted(STRATEGIES), default='halving', help="hyperparameter search strategy")
+parser.add_argument('--budget-seconds', type=float, default=None, help="wall-clock budget for the search")
+parser.add_argument('--folds', type=int, default=3, help="walk-forward validation folds")
+parser.add_argument('--latency-penalty', type=float, default=0.0,
+                    help="accuracy given up per millisecond of single-row inference when ranking candidates")
+parser.add_argument('--skip-data', action='store_true', help="train on the existing dataset without refreshing it")
+parser.add_argument('--labels', default=None,
+                    help="stored label set to train on, e.g. barrier_h10_t2 (default: the 5-day +-3%% labels)")
+args = parser.parse_args()
 
-# Replace infinity values with NA and drop rows with NA
-df.replace([float('inf'), float('-inf')], pd.NA, inplace=True)
-df = df.dropna()
+# Always fetch new data before training; only bars since the last run are
+# processed (a full build happens when no dataset exists yet)
+if not args.skip_data:
+    import generate_training_data
+    generate_training_data.main(['--incremental'])
 
-# Features and label
-feature_cols = [
-    'pct_change', 'ma_5', 'ma_10', 'ma_20', 'ma_50',
-    'bb_upper', 'bb_lower', 'rsi', 'vol_pct_change', 'ma_diff'
-]
-y = df['label']
-# Ensure all features are float
-X = df[feature_cols].astype(float)
-y = df['label']
-# For XGBoost, map labels: -1 -> 0, 0 -> 1, 1 -> 2
-y_xgb = y.map({-1: 0, 0: 1, 1: 2})
+# Load data: memory-mapped float32 features and int8 labels, no text parsing.
+# Non-finite rows were already dropped when the dataset was written.
+dataset = load_dataset(DATA_PATH)
+if args.labels is not None and args.labels not in dataset.label_sets:
+    parser.error(f"unknown label set '{args.labels}'; available: {', '.join(sorted(dataset.label_sets)) or 'none'}")
+rows = dataset.labeled_rows(args.labels)
+dates = np.asarray(dataset.dates)[rows]
+# Labels look `horizon` bars ahead, so that is how far training must stay from validation
+embargo_days = dataset.label_sets[args.labels]['horizon'] if args.labels else EMBARGO_DAYS
+# Time-ordered split: the most recent 20% of trading days is the test set, and
+# training stops embargo_days earlier so no training label looks into it
+days = np.unique(dates)
+test_start = days[int(len(days) * 0.8)]
+embargo_start = days[max(int(len(days) * 0.8) - embargo_days, 0)]
+train_idx = rows[dates < embargo_start]
+test_idx = rows[dates >= test_start]
+X_train, X_test = dataset.X[train_idx], dataset.X[test_idx]
+y = np.asarray(dataset.labels(args.labels))
+y_train, y_test = y[train_idx], y[test_idx]
+train_dates = dates[dates < embargo_start]
 
-# Split data
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+# Candidates are ranked on walk-forward folds within the training period
+folds = walk_forward_folds(train_dates, n_folds=args.folds, embargo_days=embargo_days)
+search = STRATEGIES[args.search](budget_seconds=args.budget_seconds, latency_penalty=args.latency_penalty)
+print(f'Searching {len(default_candidates())} candidates with {search.name} over {len(folds)} walk-forward folds...')
+best = search.run(default_candidates(), X_train, y_train, folds, train_dates, embargo_days)
 
-# Define models and parameter grids
-models = {
-    'RandomForest': (RandomForestClassifier(), {
-        'n_estimators': [50, 100],
-        'max_depth': [3, 5, 10],
-        'min_samples_split': [2, 5]
-    }),
-    'XGBoost': (XGBClassifier(eval_metric='logloss', use_label_encoder=False), {
-        'n_estimators': [50, 100],
-        'max_depth': [3, 5, 10],
-        'learning_rate': [0.01, 0.1]
-    })
-}
-
-best_score = 0
-best_model = None
-best_name = ''
-
-for name, (model, params) in models.items():
-    print(f'Training {name}...')
-    # Use mapped labels for XGBoost, original for RandomForest
-    if name == 'XGBoost':
-        grid = GridSearchCV(model, params, cv=3, scoring='accuracy', n_jobs=-1)
-        grid.fit(X_train, y_xgb.loc[X_train.index])
-    else:
-        grid = GridSearchCV(model, params, cv=3, scoring='accuracy', n_jobs=-1)
-        grid.fit(X_train, y_train)
-    score = grid.best_score_
-    print(f'{name} best CV score: {score:.4f}')
-    if score > best_score:
-        best_score = score
-        best_model = grid.best_estimator_
-        best_name = name
-
-# Evaluate on test set
-if best_model is not None:
-    # For XGBoost, map test labels as well
-    if best_name == 'XGBoost':
-        y_test_eval = y_xgb.loc[X_test.index]
-    else:
-        y_test_eval = y_test
-    y_pred = best_model.predict(X_test)
-    acc = accuracy_score(y_test_eval, y_pred)
-    print(f'Best model: {best_name} | Test accuracy: {acc:.4f}')
-    joblib.dump(best_model, MODEL_PATH)
+# Refit the winner on the whole training period and evaluate on the held-out test period
+if best is not None:
+    candidate, resource = best
+    best_model = candidate.fit(X_train, y_train, resource, train_dates, embargo_days)
+    acc = candidate.score(best_model, X_test, y_test)
+    print(f'Best model: {candidate.name} trees={resource} | Test accuracy: {acc:.4f}')
+    write_report(REPORT_PATH, search, best, {'test_accuracy': acc, 'train_rows': len(train_idx), 'test_rows': len(test_idx),
+                                             'labels': args.labels or 'default'})
+    print(f'Search report saved to {REPORT_PATH}')
+    # Write to a temp file and rename so serving processes never load a partial file
+    tmp_path = MODEL_PATH + '.tmp'
+    joblib.dump(best_model, tmp_path)
+    # Export the flattened ensemble for ml_model first, tagged with the model file it
+    # belongs to: the registry reloads when MODEL_PATH changes and finds it in place
+    try:
+        from tree_ensemble import compile_model
+        compile_model(best_model).save(compiled_path(MODEL_PATH) + '.tmp', model_sha256=file_sha256(tmp_path))
+        os.replace(compiled_path(MODEL_PATH) + '.tmp', compiled_path(MODEL_PATH))
+        print(f'Compiled predictor saved to {compiled_path(MODEL_PATH)}')
+    except ValueError as e:
+        print(f'Compiled predictor not exported: {e}')
+    os.replace(tmp_path, MODEL_PATH)
     print(f'Model saved to {MODEL_PATH}')
 else:
     print('No model trained.')
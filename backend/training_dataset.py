@@ -0,0 +1,241 @@
+# Binary, memory-mapped training dataset
+# generate_training_data.py streams each symbol's rows into raw column files
+# (float32 feature matrix, int8 labels, int16 symbol ids, int64 dates) and
+# train_model.py memory-maps them. meta.json is written last and holds the
+# committed row count, so readers never see a partially written chunk.
+# Extra label sets (see labels.py) live in label_sets/<name>.i1, one int8 per row.
+import json
+import os
+
+import numpy as np
+
+from features import FEATURE_COLS
+
+DATASET_PATH = os.getenv("TRAINING_DATASET_PATH", os.path.join(os.path.dirname(__file__), 'training_data'))
+
+FILES = {
+    'features': ('features.f32', np.dtype('<f4')),
+    'labels': ('labels.i1', np.dtype('i1')),
+    'symbol_ids': ('symbol_ids.i2', np.dtype('<i2')),
+    'dates': ('dates.i8', np.dtype('<i8')),
+}
+# Label of a row whose lookahead window has not closed yet
+LABEL_PENDING = -128
+LABEL_SETS_DIR = 'label_sets'
+
+
+def _label_set_file(path: str, name: str) -> str:
+    return os.path.join(path, LABEL_SETS_DIR, name + '.i1')
+
+
+def _read_meta(path: str) -> dict:
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def _write_meta(path: str, meta: dict):
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+
+def exists(path: str = DATASET_PATH) -> bool:
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+class Dataset:
+    """Memory-mapped view over a training dataset; slicing does not copy."""
+
+    def __init__(self, path: str = DATASET_PATH):
+        self.path = path
+        meta = _read_meta(path)
+        self.meta = meta
+        self.columns = meta['columns']
+        self.symbols = meta['symbols']
+        self.rows = meta['rows']
+        # name -> {"kind", "horizon", "threshold"}
+        self.label_sets = meta.get('label_sets', {})
+        shapes = {'features': (self.rows, len(self.columns))}
+        self._arrays = {}
+        for name, (filename, dtype) in FILES.items():
+            shape = shapes.get(name, (self.rows,))
+            if self.rows == 0:
+                self._arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(os.path.join(path, filename), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def X(self):
+        return self._arrays['features']
+
+    @property
+    def y(self):
+        return self._arrays['labels']
+
+    @property
+    def symbol_ids(self):
+        return self._arrays['symbol_ids']
+
+    @property
+    def dates(self):
+        return self._arrays['dates']
+
+    def symbol_of(self, i: int) -> str:
+        return self.symbols[int(self.symbol_ids[i])]
+
+    def labels(self, name: str = None):
+        """The default labels, or the stored label set `name`."""
+        if name is None:
+            return self.y
+        if name not in self.label_sets:
+            raise KeyError(f"No label set '{name}' in {self.path}; available: {sorted(self.label_sets)}")
+        if name not in self._arrays:
+            self._arrays[name] = (np.memmap(_label_set_file(self.path, name), dtype=np.int8, mode='r',
+                                            shape=(self.rows,)) if self.rows else np.empty(0, dtype=np.int8))
+        return self._arrays[name]
+
+    def labeled_rows(self, name: str = None) -> np.ndarray:
+        """Indices of rows whose label (in label set `name`) has resolved."""
+        return np.flatnonzero(np.asarray(self.labels(name)) != LABEL_PENDING)
+
+
+class DatasetWriter:
+    """Streams chunks of rows to disk; memory use is bounded by the largest chunk.
+
+    With append=True, rows are added to the existing dataset in place and
+    pending labels can be resolved; otherwise a new dataset replaces it on close().
+    label_specs names the extra label sets every append() provides (see labels.py).
+    """
+
+    def __init__(self, path: str = DATASET_PATH, columns=FEATURE_COLS, append: bool = False, label_specs=None):
+        self.path = path
+        self.append_mode = append and exists(path)
+        label_specs = dict(label_specs or {})
+        if self.append_mode:
+            meta = _read_meta(path)
+            if meta['columns'] != list(columns):
+                raise ValueError(f"Dataset columns {meta['columns']} do not match {list(columns)}")
+            if meta.get('label_sets', {}) != label_specs:
+                raise ValueError(f"Dataset label sets {sorted(meta.get('label_sets', {}))} do not match {sorted(label_specs)}")
+            self._dir = path
+        else:
+            meta = {"rows": 0, "symbols": []}
+            # Write into a sibling directory and swap it in on close()
+            self._dir = path + '.tmp'
+            if os.path.isdir(self._dir):
+                import shutil
+                shutil.rmtree(self._dir)
+            os.makedirs(os.path.join(self._dir, LABEL_SETS_DIR))
+        self.label_specs = label_specs
+        self.columns = list(columns)
+        self.symbols = meta['symbols']
+        self.rows = meta['rows']
+        self.committed_rows = self.rows
+        # Last bar date written per symbol and rows still waiting for a label
+        self.last_dates = meta.get('last_dates', {})
+        self.pending = meta.get('pending', {})
+        self._files = {}
+        paths = {name: (os.path.join(self._dir, filename), dtype) for name, (filename, dtype) in FILES.items()}
+        self._label_files = {}
+        for name in self.label_specs:
+            paths['label_set:' + name] = (_label_set_file(self._dir, name), np.dtype('i1'))
+        for name, (filepath, dtype) in paths.items():
+            if self.append_mode:
+                f = open(filepath, 'r+b')
+                # Drop bytes left behind by an interrupted run after the committed rows
+                width = len(self.columns) if name == 'features' else 1
+                f.truncate(self.rows * width * dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+            else:
+                f = open(filepath, 'wb')
+            if name.startswith('label_set:'):
+                self._label_files[name[len('label_set:'):]] = f
+            else:
+                self._files[name] = f
+
+    def append(self, symbol: str, dates, X, labels, label_sets: dict = None):
+        """Append one chunk; rows with non-finite features are dropped. Returns rows written.
+
+        label_sets maps every name in label_specs to labels aligned with X.
+        """
+        dates = np.asarray(dates, dtype='datetime64[s]').astype(np.int64)
+        if len(dates):
+            self.last_dates[symbol] = int(dates.max())
+        X = np.asarray(X, dtype=np.float32)
+        keep = np.isfinite(X).all(axis=1)
+        if not keep.any():
+            return 0
+        if symbol not in self.symbols:
+            self.symbols.append(symbol)
+        n = int(keep.sum())
+        labels = np.asarray(labels)[keep]
+        chunks = {
+            'features': X[keep],
+            'labels': labels,
+            'symbol_ids': np.full(n, self.symbols.index(symbol)),
+            'dates': dates[keep],
+        }
+        for name, (_, dtype) in FILES.items():
+            self._files[name].write(np.ascontiguousarray(chunks[name], dtype=dtype).tobytes())
+        pending = labels == LABEL_PENDING
+        for name, f in self._label_files.items():
+            values = np.asarray(label_sets[name], dtype=np.int8)[keep]
+            f.write(values.tobytes())
+            pending |= values == LABEL_PENDING
+        # A row stays pending until every one of its labels has resolved
+        pending_rows = self.rows + np.flatnonzero(pending)
+        if len(pending_rows):
+            self.pending.setdefault(symbol, []).extend(int(i) for i in pending_rows)
+        self.rows += n
+        return n
+
+    def pending_rows(self, symbol: str):
+        """(row indices, bar dates) of the symbol's committed rows still waiting for a label."""
+        rows = np.array([i for i in self.pending.get(symbol, []) if i < self.committed_rows], dtype=np.int64)
+        if not len(rows):
+            return rows, rows
+        dates = np.memmap(os.path.join(self._dir, FILES['dates'][0]), dtype=FILES['dates'][1],
+                          mode='r', shape=(self.committed_rows,))
+        return rows, np.asarray(dates[rows])
+
+    def resolve_labels(self, symbol: str, rows, labels, label_sets: dict = None):
+        """Overwrite pending labels of committed rows in place. Returns rows now fully labeled."""
+        rows = np.asarray(rows, dtype=np.int64)
+        arrays = {os.path.join(self._dir, FILES['labels'][0]): np.asarray(labels, dtype=np.int8)}
+        for name in self.label_specs:
+            arrays[_label_set_file(self._dir, name)] = np.asarray(label_sets[name], dtype=np.int8)
+        still_pending = np.zeros(len(rows), dtype=bool)
+        for filepath, values in arrays.items():
+            resolved = values != LABEL_PENDING
+            still_pending |= ~resolved
+            if resolved.any():
+                mm = np.memmap(filepath, dtype=np.int8, mode='r+', shape=(self.committed_rows,))
+                mm[rows[resolved]] = values[resolved]
+                mm.flush()
+        done = set(rows[~still_pending].tolist())
+        self.pending[symbol] = [i for i in self.pending.get(symbol, []) if i not in done]
+        return len(done)
+
+    def close(self):
+        for f in list(self._files.values()) + list(self._label_files.values()):
+            f.close()
+        _write_meta(self._dir, {
+            "columns": self.columns,
+            "symbols": self.symbols,
+            "rows": self.rows,
+            "label_sets": self.label_specs,
+            "last_dates": self.last_dates,
+            "pending": {s: rows for s, rows in self.pending.items() if rows},
+        })
+        if not self.append_mode:
+            if os.path.isdir(self.path):
+                import shutil
+                shutil.rmtree(self.path)
+            os.replace(self._dir, self.path)
+
+
+def load_dataset(path: str = DATASET_PATH) -> Dataset:
+    return Dataset(path)
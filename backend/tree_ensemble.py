@@ -0,0 +1,236 @@
+# Compiled tree-ensemble predictor
+# A fitted RandomForestClassifier or XGBClassifier is flattened into plain
+# arrays (node feature, threshold, children, missing-value direction and leaf
+# values) and evaluated with NumPy: every row walks every tree one level per
+# step, so a single row costs a handful of array ops instead of a round trip
+# through sklearn/xgboost input validation and thread dispatch.
+import json
+import time
+
+import numpy as np
+
+# Stored next to best_model.pkl by train_model.py
+FORMAT_VERSION = 1
+
+
+class CompiledEnsemble:
+    """Flattened trees. Leaves point to themselves, so walking past a leaf stays on it.
+
+    kind 'mean': leaf_values are per-tree class probabilities, averaged over trees.
+    kind 'softmax': leaf_values are margins added to base_margin for the tree's class.
+    """
+
+    def __init__(self, kind, feature, threshold, left, right, default_left, leaf_values,
+                 roots, tree_class, base_margin, depth, strict: bool, source: str = ''):
+        self.kind = kind
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.leaf_values = np.asarray(leaf_values, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_class = np.asarray(tree_class, dtype=np.int32)
+        self.base_margin = np.asarray(base_margin, dtype=np.float64)
+        self.depth = int(depth)
+        # xgboost sends x < threshold left, sklearn x <= threshold
+        self.strict = bool(strict)
+        self.source = source
+        self.n_classes = len(self.base_margin)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, X) -> np.ndarray:
+        """(n_rows, n_trees) leaf node reached by every row in every tree."""
+        # Both libraries compare float32 features against the stored thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), self.n_trees))
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            thr = self.threshold[node]
+            go_left = x < thr if self.strict else x <= thr
+            go_left = np.where(np.isnan(x), self.default_left[node], go_left)
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X) -> np.ndarray:
+        node = self.leaves(X)
+        values = self.leaf_values[node]
+        if self.kind == 'mean':
+            return values.mean(axis=1)
+        # Sum each tree's margin into its class, then softmax
+        margin = np.tile(self.base_margin, (len(node), 1))
+        for c in range(self.n_classes):
+            margin[:, c] += values[:, self.tree_class == c, 0].sum(axis=1)
+        margin -= margin.max(axis=1, keepdims=True)
+        e = np.exp(margin)
+        return e / e.sum(axis=1, keepdims=True)
+
+    # --- Persistence ---
+    def save(self, path: str, **meta):
+        # np.savez appends .npz to names without it, so write through a file object
+        with open(path, 'wb') as f:
+            np.savez(f, kind=self.kind, feature=self.feature, threshold=self.threshold, left=self.left,
+                     right=self.right, default_left=self.default_left, leaf_values=self.leaf_values,
+                     roots=self.roots, tree_class=self.tree_class, base_margin=self.base_margin,
+                     depth=self.depth, strict=self.strict, source=self.source,
+                     meta=json.dumps({"format_version": FORMAT_VERSION, **meta}))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('format_version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported compiled model format {meta.get('format_version')}")
+            compiled = cls(str(data['kind']), data['feature'], data['threshold'], data['left'], data['right'],
+                           data['default_left'], data['leaf_values'], data['roots'], data['tree_class'],
+                           data['base_margin'], int(data['depth']), bool(data['strict']), str(data['source']))
+        compiled.meta = meta
+        return compiled
+
+
+def _self_loop_leaves(left, right, feature, threshold):
+    """Point leaves (child -1) at themselves with a harmless split."""
+    idx = np.arange(len(left))
+    leaf = left < 0
+    left = np.where(leaf, idx, left)
+    right = np.where(leaf, idx, right)
+    feature = np.where(leaf, 0, feature)
+    threshold = np.where(leaf, 0.0, threshold)
+    return left, right, feature, threshold
+
+
+def _tree_depth(left, right, roots) -> int:
+    depth, node = 0, np.asarray(roots)
+    while True:
+        children = np.concatenate([left[node], right[node]])
+        children = children[children != np.concatenate([node, node])]
+        if not len(children):
+            return depth
+        depth += 1
+        node = children
+
+
+def _compile_forest(model) -> CompiledEnsemble:
+    parts, roots, offset = [], [], 0
+    for est in model.estimators_:
+        t = est.tree_
+        values = t.value[:, 0, :].astype(np.float64)
+        values = values / values.sum(axis=1, keepdims=True)
+        missing_left = getattr(t, 'missing_go_to_left', np.zeros(t.node_count, dtype=bool))
+        left = np.where(t.children_left >= 0, t.children_left + offset, -1)
+        right = np.where(t.children_right >= 0, t.children_right + offset, -1)
+        parts.append((t.feature, t.threshold, left, right, np.asarray(missing_left, dtype=bool), values))
+        roots.append(offset)
+        offset += t.node_count
+    feature, threshold, left, right, default_left, values = (np.concatenate(p) for p in zip(*parts))
+    left, right, feature, threshold = _self_loop_leaves(left, right, feature, threshold)
+    n_classes = len(model.classes_)
+    return CompiledEnsemble('mean', feature, threshold, left, right, default_left, values, roots,
+                            np.zeros(len(roots)), np.zeros(n_classes), _tree_depth(left, right, roots),
+                            strict=False, source=type(model).__name__)
+
+
+def _compile_xgboost(model) -> CompiledEnsemble:
+    booster = model.get_booster()
+    config = json.loads(booster.save_config())['learner']
+    if config['objective']['name'] not in ('multi:softprob', 'multi:softmax'):
+        raise ValueError(f"Unsupported objective {config['objective']['name']}")
+    if config['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(f"Unsupported booster {config['gradient_booster']['name']}")
+    n_classes = int(config['learner_model_param']['num_class'])
+    base = config['learner_model_param']['base_score'].strip('[]').split(',')
+    base_margin = np.broadcast_to(np.array(base, dtype=np.float32).astype(np.float64), (n_classes,))
+    gbm = json.loads(booster.save_raw('json'))['learner']['gradient_booster']['model']
+    trees, tree_info = gbm['trees'], gbm['tree_info']
+    # predict_proba stops at the best iteration when early stopping was used
+    best = getattr(model, 'best_iteration', None)
+    if best is not None:
+        per_round = len(trees) // booster.num_boosted_rounds()
+        trees, tree_info = trees[:(best + 1) * per_round], tree_info[:(best + 1) * per_round]
+    parts, roots, offset = [], [], 0
+    for tree in trees:
+        left = np.array(tree['left_children'], dtype=np.int64)
+        right = np.array(tree['right_children'], dtype=np.int64)
+        # Leaves keep their value in split_conditions
+        cond = np.array(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+        leaf = left < 0
+        parts.append((np.array(tree['split_indices']), cond, np.where(leaf, -1, left + offset),
+                      np.where(leaf, -1, right + offset), np.array(tree['default_left'], dtype=bool),
+                      np.where(leaf, cond, 0.0)[:, None]))
+        roots.append(offset)
+        offset += len(left)
+    feature, threshold, left, right, default_left, values = (np.concatenate(p) for p in zip(*parts))
+    left, right, feature, threshold = _self_loop_leaves(left, right, feature, threshold)
+    return CompiledEnsemble('softmax', feature, threshold, left, right, default_left, values, roots,
+                            tree_info, base_margin, _tree_depth(left, right, roots),
+                            strict=True, source=type(model).__name__)
+
+
+def compile_model(model) -> CompiledEnsemble:
+    """Flatten a fitted RandomForestClassifier or XGBClassifier; ValueError for anything else."""
+    name = type(model).__name__
+    if name in ('RandomForestClassifier', 'ExtraTreesClassifier'):
+        return _compile_forest(model)
+    if name == 'XGBClassifier':
+        return _compile_xgboost(model)
+    raise ValueError(f"Cannot compile {name}")
+
+
+# --- Parity and latency checks ---
+def _fixture_models(n_rows=3000, n_features=10, seed=0):
+    from sklearn.ensemble import RandomForestClassifier
+    from xgboost import XGBClassifier
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)).astype(np.float32)
+    y = np.digitize(X[:, 0] + 0.5 * X[:, 1] + rng.normal(0, 0.5, n_rows), [-0.5, 0.5]) - 1
+    rf = RandomForestClassifier(n_estimators=100, max_depth=10, random_state=seed).fit(X, y)
+    xgb = XGBClassifier(n_estimators=100, max_depth=5, learning_rate=0.1, eval_metric='mlogloss',
+                        early_stopping_rounds=10, random_state=seed)
+    xgb.fit(X[:2500], y[:2500] + 1, eval_set=[(X[2500:], y[2500:] + 1)], verbose=False)
+    X_test = rng.normal(size=(1000, n_features)).astype(np.float32)
+    X_test[rng.integers(0, 1000, 50), rng.integers(0, n_features, 50)] = np.nan
+    return {'RandomForest': rf, 'XGBoost': xgb}, X_test
+
+
+def check_parity(models=None, X=None, atol=1e-6):
+    """Compiled probabilities match predict_proba, including rows with missing features."""
+    if models is None:
+        models, X = _fixture_models()
+    for name, model in models.items():
+        compiled = compile_model(model)
+        np.testing.assert_allclose(compiled.predict_proba(X), model.predict_proba(X), atol=atol, err_msg=name)
+        np.testing.assert_allclose(compiled.predict_proba(X[:1]), model.predict_proba(X[:1]), atol=atol, err_msg=name)
+    return True
+
+
+def benchmark(models=None, X=None, repeats=200) -> dict:
+    """Median seconds per predict_proba call, library vs compiled, for one row and a batch."""
+    if models is None:
+        models, X = _fixture_models()
+    results = {}
+    for name, model in models.items():
+        compiled = compile_model(model)
+        for label, rows in (('single_row', X[:1]), ('batch_%d' % len(X), X)):
+            for impl, fn in (('library', model.predict_proba), ('compiled', compiled.predict_proba)):
+                n = repeats if len(rows) == 1 else max(repeats // 20, 3)
+                timings = []
+                for _ in range(n):
+                    started = time.perf_counter()
+                    fn(rows)
+                    timings.append(time.perf_counter() - started)
+                results.setdefault(name, {}).setdefault(label, {})[impl] = float(np.median(timings))
+    return results
+
+
+if __name__ == "__main__":
+    models, X = _fixture_models()
+    check_parity(models, X)
+    print("Compiled probabilities match predict_proba.")
+    for name, cases in benchmark(models, X).items():
+        for label, t in cases.items():
+            print(f"{name} {label}: library {t['library'] * 1e3:.3f}ms, compiled {t['compiled'] * 1e3:.3f}ms "
+                  f"({t['library'] / t['compiled']:.1f}x)")
@@ -0,0 +1,134 @@
+# Startup warm-up
+# Started from the FastAPI lifespan so the first requests on a new worker don't
+# pay for heavy imports, unpickling the model or creating tables. /ready
+# reports 503 until every step has run, with the time each one took.
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import gauge
+
+# Also refresh bars and compute features for every symbol in asx_symbols.json
+WARMUP_PREFETCH = os.getenv("WARMUP_PREFETCH", "0") == "1"
+WARMUP_PREFETCH_WORKERS = int(os.getenv("WARMUP_PREFETCH_WORKERS", "8"))
+
+# Imported up front; optional ones may be missing from a slim deployment
+HEAVY_MODULES = ("numpy", "pandas", "joblib", "sklearn.ensemble", "features", "ml_model", "tree_ensemble")
+OPTIONAL_MODULES = ("xgboost", "yfinance")
+
+
+def _import_modules() -> str:
+    import importlib
+    missing = []
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    for name in OPTIONAL_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            missing.append(name)
+    return f"missing optional: {', '.join(missing)}" if missing else None
+
+
+def _create_tables() -> str:
+    from db import Base, engine, ensure_indexes
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    return None
+
+
+def _warm_model() -> str:
+    import numpy as np
+    from features import FEATURE_COLS
+    from model_registry import registry
+    loaded = registry.reload()
+    if loaded is None:
+        return "no model file; predictions use the ma_diff fallback"
+    # One single-row and one batched prediction exercise both predictor paths
+    X = np.zeros((2, len(FEATURE_COLS)))
+    loaded.predict_label(X[:1])
+    loaded.predict_label(X)
+    return f"model {loaded.version}" + (" (compiled)" if loaded.compiled is not None else "")
+
+
+def _prefetch(symbols=None) -> str:
+    from bar_store import store
+    from data_providers import load_asx_symbols
+    from features import WARMUP_BARS
+    from ml_model import predict_buy_sell_batch
+    symbols = list(dict.fromkeys(symbols or load_asx_symbols()))
+    start = datetime.date.today() - datetime.timedelta(days=365)
+
+    def fetch(symbol):
+        try:
+            return symbol, store.get_bars(symbol, start=start).tail(WARMUP_BARS + 1)
+        except Exception:
+            return symbol, None
+
+    with ThreadPoolExecutor(max_workers=WARMUP_PREFETCH_WORKERS) as pool:
+        bars = {symbol: b for symbol, b in pool.map(fetch, symbols) if b is not None and not b.empty}
+    # Feature rows and one batched prediction for every symbol; nothing is stored
+    predict_buy_sell_batch({s: (b.close, b.volume, b.timestamp) for s, b in bars.items()})
+    return f"{len(bars)}/{len(symbols)} symbols"
+
+
+class Warmup:
+    # (name, function, required): a failed required step keeps the worker not ready
+    STEPS = (
+        ("imports", _import_modules, True),
+        ("tables", _create_tables, True),
+        ("model", _warm_model, False),
+    )
+
+    def __init__(self, prefetch: bool = WARMUP_PREFETCH):
+        self.prefetch = prefetch
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.done and all(step["status"] != "failed" or not step["required"] for step in list(self.steps.values()))
+
+    def run(self):
+        """Run every step in order (blocking); errors are recorded, not raised."""
+        self.started_at = time.time()
+        steps = list(self.STEPS)
+        if self.prefetch:
+            steps.append(("prefetch", _prefetch, False))
+        for name, fn, required in steps:
+            self.steps[name] = {"status": "running", "required": required, "seconds": None, "detail": None}
+            started = time.perf_counter()
+            try:
+                detail, status = fn(), "ok"
+            except Exception as e:
+                logging.exception("Warm-up step %s failed", name)
+                detail, status = f"{type(e).__name__}: {e}", "failed"
+            self.steps[name].update(status=status, seconds=round(time.perf_counter() - started, 4), detail=detail)
+        self.finished_at = time.time()
+        logging.info("Warm-up finished in %.2fs, ready=%s", self.finished_at - self.started_at, self.ready)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "done": self.done,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": round((self.finished_at or time.time()) - self.started_at, 4) if self.started_at else None,
+            # Copies: run() updates the steps from the warm-up thread
+            "steps": {name: dict(step) for name, step in list(self.steps.items())},
+        }
+
+
+warmup = Warmup()
+
+gauge("anystock_ready", "1 once warm-up has completed successfully", lambda: int(warmup.ready))
+gauge("anystock_warmup_step_seconds", "Time taken by each warm-up step",
+      lambda: {name: step["seconds"] for name, step in list(warmup.steps.items()) if step["seconds"] is not None},
+      labelname="step")
@@ -0,0 +1,230 @@
+# Non-blocking WebSocket fan-out
+# Each message is serialized once and pushed onto a bounded per-client queue;
+# every client has its own sender task, so a slow or dead socket only delays
+# itself and is evicted once a send stalls. Broadcasts go through a backplane
+# (see backplane.py) so clients on every worker receive them.
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+
+from fastapi import WebSocket
+
+from backplane import Backplane
+from data_providers import to_ticker
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+# 'drop_oldest' keeps the newest WS_QUEUE_SIZE messages; 'coalesce_latest'
+# keeps only the latest pending message per symbol
+WS_QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY", "coalesce_latest")
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, max_queue: int = WS_QUEUE_SIZE,
+                 policy: str = WS_QUEUE_POLICY, send_timeout: float = WS_SEND_TIMEOUT):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.symbols = None  # None means every symbol
+        self.excluded = set()  # tickers a wildcard client unsubscribed from
+        self.dropped = 0
+        self.closed = False
+        self._pending = OrderedDict() if policy == 'coalesce_latest' else deque()
+        self._wakeup = asyncio.Event()
+        self._sender = None
+
+    def enqueue(self, key: str, text: str):
+        """Queue a serialized message without blocking."""
+        if self.closed:
+            return
+        if self.policy == 'coalesce_latest':
+            if key in self._pending:
+                self.dropped += 1
+                del self._pending[key]
+            self._pending[key] = text
+            if len(self._pending) > self.max_queue:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+        else:
+            if len(self._pending) >= self.max_queue:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append(text)
+        self._wakeup.set()
+
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def _pop(self) -> str:
+        if self.policy == 'coalesce_latest':
+            return self._pending.popitem(last=False)[1]
+        return self._pending.popleft()
+
+    async def run_sender(self, on_evict):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._pending and not self.closed:
+                    await asyncio.wait_for(self.websocket.send_text(self._pop()), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Stalled (timeout) or broken socket: evict it
+            logging.info("Evicting WebSocket client: %r", e)
+            await on_evict(self)
+
+    def start(self, on_evict):
+        self._sender = asyncio.get_running_loop().create_task(self.run_sender(on_evict))
+
+    async def close(self):
+        self.closed = True
+        self._pending.clear()
+        self._wakeup.set()
+        if self._sender is not None and self._sender is not asyncio.current_task():
+            self._sender.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
+class FanoutManager:
+    def __init__(self, backplane: Backplane = None, **client_options):
+        self.backplane = backplane or Backplane()
+        self.backplane.attach(self.deliver)
+        self.client_options = client_options
+        self.clients = set()
+        # Subscription index: ticker -> clients; wildcard clients get every symbol
+        # except the ones they unsubscribed from (excluded_by_symbol)
+        self.by_symbol = {}
+        self.wildcard = set()
+        self.excluded_by_symbol = {}
+        self.evicted = 0
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket, symbols=None) -> ClientConnection:
+        await websocket.accept()
+        client = ClientConnection(websocket, **self.client_options)
+        self.clients.add(client)
+        self.subscribe(client, symbols)
+        client.start(self._evict)
+        return client
+
+    def disconnect(self, client: ClientConnection):
+        self._unindex(client)
+        self.clients.discard(client)
+        client.closed = True
+        if client._sender is not None and client._sender is not asyncio.current_task():
+            client._sender.cancel()
+
+    async def _evict(self, client: ClientConnection):
+        if client in self.clients:
+            self.evicted += 1
+        self.disconnect(client)
+        await client.close()
+
+    @staticmethod
+    def _remove(index: dict, tickers, client: ClientConnection):
+        for ticker in tickers:
+            clients = index.get(ticker)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del index[ticker]
+
+    def _unindex(self, client: ClientConnection):
+        self.wildcard.discard(client)
+        self._remove(self.by_symbol, client.symbols or (), client)
+        self._remove(self.excluded_by_symbol, client.excluded, client)
+
+    @staticmethod
+    def _tickers(symbols) -> set:
+        return {to_ticker(s.strip().upper()) for s in symbols if s.strip()}
+
+    def subscribe(self, client: ClientConnection, symbols=None, excluded=()):
+        """Replace the client's subscriptions; None subscribes to every symbol except `excluded`."""
+        self._unindex(client)
+        if symbols is None:
+            client.symbols = None
+            client.excluded = self._tickers(excluded)
+            self.wildcard.add(client)
+            for ticker in client.excluded:
+                self.excluded_by_symbol.setdefault(ticker, set()).add(client)
+            return
+        client.symbols = self._tickers(symbols)
+        client.excluded = set()
+        for ticker in client.symbols:
+            self.by_symbol.setdefault(ticker, set()).add(client)
+
+    def unsubscribe(self, client: ClientConnection, symbols):
+        """Stop sending the symbols; a wildcard client keeps every other symbol."""
+        tickers = self._tickers(symbols)
+        if client.symbols is None:
+            self.subscribe(client, None, client.excluded | tickers)
+        else:
+            self.subscribe(client, client.symbols - tickers)
+
+    def _reject(self, client: ClientConnection, detail: str):
+        client.enqueue("error", json.dumps({"error": detail}, separators=(",", ":")))
+
+    def handle_message(self, client: ClientConnection, text: str):
+        """Apply a client control message such as {"action": "subscribe", "symbols": ["CBA"]}.
+
+        Subscribing adds to the client's symbols (a wildcard client already gets
+        every symbol, so it only lifts earlier unsubscribes). Invalid messages get
+        an {"error": ...} reply and change nothing.
+        """
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return  # keep-alive or other plain text
+        if not isinstance(message, dict):
+            return
+        action = message.get("action")
+        if action == "subscribe_all":
+            self.subscribe(client, None)
+            return
+        if action not in ("subscribe", "unsubscribe"):
+            self._reject(client, f"unknown action {action!r}; expected subscribe, unsubscribe or subscribe_all")
+            return
+        symbols = message.get("symbols")
+        if not isinstance(symbols, list) or not all(isinstance(s, str) for s in symbols):
+            self._reject(client, "symbols must be a list of strings")
+            return
+        try:
+            self._tickers(symbols)
+        except ValueError as e:
+            self._reject(client, str(e))
+            return
+        if action == "unsubscribe":
+            self.unsubscribe(client, symbols)
+        elif client.symbols is None:
+            self.subscribe(client, None, client.excluded - self._tickers(symbols))
+        else:
+            self.subscribe(client, client.symbols | self._tickers(symbols))
+
+    def broadcast(self, message: dict):
+        """Serialize once and publish to the subscribed clients of every worker; never blocks."""
+        text = json.dumps(message, separators=(",", ":"), default=str)
+        symbol = message.get("symbol")
+        ticker = to_ticker(symbol.upper()) if symbol else None
+        self.backplane.publish(ticker, text)
+
+    def deliver(self, ticker, text: str):
+        """Queue a serialized message for this worker's subscribed clients."""
+        if ticker:
+            targets = (self.wildcard - self.excluded_by_symbol.get(ticker, set())) | self.by_symbol.get(ticker, set())
+        else:
+            targets = self.clients
+        for client in targets:
+            client.enqueue(ticker or "", text)
+
+    def queue_depths(self):
+        return [client.queue_depth() for client in self.clients]